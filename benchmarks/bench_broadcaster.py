@@ -0,0 +1,126 @@
+# benchmarks/bench_broadcaster.py
+"""
+Стоимость рассылки токенов по SSE: прежний Broadcaster (json.dumps и
+словарь на каждый токен, кодирование кадра отдельно для каждого клиента)
+против нового (кадр кодируется один раз, токены объединяются по окну).
+
+Генератор публикует --tokens токенов с частотой --rate токенов/с в каждый
+из --chats чатов, к каждому подключено --clients клиентов. Клиенты только
+вычитывают очередь и считают байты (как это делал бы EventSourceResponse).
+Печатаются событий/с на клиента и CPU на клиента.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_broadcaster.py --clients 200 --coalesce-ms 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.broadcaster import Broadcaster, SubscriptionClosed, encode_sse_frame  # noqa: E402
+
+
+class LegacyBroadcaster:
+    """Прежняя реализация: событие-словарь на каждый токен и await put на каждого слушателя."""
+
+    def __init__(self):
+        self._listeners = defaultdict(set)
+
+    async def subscribe(self, chat_id):
+        queue = asyncio.Queue()
+        self._listeners[chat_id].add(queue)
+        return queue
+
+    async def publish_token(self, chat_id, msg_id, token):
+        event_data = {"event": "stream_token", "data": json.dumps({"msg_id": msg_id, "token": token})}
+        for queue in self._listeners.get(chat_id, set()):
+            await queue.put(event_data)
+
+    def flush(self, chat_id):
+        pass
+
+
+async def client(queue, counters: dict, legacy: bool):
+    while True:
+        try:
+            item = await queue.get()
+        except SubscriptionClosed:
+            return
+        if item is None:
+            return
+        # sse_starlette кодирует словарь в кадр для каждого клиента, bytes отдает как есть
+        frame = encode_sse_frame(item["event"], item["data"]) if legacy else item
+        counters["events"] += 1
+        counters["bytes"] += len(frame)
+
+
+async def run_case(broadcaster, legacy: bool, args) -> dict:
+    counters = {"events": 0, "bytes": 0}
+    queues = []
+    chat_ids = []
+    clients = []
+    for chat_id in range(args.chats):
+        for _ in range(args.clients):
+            queue = await broadcaster.subscribe(chat_id)
+            queues.append(queue)
+            chat_ids.append(chat_id)
+            clients.append(asyncio.create_task(client(queue, counters, legacy)))
+
+    interval = 1.0 / args.rate
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for i in range(args.tokens):
+        for chat_id in range(args.chats):
+            await broadcaster.publish_token(chat_id, 1, f"слово{i} ")
+        await asyncio.sleep(interval)
+    for chat_id in range(args.chats):
+        broadcaster.flush(chat_id)
+    while any(not q.empty() for q in queues):
+        await asyncio.sleep(0.001)
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    for chat_id, queue in zip(chat_ids, queues):
+        if legacy:
+            queue.put_nowait(None)
+        else:
+            broadcaster.unsubscribe(chat_id, queue)
+    await asyncio.gather(*clients)
+
+    n_clients = args.chats * args.clients
+    return {
+        "events_per_client": counters["events"] / n_clients,
+        "events_per_s": counters["events"] / wall,
+        "cpu_ms_per_client": 1000 * cpu / n_clients,
+        "bytes_per_client": counters["bytes"] / n_clients,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=100, help="клиентов на чат")
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=50.0, help="токенов в секунду на чат")
+    parser.add_argument("--coalesce-ms", type=float, default=40.0)
+    args = parser.parse_args()
+
+    cases = [
+        ("legacy", LegacyBroadcaster(), True),
+        ("shared frames", Broadcaster(coalesce_ms=0), False),
+        (f"coalesce {args.coalesce_ms:g} ms", Broadcaster(coalesce_ms=args.coalesce_ms), False),
+    ]
+    print(f"{'mode':>16} {'events/client':>14} {'events/s':>10} {'CPU ms/client':>14} {'KB/client':>10}")
+    for name, broadcaster, legacy in cases:
+        r = asyncio.run(run_case(broadcaster, legacy, args))
+        print(f"{name:>16} {r['events_per_client']:>14.0f} {r['events_per_s']:>10.0f} "
+              f"{r['cpu_ms_per_client']:>14.2f} {r['bytes_per_client'] / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# benchmarks/bench_history_queries.py
+"""
+Запросы истории чата на больших таблицах: с составными индексами и без них.
+
+Для каждого размера (--sizes) создается база SQLite с сообщениями,
+перемешанными между --chats чатами (как в живой базе: сообщения одного
+чата разбросаны по таблице). Затем через репозитории замеряются запросы
+горячего пути: последняя страница, глубокая страница по курсору, контекст
+LLM, дозагрузка новых сообщений и список чатов. С --compare те же запросы
+повторяются после удаления индексов ix_messages_chat_created_id и
+ix_chats_user_created (схема до миграции 2).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_history_queries.py --sizes 10000,1000000 --compare
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from db import sqlite_pragmas  # noqa: E402
+from models import Base  # noqa: E402
+from repositories.chat_repo import ChatRepository  # noqa: E402
+from repositories.message_repo import MessageRepository  # noqa: E402
+
+INDEXES = ("ix_messages_chat_created_id", "ix_chats_user_created")
+
+
+def make_engine(path: str):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
+
+
+def seed(path: str, messages: int, chats: int, users: int) -> None:
+    conn = sqlite3.connect(path)
+    started = datetime(2024, 1, 1)
+    conn.executemany(
+        "INSERT INTO users (id, username) VALUES (?, ?)",
+        [(u + 1, f"user{u}") for u in range(users)],
+    )
+    conn.executemany(
+        "INSERT INTO chats (id, title, created_at, user_id) VALUES (?, ?, ?, ?)",
+        [(c + 1, f"Чат {c}", str(started + timedelta(minutes=c)), c % users + 1) for c in range(chats)],
+    )
+    batch = []
+    for i in range(messages):
+        chat_id = i % chats + 1
+        user_msg = (i // chats) % 2 == 0
+        batch.append((
+            f"Сообщение {i} " * 8,
+            "USER" if user_msg else "MODEL",
+            str(started + timedelta(seconds=i)),
+            chat_id,
+            (chat_id - 1) % users + 1 if user_msg else None,
+        ))
+        if len(batch) == 50000:
+            conn.executemany(
+                "INSERT INTO messages (content, message_type, created_at, chat_id, user_id) VALUES (?, ?, ?, ?, ?)",
+                batch,
+            )
+            batch = []
+    if batch:
+        conn.executemany(
+            "INSERT INTO messages (content, message_type, created_at, chat_id, user_id) VALUES (?, ?, ?, ?, ?)",
+            batch,
+        )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+async def timed(fn, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await fn()
+        samples.append(1000 * (time.perf_counter() - t0))
+    samples.sort()
+    return {"p50": statistics.median(samples), "p95": samples[int(len(samples) * 0.95) - 1]}
+
+
+async def run_queries(session_factory, chat_id: int, user_id: int, repeat: int) -> dict:
+    async with session_factory() as session:
+        mr = MessageRepository(session)
+        cr = ChatRepository(session)
+        # Курсор из середины чата — "глубокая" страница
+        page, cursor = await mr.get_messages_page(chat_id, limit=50)
+        depth = 0
+        while cursor is not None and depth < 20:
+            page, cursor = await mr.get_messages_page(chat_id, limit=50, before=cursor)
+            depth += 1
+        deep_cursor = (page[0].created_at, page[0].id) if page else None
+        latest, _ = await mr.get_messages_page(chat_id, limit=50)
+        after_id = latest[len(latest) // 2].id if latest else 0
+
+        queries = {
+            "последняя страница (50)": lambda: mr.get_messages_page(chat_id, limit=50),
+            "страница по курсору": lambda: mr.get_messages_page(chat_id, limit=50, before=deep_cursor),
+            "контекст LLM (100)": lambda: mr.get_recent_messages_for_chat(chat_id, limit=100),
+            "новые после id": lambda: mr.get_messages_after(chat_id, after_id),
+            "список чатов пользователя": lambda: cr.list_chat_summaries(user_id),
+        }
+        results = {}
+        for name, fn in queries.items():
+            session.expunge_all()
+            results[name] = await timed(fn, repeat)
+        return results
+
+
+def explain(path: str, chat_id: int) -> str:
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM messages WHERE chat_id = ? "
+        "ORDER BY created_at DESC, id DESC LIMIT 51",
+        (chat_id,),
+    ).fetchall()
+    conn.close()
+    return "; ".join(row[-1] for row in rows)
+
+
+async def bench_size(size: int, args) -> None:
+    path = os.path.join(args.db_dir, f"history_{size}.db")
+    if os.path.exists(path):
+        os.remove(path)
+    engine = make_engine(path)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+
+    t0 = time.perf_counter()
+    seed(path, size, args.chats, args.users)
+    print(f"\n=== {size} сообщений, {args.chats} чатов (заполнение {time.perf_counter() - t0:.1f} с) ===")
+
+    variants = [("с индексами", False)] + ([("без индексов", True)] if args.compare else [])
+    for label, drop in variants:
+        if drop:
+            conn = sqlite3.connect(path)
+            for index in INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {index}")
+            conn.execute("ANALYZE")
+            conn.close()
+        engine = make_engine(path)
+        session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        results = await run_queries(session_factory, chat_id=1, user_id=1, repeat=args.repeat)
+        await engine.dispose()
+        print(f"-- {label}: {explain(path, 1)}")
+        for name, r in results.items():
+            print(f"   {name:<28} p50 {r['p50']:>8.2f} мс   p95 {r['p95']:>8.2f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,1000000", help="число сообщений через запятую")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--compare", action="store_true", help="повторить без составных индексов")
+    parser.add_argument("--db-dir", default=tempfile.gettempdir())
+    args = parser.parse_args()
+    for size in (int(s) for s in args.sizes.split(",")):
+        asyncio.run(bench_size(size, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# benchmarks/bench_history_serialization.py
+"""
+Сериализация страницы истории: ORM + MessageDTO на каждое сообщение
+против строк get_message_rows_page и одного dump_messages_json.
+
+"dto" повторяет прежний путь GET /api/chats/{id}/messages: ORM-объекты,
+MessageDTO.model_validate для каждого, затем FastAPI валидирует
+response_model=list[MessageDTO] еще раз и сериализует. "rows" — текущий
+путь: кортежи нужных колонок и готовые байты JSON. Кэш истории выключен,
+чтобы мерить запрос к базе и сериализацию. Перед замером проверяется,
+что оба пути дают одинаковый JSON.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_history_serialization.py --messages 2000 --limits 50,200
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+async def run(args) -> None:
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_model_field
+
+    from db import async_session, init_db
+    from dtos import MessageDTO, dump_messages_json
+    from models import Chat, Message, MessageType, User
+    from repositories.message_repo import MessageRepository
+
+    await init_db()
+    async with async_session() as session:
+        user = User(username="bench")
+        session.add(user)
+        await session.flush()
+        chat = Chat(user_id=user.id, title="Бенчмарк")
+        session.add(chat)
+        await session.flush()
+        session.add_all(
+            Message(
+                chat_id=chat.id,
+                user_id=user.id if i % 2 == 0 else None,
+                content=("Вопрос пользователя о погоде и планах на выходные. " if i % 2 == 0
+                         else "Развернутый ответ модели с подробностями. " * 8),
+                message_type=MessageType.USER if i % 2 == 0 else MessageType.MODEL,
+            )
+            for i in range(args.messages)
+        )
+        await session.commit()
+
+    # Так FastAPI проверяет и сериализует ответ с response_model
+    field = create_model_field(name="Response", type_=list[MessageDTO], mode="serialization")
+
+    async def dto_path(limit: int) -> bytes:
+        async with async_session() as session:
+            msgs, _ = await MessageRepository(session).get_messages_page(chat.id, limit=limit)
+            content = await serialize_response(
+                field=field, response_content=[MessageDTO.model_validate(m) for m in msgs]
+            )
+        # Как JSONResponse.render
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+    async def rows_path(limit: int) -> bytes:
+        async with async_session() as session:
+            rows, _ = await MessageRepository(session).get_message_rows_page(chat.id, limit=limit)
+        return dump_messages_json(rows)
+
+    print(f"{args.messages} сообщений в чате, {args.repeat} повторов")
+    print(f"{'limit':>6} {'путь':<6} {'p50 мс':>8} {'p95 мс':>8}")
+    for limit in args.limits:
+        assert json.loads(await dto_path(limit)) == json.loads(await rows_path(limit)), "JSON путей различается"
+        for name, path in (("dto", dto_path), ("rows", rows_path)):
+            timings = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                await path(limit)
+                timings.append(1000 * (time.perf_counter() - t0))
+            timings.sort()
+            print(f"{limit:>6} {name:<6} {statistics.median(timings):>8.2f} "
+                  f"{timings[int(0.95 * (len(timings) - 1))]:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--limits", type=lambda s: [int(x) for x in s.split(",")], default=[50, 200])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="voice-chat-serialize-")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# benchmarks/bench_llm_gateway.py
+"""
+LLMGateway против fake_ollama.py: справедливость очереди и отмена.
+
+Один пользователь отправляет --spam сообщений в разные чаты, еще --users
+пользователей — по одному. Печатается время ожидания в очереди и полного
+ответа для каждого запроса: при справедливом планировщике одиночные
+пользователи не ждут, пока закончится вся пачка первого. В конце одна
+генерация отменяется новым сообщением в том же чате, и по /stats заглушки
+видно, что поток был прерван.
+
+Запуск из корня репозитория:
+    python benchmarks/fake_ollama.py --port 11500 &
+    python benchmarks/bench_llm_gateway.py --base-url http://127.0.0.1:11500
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.llm_gateway import GenerationCancelled, LLMGateway  # noqa: E402
+
+
+async def one_request(gateway: LLMGateway, user_id: int, chat_id: int, started: float) -> dict:
+    first_token = None
+    tokens = 0
+    try:
+        async for _ in gateway.stream("привет", user_id=user_id, chat_id=chat_id):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            tokens += 1
+        status = "ok"
+    except GenerationCancelled:
+        status = "cancelled"
+    return {
+        "user": user_id,
+        "chat": chat_id,
+        "status": status,
+        "tokens": tokens,
+        "first_token_s": first_token,
+        "done_s": time.perf_counter() - started,
+    }
+
+
+async def run(args) -> None:
+    gateway = LLMGateway(args.base_url, args.model, max_concurrency=args.concurrency)
+    started = time.perf_counter()
+    jobs = [one_request(gateway, 1, 1000 + i, started) for i in range(args.spam)]
+    jobs += [one_request(gateway, 2 + i, 2000 + i, started) for i in range(args.users)]
+    results = await asyncio.gather(*jobs)
+
+    print(f"{'user':>4} {'chat':>5} {'first token s':>14} {'done s':>8}")
+    for r in results:
+        print(f"{r['user']:>4} {r['chat']:>5} {r['first_token_s'] or float('nan'):>14.3f} {r['done_s']:>8.3f}")
+    print(json.dumps(gateway.stats()["models"], ensure_ascii=False, indent=2))
+
+    # Отмена: второе сообщение в том же чате останавливает первую генерацию
+    started = time.perf_counter()
+    first = asyncio.create_task(one_request(gateway, 1, 1, started))
+    await asyncio.sleep(args.cancel_after)
+    second = await one_request(gateway, 1, 1, started)
+    print(f"первая генерация: {(await first)['status']}, вторая: {second['status']}")
+
+    with urllib.request.urlopen(f"{args.base_url}/stats") as resp:
+        print("fake ollama:", resp.read().decode())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:11500")
+    parser.add_argument("--model", default="saiga_llama3_8b:latest")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--spam", type=int, default=8, help="сообщений от одного пользователя")
+    parser.add_argument("--users", type=int, default=3, help="других пользователей по одному сообщению")
+    parser.add_argument("--cancel-after", type=float, default=0.2)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
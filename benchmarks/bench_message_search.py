@@ -0,0 +1,169 @@
+# benchmarks/bench_message_search.py
+"""
+Поиск по сообщениям (FTS5, MessageRepository.search_messages) на большой базе.
+
+Создает временную базу через init_db (таблица messages_fts и триггеры —
+миграция 4), заполняет ее --messages сообщениями: русские слова в разных
+формах и синтетические термины с распределением Ципфа (от частых к
+редким). Индекс наполняется теми же триггерами, что и в приложении, —
+время заполнения тоже печатается. Затем замеряются запросы поиска по
+всем чатам пользователя и по одному чату, глубокая страница по курсору
+и, для сравнения, LIKE по тем же сообщениям без индекса.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_message_search.py --messages 1000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STEMS = [
+    "книг", "погод", "работ", "музык", "дорог", "машин", "школ", "комнат", "кухн", "стран",
+    "город", "поезд", "отпуск", "рецепт", "програм", "задач", "встреч", "картин", "прогулк", "недел",
+]
+ENDINGS = ["а", "и", "у", "ой", "ами", "ах", "е"]
+FILLER = "я ты мы как что это был очень можно сегодня завтра вчера потом где когда почему".split()
+
+
+def make_text(rng: random.Random, terms: int) -> str:
+    words = []
+    for _ in range(12):
+        roll = rng.random()
+        if roll < 0.25:
+            words.append(rng.choice(STEMS) + rng.choice(ENDINGS))
+        elif roll < 0.55:
+            # Ципф: термин k встречается примерно в k раз реже первого
+            words.append(f"термин{int(terms ** rng.random())}")
+        else:
+            words.append(rng.choice(FILLER))
+    return " ".join(words).capitalize()
+
+
+def seed(path: str, messages: int, chats: int, users: int, terms: int) -> None:
+    rng = random.Random(42)
+    conn = sqlite3.connect(path)
+    started = datetime(2024, 1, 1)
+    conn.executemany("INSERT INTO users (id, username) VALUES (?, ?)", [(u + 1, f"user{u}") for u in range(users)])
+    conn.executemany(
+        "INSERT INTO chats (id, title, created_at, user_id) VALUES (?, ?, ?, ?)",
+        [(c + 1, f"Чат {c}", str(started + timedelta(minutes=c)), c % users + 1) for c in range(chats)],
+    )
+    batch = []
+    for i in range(messages):
+        chat_id = rng.randrange(chats) + 1
+        user_msg = i % 2 == 0
+        batch.append((
+            make_text(rng, terms),
+            "USER" if user_msg else "MODEL",
+            "COMPLETE",
+            str(started + timedelta(seconds=i)),
+            chat_id,
+            (chat_id - 1) % users + 1 if user_msg else None,
+        ))
+        if len(batch) == 50000 or i == messages - 1:
+            conn.executemany(
+                "INSERT INTO messages (content, message_type, status, created_at, chat_id, user_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+            batch = []
+    conn.commit()
+    conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')")
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+async def timed(fn, repeat: int) -> dict:
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = await fn()
+        samples.append(1000 * (time.perf_counter() - t0))
+    samples.sort()
+    return {"p50": statistics.median(samples), "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "result": result}
+
+
+async def run(args, path: str) -> None:
+    from sqlalchemy import text
+
+    from db import async_session, init_db
+    from repositories.message_repo import MessageRepository
+
+    await init_db()
+    t0 = time.perf_counter()
+    seed(path, args.messages, args.chats, args.users, args.terms)
+    print(f"база: {args.messages} сообщений, {args.chats} чатов, {args.users} польз.; "
+          f"вставка с индексацией {time.perf_counter() - t0:.1f} с, файл {os.path.getsize(path) / 2**20:.0f} МиБ")
+
+    user_id, chat_id = 1, 1
+    async with async_session() as session:
+        repo = MessageRepository(session)
+
+        async def count(q: str) -> int:
+            rows, _ = await repo.search_messages(user_id, q, limit=10**9)
+            return len(rows)
+
+        async def deep_cursor(q: str, pages: int):
+            cursor = None
+            for _ in range(pages):
+                _, cursor = await repo.search_messages(user_id, q, limit=20, after=cursor)
+            return cursor
+
+        cases = [
+            ("редкий термин", "термин4999", None),
+            ("средний термин", "термин50", None),
+            ("частое слово (формы: книгами)", "книгами", None),
+            ("два слова (AND)", "погодой дорогами", None),
+            ("частое слово в одном чате", "книгами", chat_id),
+        ]
+        print(f"{'запрос':<34} {'совпад.':>8} {'p50 мс':>8} {'p95 мс':>8}")
+        for label, q, chat in cases:
+            matches = await count(q)
+            stats = await timed(lambda: repo.search_messages(user_id, q, chat_id=chat, limit=20), args.repeat)
+            print(f"{label:<34} {matches:>8} {stats['p50']:>8.2f} {stats['p95']:>8.2f}")
+
+        cursor = await deep_cursor("книгами", 5)
+        stats = await timed(lambda: repo.search_messages(user_id, "книгами", limit=20, after=cursor), args.repeat)
+        print(f"{'страница 6 по курсору':<34} {'':>8} {stats['p50']:>8.2f} {stats['p95']:>8.2f}")
+
+        like = text(
+            "SELECT m.id FROM messages m JOIN chats c ON c.id = m.chat_id "
+            "WHERE c.user_id = :user_id AND m.content LIKE :pattern ORDER BY m.id LIMIT 20"
+        )
+        for label, pattern in (("LIKE без индекса (редкий)", "%термин4999%"), ("LIKE без индекса (книг)", "%книг%")):
+            stats = await timed(lambda: session.execute(like, {"user_id": user_id, "pattern": pattern}),
+                                max(1, args.repeat // 10))
+            print(f"{label:<34} {'':>8} {stats['p50']:>8.2f} {stats['p95']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--terms", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="voice-chat-search-")
+    path = os.path.join(tmp, "search.db")
+    # DATABASE_URL читается при импорте db
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+    asyncio.run(run(args, path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# benchmarks/bench_message_writes.py
+"""
+Задержка записи пары сообщений (пользователь + плейсхолдер модели) перед
+началом генерации при --chats одновременных отправках.
+
+  legacy    — как раньше: два add_message, каждый с commit и refresh;
+  exchange  — MessageRepository.add_exchange: одна транзакция, INSERT ... RETURNING;
+  group     — MessageWriter: вставки всех чатов за окно --batch-ms одним коммитом.
+
+Каждый режим — на своей временной базе с теми же PRAGMA, что у приложения
+(--synchronous FULL покажет цену fsync на каждый коммит).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_message_writes.py --chats 32 --rounds 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def run_mode(mode: str, args) -> dict:
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    import settings
+    from db import sqlite_pragmas
+    from models import Base, Chat, MessageType, User
+    from repositories.message_repo import MessageRepository
+    from services.message_writer import MessageWriter
+
+    settings.SQLITE_SYNCHRONOUS = args.synchronous
+    path = os.path.join(tempfile.mkdtemp(prefix="voice-chat-writes-"), "writes.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+        cursor.close()
+
+    session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_factory() as session:
+        session.add(User(id=1, username="bench"))
+        session.add_all(Chat(id=c + 1, user_id=1, title=f"Чат {c}") for c in range(args.chats))
+        await session.commit()
+
+    writer = MessageWriter(session_factory, batch_ms=args.batch_ms)
+    latencies = []
+
+    async def send(chat_id: int) -> None:
+        t0 = time.perf_counter()
+        if mode == "group":
+            await writer.add_exchange(chat_id, "привет", 1)
+        else:
+            # У каждого запроса своя сессия, как у отдельного соединения
+            async with session_factory() as session:
+                repo = MessageRepository(session)
+                if mode == "legacy":
+                    user_msg = await repo.add_message(chat_id, "привет", MessageType.USER, 1)
+                    await session.refresh(user_msg)
+                    model_msg = await repo.add_message(chat_id, "", MessageType.MODEL, None)
+                    await session.refresh(model_msg)
+                else:
+                    await repo.add_exchange(chat_id, "привет", 1)
+        latencies.append(1000 * (time.perf_counter() - t0))
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        await asyncio.gather(*(send(c + 1) for c in range(args.chats)))
+    wall = time.perf_counter() - started
+    await writer.close()
+    await engine.dispose()
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "per_s": len(latencies) / wall,
+        "batches": writer.stats()["batches"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=32, help="одновременных отправок")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--batch-ms", type=float, default=5.0)
+    parser.add_argument("--synchronous", default="NORMAL", help="PRAGMA synchronous: NORMAL или FULL")
+    args = parser.parse_args()
+
+    print(f"{'режим':>9} {'p50 мс':>8} {'p95 мс':>8} {'пар/с':>8} {'групп':>6}")
+    for mode in ("legacy", "exchange", "group"):
+        r = asyncio.run(run_mode(mode, args))
+        print(f"{mode:>9} {r['p50']:>8.2f} {r['p95']:>8.2f} {r['per_s']:>8.0f} {r['batches'] or '':>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# benchmarks/bench_startup.py
+"""
+Время старта приложения:
+  - import main (в отдельном процессе, без кэша модулей текущего);
+  - от запуска uvicorn до первого успешного ответа (/health/live и главная страница);
+  - до готовности моделей (/health/ready -> 200), если не указан --skip-ready.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_startup.py --runs 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import main; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def measure_import() -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def get_status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=2) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def wait_for(url: str, ok_status: int, started: float, timeout: float) -> float:
+    while time.perf_counter() - started < timeout:
+        if get_status(url) == ok_status:
+            return time.perf_counter() - started
+        time.sleep(0.02)
+    return float("nan")
+
+
+def measure_server(port: int, skip_ready: bool, timeout: float) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        result = {"live_s": wait_for(f"{base}/health/live", 200, started, timeout)}
+        page_started = time.perf_counter()
+        status = get_status(f"{base}/")
+        result["first_page_ms"] = round(1000 * (time.perf_counter() - page_started), 1)
+        result["first_page_status"] = status
+        if not skip_ready:
+            result["ready_s"] = wait_for(f"{base}/health/ready", 200, started, timeout)
+            try:
+                with urllib.request.urlopen(f"{base}/health/ready", timeout=2) as resp:
+                    body = resp.read()
+            except urllib.error.HTTPError as e:
+                body = e.read()  # 503: какая-то модель не загрузилась
+            result["models"] = json.loads(body)["models"]
+        return result
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--skip-ready", action="store_true", help="не ждать загрузки моделей")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    print(f"import main: min {min(imports):.3f} s, max {max(imports):.3f} s")
+
+    for run in range(args.runs):
+        result = measure_server(args.port, args.skip_ready, args.timeout)
+        line = f"run {run + 1}: live {result['live_s']:.3f} s, first page {result['first_page_ms']} ms"
+        line += f" (HTTP {result['first_page_status']})"
+        if "ready_s" in result:
+            line += f", ready {result['ready_s']:.3f} s"
+        print(line)
+        for name, state in result.get("models", {}).items():
+            print(f"    {name}: {state['state']}, загрузка {state['load_seconds']} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# benchmarks/bench_tts_batching.py
+"""
+TTS под конкурентной нагрузкой: пул без батчинга против TTSBatchScheduler.
+
+Как в приложении: --concurrency клиентов одновременно шлют запросы
+(каждый — следующий сразу после ответа на предыдущий), синтез идет
+в BoundedWorkerPool с --workers потоками. Режим "pool" — каждый запрос
+отдельной задачей пула (synthesize_to_bytes), "batch W мс" — через
+планировщик с окном W. Для каждого режима печатаются запросы/с,
+секунды аудио/с, задержка p50/p95 и средний размер пачки.
+
+Если модель не принимает список текстов (supports_batch = нет),
+планировщик сам отправляет запросы в пул без окна — строки "batch"
+тогда должны совпадать с "pool".
+
+Запуск из корня репозитория:
+    python benchmarks/bench_tts_batching.py --concurrency 1,4,8 --requests 32 --windows 5,10
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import soundfile as sf  # noqa: E402
+import torch  # noqa: E402
+
+from services.local_tts_service import LocalTextToVoiceService  # noqa: E402
+from services.tts_batcher import TTSBatchScheduler  # noqa: E402
+from services.worker_pool import BoundedWorkerPool  # noqa: E402
+
+SAMPLE_TEXTS = [
+    "Привет! Чем могу помочь?",
+    "Сегодня отличная погода для прогулки по парку.",
+    "Нейросеть генерирует ответ по одному токену за раз.",
+    "Озвучка длинных ответов занимает заметное время.",
+]
+
+
+def audio_seconds(wav_bytes: bytes) -> float:
+    info = sf.info(io.BytesIO(wav_bytes))
+    return info.frames / info.samplerate
+
+
+async def run_load(synthesize, requests: list, concurrency: int) -> dict:
+    """concurrency клиентов разбирают requests по очереди; задержка — от отправки до ответа."""
+    queue = list(reversed(requests))
+    latencies = []
+    total_audio = 0.0
+
+    async def client():
+        nonlocal total_audio
+        while queue:
+            params = queue.pop()
+            t0 = time.perf_counter()
+            audio = await synthesize(**params)
+            latencies.append(time.perf_counter() - t0)
+            total_audio += audio_seconds(audio)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "rps": len(requests) / wall,
+        "audio": total_audio / wall,
+        "p50": 1000 * statistics.median(latencies),
+        "p95": 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+async def run(args, service: LocalTextToVoiceService) -> None:
+    requests = [
+        {"text": SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)], "speaker": args.speaker}
+        for i in range(args.requests)
+    ]
+    # Очередь пула с запасом: в замере нужны задержки, а не отказы 429
+    pool = BoundedWorkerPool("tts-bench", max_workers=args.workers, max_queue=max(args.concurrency) * 2, timeout=None)
+
+    async def direct(**params) -> bytes:
+        return await pool.submit(service.synthesize_to_bytes, **params)
+
+    # Прогрев (JIT, аллокации)
+    await direct(**requests[0])
+
+    print(f"{'клиентов':>8} {'режим':<12} {'req/s':>8} {'audio s/s':>10} {'p50 мс':>8} {'p95 мс':>8} {'пачка':>6}")
+    for concurrency in args.concurrency:
+        modes = [("pool", direct, None)]
+        for window in args.windows:
+            batcher = TTSBatchScheduler(service, pool, window_ms=window, max_batch=args.max_batch)
+            modes.append((f"batch {window:g} мс", batcher.synthesize, batcher))
+        for name, synthesize, batcher in modes:
+            result = await run_load(synthesize, requests, concurrency)
+            batch = batcher.stats()["avg_batch_size"] if batcher is not None else 1.0
+            print(f"{concurrency:>8} {name:<12} {result['rps']:>8.2f} {result['audio']:>10.2f} "
+                  f"{result['p50']:>8.1f} {result['p95']:>8.1f} {batch or 1.0:>6.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 4, 8])
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2, help="потоков в пуле (как TTS_WORKERS)")
+    parser.add_argument("--windows", type=lambda s: [float(x) for x in s.split(",")], default=[10.0])
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--speaker", default="aidar")
+    parser.add_argument("--threads", type=int, default=0, help="torch.set_num_threads (0 — по умолчанию)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    service = LocalTextToVoiceService()
+    try:
+        service.load()
+    except RuntimeError:
+        sys.exit("Модель Silero не загрузилась")
+    print(f"Пакетный API модели: {'да' if service.supports_batch else 'нет (планировщик идет в пул напрямую)'}")
+
+    asyncio.run(run(args, service))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/bench_tts_postprocess.py
+"""
+Сравнение старой цепочки пост-обработки TTS (np.convolve и копия на каждом шаге)
+с AudioPostProcessor (FFT overlap-add, кэш ИХ, объединенные gain/normalize)
+на синтетическом сигнале длиной 10/60/300 секунд.
+
+Старая реверберация — O(N·M), на 300 с она считается минутами,
+поэтому по умолчанию ограничена длиной --legacy-max.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_tts_postprocess.py --reverb-time 0.5 --reverb-decay 0.3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from services.audio_pipeline import AudioPostProcessor, impulse_response  # noqa: E402
+
+SAMPLE_RATE = 48000
+
+
+# --- Прежняя реализация (до AudioPostProcessor), без pitch/tempo ---
+def legacy_chain(wav, gain_db, reverb_time, decay, silence_before, silence_after, sr=SAMPLE_RATE):
+    b = int(round(silence_before * sr))
+    a = int(round(silence_after * sr))
+    if b or a:
+        wav = np.concatenate([np.zeros(b, dtype=np.float32), wav, np.zeros(a, dtype=np.float32)]).astype(np.float32)
+    wav = (wav * 10 ** (gain_db / 20)).astype(np.float32)
+    if reverb_time > 0 and decay > 0:
+        n = int(sr * reverb_time)
+        t = np.arange(n, dtype=np.float32)
+        ir = (decay ** (t / (sr * reverb_time))).astype(np.float32)
+        ir /= (np.sum(np.abs(ir)) + 1e-9)
+        convolved = np.convolve(wav, ir, mode='full')[:len(wav)]
+        out = wav + convolved * 0.7
+        out /= max(1.0, np.max(np.abs(out)) + 1e-9)
+        wav = out.astype(np.float32)
+    peak = np.max(np.abs(wav))
+    if peak > 0:
+        wav = wav * (0.98 / peak)
+    return wav.astype(np.float32)
+
+
+def make_signal(seconds: float) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * SAMPLE_RATE), dtype=np.float32) / SAMPLE_RATE
+    voice_like = 0.3 * np.sin(2 * np.pi * 180 * t) * (1 + np.sin(2 * np.pi * 3 * t))
+    return (voice_like + 0.05 * rng.standard_normal(t.size)).astype(np.float32)
+
+
+def timed(fn, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--durations", default="10,60,300")
+    parser.add_argument("--reverb-time", type=float, default=0.5)
+    parser.add_argument("--reverb-decay", type=float, default=0.3)
+    parser.add_argument("--gain-db", type=float, default=3.0)
+    parser.add_argument("--legacy-max", type=float, default=60.0,
+                        help="не запускать старую цепочку на сигналах длиннее (сек)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    post = AudioPostProcessor(SAMPLE_RATE)
+    params = dict(gain_db=args.gain_db, reverb_time=args.reverb_time, reverb_decay=args.reverb_decay,
+                  silence_before=0.2, silence_after=0.2)
+    # ИХ строится один раз и дальше берется из кэша
+    impulse_response(args.reverb_time, args.reverb_decay, SAMPLE_RATE)
+
+    print(f"{'length':>7} {'legacy s':>10} {'pipeline s':>11} {'speedup':>8} {'max diff':>9}")
+    for seconds in (float(d) for d in args.durations.split(",")):
+        signal = make_signal(seconds)
+        new_time, new_out = timed(lambda: post.process(signal.copy(), **params), args.repeat)
+
+        if seconds <= args.legacy_max:
+            legacy_time, legacy_out = timed(
+                lambda: legacy_chain(signal, args.gain_db, args.reverb_time, args.reverb_decay, 0.2, 0.2),
+                1,
+            )
+            diff = float(np.max(np.abs(legacy_out - new_out)))
+            print(f"{seconds:>6.0f}s {legacy_time:>10.3f} {new_time:>11.3f} {legacy_time / new_time:>7.1f}x {diff:>9.2e}")
+        else:
+            print(f"{seconds:>6.0f}s {'skipped':>10} {new_time:>11.3f} {'-':>8} {'-':>9}")
+
+
+if __name__ == "__main__":
+    main()
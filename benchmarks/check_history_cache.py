@@ -0,0 +1,114 @@
+# benchmarks/check_history_cache.py
+"""
+Проверка согласованности кэша истории (HistoryCache) с базой.
+
+На временной базе прогревает кэш, затем пишет всеми путями записи —
+MessageWriter (пара сообщений, контрольная точка стрима, итоговый текст),
+прямые методы MessageRepository, создание и удаление чата — и после
+каждого шага сравнивает последнюю страницу и список чатов из кэша с тем,
+что читается из базы без кэша. В конце — время чтения страницы с кэшем и без.
+
+Запуск из корня репозитория:
+    python benchmarks/check_history_cache.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PAGE = 20
+
+
+def page_key(page):
+    messages, cursor = page
+    return [(m.id, m.content, m.message_type, m.status) for m in messages], cursor
+
+
+async def run() -> bool:
+    from db import async_session, init_db
+    from models import MessageStatus, MessageType
+    from repositories.chat_repo import ChatRepository
+    from repositories.message_repo import MessageRepository
+    from repositories.user_repo import UserRepository
+    from services.history_cache import HistoryCache
+    from services.message_writer import MessageWriter
+
+    await init_db()
+    cache = HistoryCache(max_chats=8, max_users=8, window=PAGE)
+    writer = MessageWriter(async_session, batch_ms=2, cache=cache)
+    ok = True
+
+    async with async_session() as session:
+        user = await UserRepository(session).create_user("cache-check")
+        cr = ChatRepository(session, cache=cache)
+        mr = MessageRepository(session, cache=cache)
+        chat = await cr.create_chat(user.id, "Чат")
+        for i in range(PAGE + 5):
+            await mr.add_message(chat.id, f"Сообщение {i}", MessageType.USER, user.id)
+
+    async def check(step: str, chat_id: int, user_id: int) -> None:
+        nonlocal ok
+        async with async_session() as session:
+            cached_page = await MessageRepository(session, cache=cache).get_messages_page(chat_id, limit=PAGE)
+            cached_list = await ChatRepository(session, cache=cache).list_chat_summaries(user_id)
+            fresh_page = await MessageRepository(session).get_messages_page(chat_id, limit=PAGE)
+            fresh_list = await ChatRepository(session).list_chat_summaries(user_id)
+        passed = page_key(cached_page) == page_key(fresh_page) and list(cached_list) == list(fresh_list)
+        ok &= passed
+        print(f"{step:<44} {'ok' if passed else 'РАСХОЖДЕНИЕ'}")
+
+    await check("прогрев", chat.id, user.id)
+
+    user_msg, model_msg = await writer.add_exchange(chat.id, "Вопрос", user.id)
+    await check("MessageWriter.add_exchange", chat.id, user.id)
+
+    writer.checkpoint(chat.id, model_msg.id, "Частичный отв")
+    await writer.flush()
+    await check("MessageWriter.checkpoint", chat.id, user.id)
+
+    await writer.update_content(chat.id, model_msg.id, "Полный ответ", MessageStatus.COMPLETE)
+    await writer.flush()
+    await check("MessageWriter.update_content", chat.id, user.id)
+
+    async with async_session() as session:
+        mr = MessageRepository(session, cache=cache)
+        await mr.add_exchange(chat.id, "Еще вопрос", user.id)
+        await mr.update_message_content(user_msg.id, "Исправленный вопрос")
+    await check("MessageRepository.add_exchange/update", chat.id, user.id)
+
+    async with async_session() as session:
+        other = await ChatRepository(session, cache=cache).create_chat(user.id, "Второй")
+    await check("ChatRepository.create_chat", chat.id, user.id)
+
+    async with async_session() as session:
+        await ChatRepository(session, cache=cache).delete_chat(other.id)
+    await check("ChatRepository.delete_chat", chat.id, user.id)
+
+    await writer.close()
+
+    async with async_session() as session:
+        cached = MessageRepository(session, cache=cache)
+        plain = MessageRepository(session)
+        for label, repo in (("без кэша", plain), ("с кэшем", cached)):
+            t0 = time.perf_counter()
+            for _ in range(1000):
+                await repo.get_messages_page(chat.id, limit=PAGE)
+            print(f"последняя страница {label:<10} {1000 * (time.perf_counter() - t0):.3f} мкс/запрос")
+
+    stats = cache.stats()
+    print(f"попадания {stats['hit_rate']}, окон {stats['chats']}, сообщений {stats['cached_messages']}")
+    return ok
+
+
+def main():
+    tmp = tempfile.mkdtemp(prefix="voice-chat-cache-")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'check.db')}"
+    sys.exit(0 if asyncio.run(run()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# benchmarks/check_pubsub.py
+"""
+Проверка доставки событий между воркерами через PubSubBackend.
+
+Несколько Broadcaster изображают воркеры uvicorn: ответ генерируется в
+первом, клиенты подключены ко всем остальным. Проверяется, что каждый
+клиент получил new_message раньше токенов, токены — по порядку и без
+потерь, и печатается задержка доставки на чужой воркер.
+
+Запуск из корня репозитория:
+    python benchmarks/check_pubsub.py                      # LocalBus в памяти
+    python benchmarks/check_pubsub.py --redis redis://localhost:6379/0
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.broadcaster import Broadcaster  # noqa: E402
+from services.pubsub import LocalBus, LocalBusBackend, RedisBackend  # noqa: E402
+
+
+def parse_frame(frame: bytes):
+    event, data = None, []
+    for line in frame.decode("utf-8").split("\r\n"):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data.append(line[len("data: "):])
+    return event, json.loads("\n".join(data))
+
+
+async def client(subscription, expected_tokens: int) -> dict:
+    events = []
+    text = ""
+    while len(text.split()) < expected_tokens:
+        event, data = parse_frame(await subscription.get())
+        events.append(event)
+        if event == "stream_token":
+            text += data["token"]
+    return {"events": events, "text": text, "last_at": time.perf_counter()}
+
+
+async def run(args) -> None:
+    bus = LocalBus()
+
+    def backend():
+        if args.redis:
+            return RedisBackend(args.redis, channel="voice-chat:check")
+        return LocalBusBackend(bus)
+
+    workers = [Broadcaster(coalesce_ms=args.coalesce_ms, backend=backend()) for _ in range(args.workers)]
+    for worker in workers:
+        await worker.start()
+    chat_id = 1
+    subscriptions = [await w.subscribe(chat_id) for w in workers[1:] for _ in range(args.clients)]
+    clients = [asyncio.create_task(client(s, args.tokens)) for s in subscriptions]
+    await asyncio.sleep(0.2)  # подписки Redis успевают установиться
+
+    producer = workers[0]
+    started = time.perf_counter()
+    await producer.publish_message(chat_id, json.dumps({"id": 10, "role": "model", "content": ""}))
+    for i in range(args.tokens):
+        await producer.publish_token(chat_id, 10, f"т{i} ")
+        await asyncio.sleep(args.interval_ms / 1000)
+    producer.flush(chat_id)
+    published_at = time.perf_counter()
+
+    results = await asyncio.wait_for(asyncio.gather(*clients), timeout=30)
+    expected = "".join(f"т{i} " for i in range(args.tokens))
+    ok = all(r["events"][0] == "new_message" and r["text"] == expected for r in results)
+    lag = max(r["last_at"] for r in results) - published_at
+    print(f"воркеров: {args.workers}, клиентов на чужих воркерах: {len(results)}")
+    print(f"порядок и полнота: {'OK' if ok else 'НАРУШЕНЫ'}")
+    print(f"генерация {published_at - started:.3f} с, отставание последнего клиента {lag * 1000:.1f} мс")
+    print(json.dumps(producer.stats()["pubsub"], ensure_ascii=False))
+    for worker in workers:
+        await worker.close()
+    if not ok:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis", default=None, help="URL Redis; без него — LocalBus в памяти")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=10, help="клиентов на каждом воркере")
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--interval-ms", type=float, default=2.0)
+    parser.add_argument("--coalesce-ms", type=float, default=40.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# benchmarks/check_query_counts.py
+"""
+Проверка числа SQL-запросов на эндпоинт (защита от N+1 и лишней загрузки связей).
+
+Создает временную базу с --users пользователями по --chats чатов и
+--messages сообщений в каждом, вызывает эндпоинты через ASGI (без
+uvicorn и без загрузки моделей) и сравнивает число запросов с бюджетом.
+Бюджет не зависит от числа чатов и сообщений: если он превышен, значит
+где-то появился запрос на каждую строку.
+
+Запуск из корня репозитория:
+    python benchmarks/check_query_counts.py --chats 50 --messages 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Максимум SQL-запросов на вызов
+BUDGETS = [
+    ("GET", "/chats", 1),
+    ("GET", "/chats/{chat_id}", 2),
+    ("GET", "/api/users/{user_id}/chats", 1),
+    ("GET", "/api/chats/{chat_id}", 1),
+    ("GET", "/api/chats/{chat_id}?include_messages=true", 2),
+    ("GET", "/api/chats/{chat_id}/messages", 1),
+    ("GET", "/api/chats/{chat_id}/messages?limit=20&before={cursor}", 1),
+    ("GET", "/api/users/{user_id}/messages/search?q=Сообщения", 1),
+    # Повторные чтения обслуживает кэш истории (HISTORY_CACHE_CHATS=0 — снова 1-2 запроса)
+    ("GET", "/chats/{chat_id}", 0 if os.getenv("HISTORY_CACHE_CHATS", "") != "0" else 2),
+    ("GET", "/api/users/{user_id}/chats", 0 if os.getenv("HISTORY_CACHE_USERS", "") != "0" else 1),
+]
+
+
+async def seed(users: int, chats: int, messages: int) -> dict:
+    from db import async_session, init_db
+    from models import Chat, Message, MessageType, User
+
+    await init_db()
+    async with async_session() as session:
+        first_user = first_chat = None
+        for u in range(users):
+            user = User(username=f"user{u}")
+            session.add(user)
+            await session.flush()
+            for c in range(chats):
+                chat = Chat(user_id=user.id, title=f"Чат {c}")
+                session.add(chat)
+                await session.flush()
+                session.add_all(
+                    Message(
+                        chat_id=chat.id,
+                        user_id=user.id if i % 2 == 0 else None,
+                        content=f"Сообщение {i} " * 5,
+                        message_type=MessageType.USER if i % 2 == 0 else MessageType.MODEL,
+                    )
+                    for i in range(messages)
+                )
+                first_chat = first_chat or chat.id
+            first_user = first_user or user.id
+        await session.commit()
+    return {"user_id": first_user, "chat_id": first_chat}
+
+
+async def run(args) -> bool:
+    import httpx
+
+    from db import QueryCounter
+    from endpoints.utils import COOKIE_NAME
+    from main import app
+
+    started = time.perf_counter()
+    ids = await seed(args.users, args.chats, args.messages)
+    print(f"база: {args.users} польз. x {args.chats} чатов x {args.messages} сообщ. "
+          f"({time.perf_counter() - started:.1f} с)")
+
+    transport = httpx.ASGITransport(app=app)
+    ok = True
+    async with httpx.AsyncClient(transport=transport, base_url="http://test",
+                                 cookies={COOKIE_NAME: str(ids["user_id"])}) as client:
+        first_page = await client.get(f"/api/chats/{ids['chat_id']}/messages")
+        ids["cursor"] = first_page.headers.get("X-Next-Cursor", "")
+
+        print(f"{'запрос':<58} {'SQL':>4} {'бюджет':>7} {'мс':>7}")
+        for method, template, budget in BUDGETS:
+            path = template.format(**ids)
+            with QueryCounter() as counter:
+                t0 = time.perf_counter()
+                resp = await client.request(method, path)
+                elapsed = 1000 * (time.perf_counter() - t0)
+            passed = resp.status_code < 400 and counter.count <= budget
+            ok &= passed
+            print(f"{method + ' ' + template:<58} {counter.count:>4} {budget:>7} {elapsed:>7.1f}"
+                  f"{'' if passed else '  <-- ПРЕВЫШЕН (' + str(resp.status_code) + ')'}")
+            if not passed and args.verbose:
+                for statement in counter.statements:
+                    print("   ", " ".join(statement.split())[:160])
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--verbose", action="store_true", help="печатать запросы при превышении")
+    args = parser.parse_args()
+
+    # Отдельная временная база; DATABASE_URL читается при импорте db
+    tmp = tempfile.mkdtemp(prefix="voice-chat-queries-")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'check.db')}"
+    os.chdir(ROOT)  # StaticFiles и шаблоны ищутся относительно корня
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
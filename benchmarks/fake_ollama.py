@@ -0,0 +1,88 @@
+# benchmarks/fake_ollama.py
+"""
+Локальная заглушка сервера Ollama для проверки LLMGateway без модели.
+
+Отвечает на POST /api/generate потоком NDJSON, как настоящий Ollama:
+--tokens токенов с паузой --delay-ms между ними. GET /stats показывает,
+сколько генераций шло одновременно (проверка лимита параллельности)
+и сколько было прервано клиентом (проверка отмены).
+
+Запуск:
+    python benchmarks/fake_ollama.py --port 11500 --delay-ms 20
+    OLLAMA_BASE_URL=http://127.0.0.1:11500 python main.py
+"""
+import argparse
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(tokens: int = 40, delay_ms: float = 20.0) -> FastAPI:
+    app = FastAPI(title="Fake Ollama")
+    stats = {"requests": 0, "active": 0, "max_active": 0, "completed": 0, "aborted": 0}
+
+    def chunk(model: str, response: str, done: bool) -> dict:
+        data = {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "response": response,
+            "done": done,
+        }
+        if done:
+            data.update(done_reason="stop", eval_count=tokens, total_duration=0)
+        return data
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        prompt = body.get("prompt", "")
+        stats["requests"] += 1
+
+        async def produce():
+            stats["active"] += 1
+            stats["max_active"] = max(stats["max_active"], stats["active"])
+            try:
+                for i in range(tokens):
+                    await asyncio.sleep(delay_ms / 1000)
+                    yield json.dumps(chunk(model, f"т{i} ", False)) + "\n"
+                yield json.dumps(chunk(model, "", True)) + "\n"
+                stats["completed"] += 1
+            except asyncio.CancelledError:
+                stats["aborted"] += 1
+                raise
+            finally:
+                stats["active"] -= 1
+
+        if body.get("stream", True) is False:
+            text = "".join([json.loads(line)["response"] async for line in produce()])
+            return JSONResponse({**chunk(model, text, True), "prompt_chars": len(prompt)})
+        return StreamingResponse(produce(), media_type="application/x-ndjson")
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": "saiga_llama3_8b:latest", "model": "saiga_llama3_8b:latest"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--delay-ms", type=float, default=20.0)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.tokens, args.delay_ms), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,21 @@ from dependency_injector import containers, providers
 from repositories.user_repo import UserRepository
 from repositories.chat_repo import ChatRepository
 from repositories.message_repo import MessageRepository
-from services.chat_service import ChatService, Broadcaster
-from db import get_session
+from services.chat_service import ChatService
+from services.broadcaster import Broadcaster
+from services.pubsub import InProcessBackend, RedisBackend
+from db import get_session, async_session
 from services.transcription_service import TranscriptionService
 from services.local_tts_service import LocalTextToVoiceService
+from services.worker_pool import BoundedWorkerPool
+from services.tts_cache import TTSAudioCache
+from services.tts_batcher import TTSBatchScheduler
+from services.model_registry import ModelRegistry
+from services.context_builder import ConversationContextBuilder
+from services.llm_gateway import LLMGateway
+from services.message_writer import MessageWriter
+from services.history_cache import HistoryCache
+import settings
 
 
 class Container(containers.DeclarativeContainer):
@@ -21,6 +32,8 @@ class Container(containers.DeclarativeContainer):
             "endpoints.web_actions",
             "endpoints.api_users",
             "endpoints.api_messages",
+            "endpoints.api_metrics",
+            "endpoints.api_health",
             "services.chat_service",
         ]
     )
@@ -32,6 +45,23 @@ class Container(containers.DeclarativeContainer):
     # генераторами (с yield), как наш get_session.
     db_session = providers.Resource(get_session)
 
+    # Кэш последних страниц активных чатов и списков чатов (один на процесс)
+    history_cache: providers.Singleton[HistoryCache] = providers.Singleton(
+        HistoryCache,
+        max_chats=settings.HISTORY_CACHE_CHATS,
+        max_users=settings.HISTORY_CACHE_USERS,
+        window=settings.HISTORY_CACHE_WINDOW,
+    )
+
+    # Кэш собранного контекста диалогов для LLM (один на приложение)
+    context_builder: providers.Singleton[ConversationContextBuilder] = providers.Singleton(
+        ConversationContextBuilder,
+        max_tokens=settings.LLM_CONTEXT_TOKENS,
+        reply_reserve_tokens=settings.LLM_REPLY_RESERVE_TOKENS,
+        summary_max_tokens=settings.LLM_SUMMARY_TOKENS,
+        max_chats=settings.LLM_CONTEXT_CACHE_CHATS,
+    )
+
     # 2. Репозитории
     # Factory создает новый экземпляр при каждом запросе.
     # Мы "связываем" аргумент 'session' в __init__ репозитория
@@ -44,27 +74,129 @@ class Container(containers.DeclarativeContainer):
     chat_repo: providers.Factory[ChatRepository] = providers.Factory(
         ChatRepository,
         session=db_session,
+        cache=history_cache,
+        on_delete=context_builder.provided.forget,
     )
 
     message_repo: providers.Factory[MessageRepository] = providers.Factory(
         MessageRepository,
         session=db_session,
+        cache=history_cache,
     )
 
-    broadcaster = providers.Singleton(Broadcaster)
+    # Групповая запись сообщений (свои сессии, общий для приложения)
+    message_writer: providers.Singleton[MessageWriter] = providers.Singleton(
+        MessageWriter,
+        session_factory=providers.Object(async_session),
+        batch_ms=settings.DB_WRITE_BATCH_MS,
+        max_batch=settings.DB_WRITE_MAX_BATCH,
+        write_behind=settings.DB_WRITE_BEHIND,
+        cache=history_cache,
+        update_retries=settings.DB_WRITE_UPDATE_RETRIES,
+    )
 
-    chat_service: providers.Factory[ChatService] = providers.Factory(
-        ChatService,
-        message_repo=message_repo,
-        broadcaster=broadcaster
+    # Транспорт событий: в пределах процесса или через Redis между воркерами/узлами
+    pubsub_backend = providers.Selector(
+        providers.Object(settings.SSE_PUBSUB_BACKEND),
+        memory=providers.Singleton(InProcessBackend),
+        redis=providers.Singleton(
+            RedisBackend,
+            url=settings.REDIS_URL,
+            channel=settings.SSE_PUBSUB_CHANNEL,
+        ),
+    )
+
+    # Рассылка событий SSE; токены объединяются в кадры раз в SSE_COALESCE_MS,
+    # у каждого подписчика ограниченная очередь с политикой для медленных клиентов
+    broadcaster = providers.Singleton(
+        Broadcaster,
+        coalesce_ms=settings.SSE_COALESCE_MS,
+        coalesce_max_chars=settings.SSE_COALESCE_MAX_CHARS,
+        slow_consumer_policy=settings.SSE_SLOW_CONSUMER_POLICY,
+        max_queue_events=settings.SSE_QUEUE_MAX_EVENTS,
+        max_queue_bytes=settings.SSE_QUEUE_MAX_BYTES,
+        backend=pubsub_backend,
+        replay_events=settings.SSE_REPLAY_EVENTS,
+        replay_chats=settings.SSE_REPLAY_CHATS,
+    )
+
+    # Пул инференса Whisper: по потоку на каждое параллельное распознавание
+    # (экземпляры модели x num_workers), остальные запросы ждут в очереди
+    stt_worker_pool: providers.Singleton[BoundedWorkerPool] = providers.Singleton(
+        BoundedWorkerPool,
+        name="stt",
+        max_workers=settings.STT_REPLICAS * settings.STT_NUM_WORKERS,
+        max_queue=settings.STT_MAX_QUEUE,
+        timeout=settings.STT_JOB_TIMEOUT,
     )
 
     transcription_service: providers.Singleton[TranscriptionService] = providers.Singleton(
-        TranscriptionService
+        TranscriptionService,
+        stt_pool=stt_worker_pool,
+        num_workers=settings.STT_NUM_WORKERS,
     )
 
     local_tts_service = providers.Singleton(LocalTextToVoiceService)
 
+    # Фоновая загрузка моделей после старта сервера (состояние — /health/ready)
+    model_registry: providers.Singleton[ModelRegistry] = providers.Singleton(
+        ModelRegistry,
+        loaders=providers.Dict(
+            tts=local_tts_service.provided.load,
+            stt=transcription_service.provided.load,
+        ),
+    )
+
+    # Отдельный пул потоков для синтеза речи, чтобы TTS не блокировал event loop
+    tts_worker_pool: providers.Singleton[BoundedWorkerPool] = providers.Singleton(
+        BoundedWorkerPool,
+        name="tts",
+        max_workers=settings.TTS_WORKERS,
+        max_queue=settings.TTS_MAX_QUEUE,
+        timeout=settings.TTS_JOB_TIMEOUT,
+    )
+
+    # Кэш готового аудио (память + опционально диск)
+    tts_cache: providers.Singleton[TTSAudioCache] = providers.Singleton(
+        TTSAudioCache,
+        max_memory_bytes=settings.TTS_CACHE_MAX_MEMORY_MB * 1024 * 1024,
+        disk_dir=settings.TTS_CACHE_DIR,
+        max_disk_bytes=settings.TTS_CACHE_MAX_DISK_MB * 1024 * 1024,
+    )
+
+    # Объединение одновременных запросов синтеза в пачки
+    tts_batcher: providers.Singleton[TTSBatchScheduler] = providers.Singleton(
+        TTSBatchScheduler,
+        tts_service=local_tts_service,
+        tts_pool=tts_worker_pool,
+        window_ms=settings.TTS_BATCH_WINDOW_MS,
+        max_batch=settings.TTS_MAX_BATCH,
+    )
+
+    # Единый клиент Ollama: пул соединений, лимит параллельных генераций, справедливая очередь
+    llm_gateway: providers.Singleton[LLMGateway] = providers.Singleton(
+        LLMGateway,
+        base_url=settings.OLLAMA_BASE_URL,
+        default_model=settings.LLM_MODEL,
+        max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    )
+
+    chat_service: providers.Factory[ChatService] = providers.Factory(
+        ChatService,
+        message_repo=message_repo,
+        chat_repo=chat_repo,
+        message_writer=message_writer,
+        broadcaster=broadcaster,
+        context_builder=context_builder,
+        llm_gateway=llm_gateway,
+        tts_service=local_tts_service,
+        tts_batcher=tts_batcher,
+        tts_cache=tts_cache,
+        checkpoint_tokens=settings.STREAM_CHECKPOINT_TOKENS,
+        checkpoint_ms=settings.STREAM_CHECKPOINT_MS,
+        heartbeat_s=settings.STREAM_HEARTBEAT_S,
+    )
+
 
 # Создаем единственный экземпляр контейнера для всего приложения
 container = Container()
\ No newline at end of file
@@ -1,24 +1,225 @@
 # db.py
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from typing import AsyncGenerator
+from typing import AsyncGenerator, List
 from models import Base
 import asyncio
+from datetime import datetime, timedelta
+import settings
 
-DATABASE_URL = "sqlite+aiosqlite:///./chat_app.db"
+DATABASE_URL = settings.DATABASE_URL
+
+# Добавляется к тексту ответа, который прервался вместе с процессом
+INTERRUPTED_MARKER = "\n[ОТВЕТ ПРЕРВАН]"
 
 engine = create_async_engine(DATABASE_URL, echo=False, future=True)
 
+
+def sqlite_pragmas() -> List[str]:
+    """PRAGMA, которые выполняются на каждом новом соединении SQLite."""
+    return [
+        f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}",
+        # Отрицательное значение — размер в КиБ, а не в страницах
+        f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}",
+        f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}",
+        "PRAGMA temp_store=MEMORY",
+        # Каскадное удаление чатов и сообщений делает сама база (passive_deletes в моделях)
+        "PRAGMA foreign_keys=ON",
+    ]
+
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+        cursor.close()
+
 async_session = sessionmaker(
     bind=engine,
     class_=AsyncSession,
     expire_on_commit=False,
 )
 
+class QueryCounter:
+    """
+    Считает SQL-запросы, выполненные движком внутри блока with
+    (проверка, что страница не делает N+1 запросов):
+
+        with QueryCounter() as counter:
+            ...
+        assert counter.count <= 2, counter.statements
+    """
+
+    def __init__(self, target_engine=None):
+        self._engine = (target_engine or engine).sync_engine
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(self._engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        event.remove(self._engine, "before_cursor_execute", self._on_execute)
+
+
+def _add_column_if_missing(conn, table: str, column: str, ddl: str) -> None:
+    # В новой базе create_all уже создал колонку — тогда миграция ничего не делает
+    columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _migration_1_chat_summary(conn) -> None:
+    _add_column_if_missing(conn, "chats", "summary", "TEXT")
+    _add_column_if_missing(conn, "chats", "summary_upto_id", "INTEGER")
+
+
+def _migration_2_hot_path_indexes(conn) -> None:
+    # История чата: WHERE chat_id = ? ORDER BY created_at, id — без сортировки и без чтения чужих чатов
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_messages_chat_created_id ON messages (chat_id, created_at, id)"
+    )
+    # Список чатов пользователя: WHERE user_id = ? ORDER BY created_at
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_chats_user_created ON chats (user_id, created_at)")
+    # Обновить статистику планировщика под новые индексы
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _migration_3_message_status(conn) -> None:
+    _add_column_if_missing(conn, "messages", "status", "VARCHAR(9) NOT NULL DEFAULT 'COMPLETE'")
+    _add_column_if_missing(conn, "messages", "updated_at", "DATETIME")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_messages_streaming ON messages (status) WHERE status = 'STREAMING'"
+    )
+
+
+# Текст для индекса: unicode61 снимает диакритику только с латиницы, ё -> е сворачиваем сами
+# (запрос сворачивается так же — services.search_query)
+def _fts_text(row: str) -> str:
+    return f"replace(replace({row}.content, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _migration_4_message_search(conn) -> bool:
+    # Полнотекстовый индекс по тексту сообщений; сам текст хранится только в messages
+    # (external content, rowid = messages.id).
+    # chat_id тоже индексируется: поиск в чатах пользователя ограничивается
+    # внутри FTS (chat_id : (...)), а не фильтром по всем совпадениям базы.
+    # Поиск идет по основам слов как по префиксам ("книг"*): готовые префиксные индексы
+    # длиной 3-6 избавляют от слияния списков всех форм слова (индекс больше примерно втрое)
+    try:
+        conn.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+            "content, chat_id, content='messages', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='3 4 5 6')"
+        )
+    except Exception as e:
+        # SQLite без FTS5: приложение работает, поиск отвечает 503.
+        # Версия схемы не растет — индекс будет создан при старте со сборкой SQLite с FTS5
+        print(f"Поиск по сообщениям недоступен (нет FTS5): {e}")
+        return False
+    # Индекс синхронизируют триггеры — при любой записи, в том числе не через репозитории.
+    # Стримящиеся ответы не индексируются: контрольные точки не переписывают индекс,
+    # ответ попадает в него, когда получает итоговый статус
+    # ('delete' для external content требует ровно тот текст, что был проиндексирован)
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages
+        WHEN new.status != 'STREAMING' BEGIN
+            INSERT INTO messages_fts(rowid, content, chat_id) VALUES (new.id, {_fts_text('new')}, new.chat_id);
+        END
+    """)
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages
+        WHEN old.status != 'STREAMING' BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content, chat_id)
+                VALUES ('delete', old.id, {_fts_text('old')}, old.chat_id);
+        END
+    """)
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content, status, chat_id ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content, chat_id)
+                SELECT 'delete', old.id, {_fts_text('old')}, old.chat_id WHERE old.status != 'STREAMING';
+            INSERT INTO messages_fts(rowid, content, chat_id)
+                SELECT new.id, {_fts_text('new')}, new.chat_id WHERE new.status != 'STREAMING';
+        END
+    """)
+    conn.exec_driver_sql(
+        f"INSERT INTO messages_fts(rowid, content, chat_id) SELECT id, {_fts_text('messages')}, chat_id FROM messages "
+        "WHERE status != 'STREAMING'"
+    )
+    return True
+
+
+# Миграции схемы по порядку; номер примененной хранится в PRAGMA user_version
+MIGRATIONS = [
+    _migration_1_chat_summary,
+    _migration_2_hot_path_indexes,
+    _migration_3_message_status,
+    _migration_4_message_search,
+]
+
+
+def _has_table(conn, name: str) -> bool:
+    return conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)
+    ).scalar() is not None
+
+
+def _apply_migrations(conn) -> None:
+    version = conn.exec_driver_sql("PRAGMA user_version").scalar() or 0
+    if version >= 4 and not _has_table(conn, "messages_fts"):
+        # Базы, которые раньше дошли до версии 4 без FTS5: индекса у них нет
+        _migration_4_message_search(conn)
+    for number, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+        if migrate(conn) is False:
+            # Миграция не применилась: версия остается прежней, повтор при следующем старте
+            break
+        conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+
+
 async def init_db() -> None:
-    # Создание таблиц
+    # Создание таблиц и миграции существующей базы
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_apply_migrations)
+
+async def recover_interrupted_messages(grace_seconds: float) -> int:
+    """
+    Ответы модели, которые остались в статусе streaming после падения
+    или перезапуска, переводятся в failed с текстом последней контрольной точки.
+    """
+    from repositories.message_repo import MessageRepository
+
+    stale_before = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    async with async_session() as session:
+        return await MessageRepository(session).finalize_interrupted(stale_before, INTERRUPTED_MARKER)
+
+async def run_recovery_sweeps(grace_seconds: float, interval_seconds: float) -> None:
+    """
+    Фоновая задача: recover_interrupted_messages каждые interval_seconds.
+    Одной проверки при старте мало — после быстрого перезапуска прерванные
+    ответы еще моложе grace_seconds и будут пропущены.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            recovered = await recover_interrupted_messages(grace_seconds)
+        except Exception as e:
+            print(f"Ошибка восстановления прерванных ответов: {e}")
+            continue
+        if recovered:
+            print(f"Восстановлено прерванных ответов: {recovered}")
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
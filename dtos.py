@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import Iterable, List, Optional
+from typing_extensions import TypedDict
 from datetime import datetime
 from enum import Enum
 
@@ -7,6 +8,12 @@ class MessageTypeStr(str, Enum):
     USER = "user"
     MODEL = "model"
 
+class MessageStatusStr(str, Enum):
+    STREAMING = "streaming"
+    COMPLETE = "complete"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
 
 # ======================
 # Input DTOs
@@ -32,6 +39,7 @@ class MessageDTO(BaseModel):
     content: str
     message_type: MessageTypeStr
     created_at: datetime
+    status: MessageStatusStr = MessageStatusStr.COMPLETE
 
     model_config = {"from_attributes": True}
 
@@ -39,14 +47,62 @@ class MessageDTO(BaseModel):
     def message_type_value(self):
         return self.message_type.value
 
+class MessageJSON(TypedDict):
+    """Та же форма, что у MessageDTO, для сериализации без создания моделей."""
+    id: int
+    content: str
+    message_type: str
+    created_at: datetime
+    status: str
+
+_MESSAGE_LIST_JSON = TypeAdapter(List[MessageJSON])
+
+def dump_messages_json(messages: Iterable) -> bytes:
+    """
+    JSON списка сообщений за один проход сериализатора pydantic-core,
+    без MessageDTO.model_validate на каждое сообщение и повторной
+    валидации response_model. Принимает любые объекты с атрибутами
+    сообщения (ORM, Row из get_message_rows_page, CachedMessage);
+    результат совпадает с list[MessageDTO].
+    """
+    return _MESSAGE_LIST_JSON.dump_json([
+        {"id": m.id, "content": m.content, "message_type": m.message_type.value,
+         "created_at": m.created_at, "status": m.status.value}
+        for m in messages
+    ])
+
 class ChatDTO(BaseModel):
     id: int
     title: str
     created_at: datetime
+
+    model_config = {"from_attributes": True}
+
+class ChatWithMessagesDTO(ChatDTO):
+    # Только для чата, загруженного с сообщениями (ChatRepository.get_chat(..., with_messages=True))
     messages: List[MessageDTO] = []
 
+class ChatSummaryDTO(BaseModel):
+    """Строка списка чатов: без сообщений, только превью последнего и их число."""
+    id: int
+    title: str
+    created_at: datetime
+    message_count: int = 0
+    last_message_preview: Optional[str] = None
+    last_message_at: Optional[datetime] = None
+
     model_config = {"from_attributes": True}
 
+class MessageSearchHitDTO(BaseModel):
+    """Результат поиска: сообщение, его чат и фрагмент текста с совпадениями в <mark> (HTML экранирован)."""
+    id: int
+    chat_id: int
+    chat_title: str
+    message_type: MessageTypeStr
+    created_at: datetime
+    status: MessageStatusStr = MessageStatusStr.COMPLETE
+    snippet: str
+
 class UserDTO(BaseModel):
     id: int
     username: str
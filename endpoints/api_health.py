@@ -0,0 +1,25 @@
+# endpoints/api_health.py
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+from dependency_injector.wiring import inject, Provide
+
+from containers import Container
+from services.model_registry import ModelRegistry
+
+router = APIRouter(prefix="/health")
+
+
+@router.get("/live")
+async def liveness():
+    """Процесс жив и принимает запросы (модели могут еще загружаться)."""
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+@inject
+async def readiness(
+    model_registry: ModelRegistry = Depends(Provide[Container.model_registry])
+):
+    """Все модели загружены; иначе 503 и состояние каждой модели."""
+    status = model_registry.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
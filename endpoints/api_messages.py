@@ -1,14 +1,21 @@
 # endpoints/api_messages.py
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from dependency_injector.wiring import inject, Provide
 
 from dtos import (
     MessageCreateDTO,
     MessageDTO,
+    ChatDTO,
+    ChatWithMessagesDTO,
+    dump_messages_json,
 )
 from containers import Container
-from repositories.message_repo import MessageRepository
+from repositories.chat_repo import ChatRepository
+from repositories.message_repo import MessageRepository, decode_message_cursor, encode_message_cursor
 from models import MessageType
+import settings
 
 # Обратите внимание на префикс роутера
 router = APIRouter(prefix="/api/chats")
@@ -32,7 +39,34 @@ async def add_message(
 @inject
 async def get_messages(
     chat_id: int,
+    limit: int = Query(settings.CHAT_PAGE_SIZE, ge=1, le=settings.CHAT_PAGE_MAX),
+    before: Optional[str] = Query(None, description="Курсор из X-Next-Cursor предыдущей страницы"),
     mr: MessageRepository = Depends(Provide[Container.message_repo])
 ):
-    msgs = await mr.get_messages_for_chat(chat_id)
-    return [MessageDTO.model_validate(m) for m in msgs]
\ No newline at end of file
+    """
+    Страница истории по возрастанию времени. Если есть более старые
+    сообщения, их курсор возвращается в заголовке X-Next-Cursor.
+    JSON собирается сразу из строк запроса (dump_messages_json), response_model — только для схемы OpenAPI.
+    """
+    try:
+        cursor = decode_message_cursor(before) if before else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows, next_cursor = await mr.get_message_rows_page(chat_id, limit=limit, before=cursor)
+    headers = {"X-Next-Cursor": encode_message_cursor(next_cursor)} if next_cursor is not None else None
+    return Response(content=dump_messages_json(rows), media_type="application/json", headers=headers)
+
+@router.get("/{chat_id}", response_model=ChatWithMessagesDTO)
+@inject
+async def get_chat(
+    chat_id: int,
+    include_messages: bool = False,
+    cr: ChatRepository = Depends(Provide[Container.chat_repo])
+):
+    """Чат; все сообщения — только по явному include_messages=true (для длинных чатов — пагинация)."""
+    chat = await cr.get_chat(chat_id, with_messages=include_messages)
+    if not chat:
+        raise HTTPException(status_code=404, detail="chat not found")
+    if include_messages:
+        return ChatWithMessagesDTO.model_validate(chat)
+    return ChatWithMessagesDTO(**ChatDTO.model_validate(chat).model_dump())
@@ -0,0 +1,85 @@
+# endpoints/api_metrics.py
+from fastapi import APIRouter, Depends
+from dependency_injector.wiring import inject, Provide
+
+from containers import Container
+from services.worker_pool import BoundedWorkerPool
+from services.tts_cache import TTSAudioCache
+from services.tts_batcher import TTSBatchScheduler
+from services.context_builder import ConversationContextBuilder
+from services.llm_gateway import LLMGateway
+from services.broadcaster import Broadcaster
+from services.message_writer import MessageWriter
+from services.history_cache import HistoryCache
+
+router = APIRouter(prefix="/api/metrics")
+
+
+@router.get("/tts")
+@inject
+async def tts_metrics(
+    tts_pool: BoundedWorkerPool = Depends(Provide[Container.tts_worker_pool]),
+    tts_cache: TTSAudioCache = Depends(Provide[Container.tts_cache]),
+    tts_batcher: TTSBatchScheduler = Depends(Provide[Container.tts_batcher])
+):
+    """Глубина очереди, время ожидания и синтеза в пуле TTS, попадания в кэш, размеры пачек."""
+    return {"pool": tts_pool.stats(), "cache": tts_cache.stats(), "batching": tts_batcher.stats()}
+
+
+@router.get("/stt")
+@inject
+async def stt_metrics(
+    stt_pool: BoundedWorkerPool = Depends(Provide[Container.stt_worker_pool])
+):
+    """Очередь пула Whisper: время ожидания в очереди против времени инференса, отказы, отмены."""
+    return {"pool": stt_pool.stats()}
+
+
+@router.get("/context")
+@inject
+async def context_metrics(
+    context_builder: ConversationContextBuilder = Depends(Provide[Container.context_builder])
+):
+    """Кэш контекста LLM: холодные загрузки против дозагрузки новых сообщений, число сводок."""
+    return context_builder.stats()
+
+
+@router.get("/llm")
+@inject
+async def llm_metrics(
+    llm_gateway: LLMGateway = Depends(Provide[Container.llm_gateway])
+):
+    """Очередь генераций по моделям: занятые слоты, ожидающие, время ожидания, отмены."""
+    return llm_gateway.stats()
+
+
+@router.get("/sse")
+@inject
+async def sse_metrics(
+    detail: bool = False,
+    broadcaster: Broadcaster = Depends(Provide[Container.broadcaster])
+):
+    """
+    Подписчики SSE, токены против реально отправленных событий и кадров,
+    глубина очередей и выброшенные события по чатам (detail=true — по каждому подписчику).
+    """
+    return broadcaster.stats(detail=detail)
+
+
+
+@router.get("/db")
+@inject
+async def db_metrics(
+    message_writer: MessageWriter = Depends(Provide[Container.message_writer])
+):
+    """Групповая запись сообщений: размер групп, время коммита, отложенные обновления."""
+    return message_writer.stats()
+
+
+@router.get("/cache")
+@inject
+async def history_cache_metrics(
+    history_cache: HistoryCache = Depends(Provide[Container.history_cache])
+):
+    """Кэш истории чатов: доля попаданий по окнам и спискам чатов, вытеснения, занятая память."""
+    return history_cache.stats()
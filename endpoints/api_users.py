@@ -1,5 +1,8 @@
 # endpoints/api_users.py
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.exc import OperationalError
 # 1. Импортируем 'inject' и 'Provide'
 from dependency_injector.wiring import inject, Provide
 
@@ -8,11 +11,16 @@ from dtos import (
     UserDTO,
     ChatCreateDTO,
     ChatDTO,
+    ChatSummaryDTO,
+    MessageSearchHitDTO,
 )
 # 2. Импортируем наш контейнер и типы репозиториев
 from containers import Container
 from repositories.user_repo import UserRepository
 from repositories.chat_repo import ChatRepository
+from repositories.message_repo import MessageRepository, decode_search_cursor, encode_search_cursor
+from services.search_query import make_snippet
+import settings
 
 
 # Обратите внимание на префикс роутера
@@ -51,11 +59,46 @@ async def create_chat_for_user(
     chat = await cr.create_chat(user_id=user_id, title=payload.title)
     return ChatDTO.model_validate(chat)
 
-@router.get("/{user_id}/chats", response_model=list[ChatDTO]) # <--- Путь изменен
+@router.get("/{user_id}/chats", response_model=list[ChatSummaryDTO]) # <--- Путь изменен
 @inject
 async def list_chats(
     user_id: int,
     cr: ChatRepository = Depends(Provide[Container.chat_repo])
 ):
-    chats = await cr.list_chats_for_user(user_id)
-    return [ChatDTO.model_validate(c) for c in chats]
\ No newline at end of file
+    # Один агрегирующий запрос; сами сообщения — через /api/chats/{chat_id}/messages
+    chats = await cr.list_chat_summaries(user_id)
+    return [ChatSummaryDTO.model_validate(c) for c in chats]
+
+@router.get("/{user_id}/messages/search", response_model=list[MessageSearchHitDTO])
+@inject
+async def search_messages(
+    user_id: int,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=500, description="Слова запроса; формы слов находятся по основе"),
+    chat_id: Optional[int] = Query(None, description="Искать только в этом чате"),
+    limit: int = Query(settings.SEARCH_PAGE_SIZE, ge=1, le=settings.SEARCH_PAGE_MAX),
+    after: Optional[str] = Query(None, description="Курсор из X-Next-Cursor предыдущей страницы"),
+    mr: MessageRepository = Depends(Provide[Container.message_repo])
+):
+    """
+    Поиск по сообщениям всех чатов пользователя (или одного chat_id), лучшие совпадения первыми.
+    Курсор следующей страницы — в заголовке X-Next-Cursor.
+    """
+    try:
+        cursor = decode_search_cursor(after) if after else None
+        hits, next_cursor = await mr.search_messages(user_id, q, chat_id=chat_id, limit=limit, after=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except OperationalError as e:
+        # Нет таблицы messages_fts: SQLite собран без FTS5
+        raise HTTPException(status_code=503, detail=f"search unavailable: {e.orig}")
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = encode_search_cursor(next_cursor)
+    return [
+        MessageSearchHitDTO(
+            id=h.id, chat_id=h.chat_id, chat_title=h.chat_title, message_type=h.message_type.value,
+            created_at=h.created_at, status=h.status.value,
+            snippet=make_snippet(h.content, q, settings.SEARCH_SNIPPET_WORDS),
+        )
+        for h in hits
+    ]
@@ -1,12 +1,13 @@
 # endpoints/utils.py
-from fastapi import Request
+from starlette.requests import HTTPConnection
 from typing import Optional
 
 COOKIE_NAME = "chat_user_id"
 
-def get_current_user_id_from_request(request: Request) -> Optional[int]:
+def get_current_user_id_from_request(request: HTTPConnection) -> Optional[int]:
     """
     Извлекает ID пользователя из cookie 'chat_user_id'.
+    Подходит и для HTTP-запросов, и для WebSocket.
     """
     cookie = request.cookies.get(COOKIE_NAME)
     if not cookie:
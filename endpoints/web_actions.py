@@ -1,28 +1,43 @@
 # endpoints/web_actions.py
 from fastapi import (
     APIRouter, Request, Depends, Form,
-    HTTPException, BackgroundTasks, UploadFile, File, Body
+    HTTPException, BackgroundTasks, UploadFile, File, Body,
+    WebSocket, WebSocketDisconnect
 )
 from fastapi.responses import (
     Response, JSONResponse,
     StreamingResponse
 )
-from pydantic import BaseModel, confloat, validator
+from pydantic import BaseModel, Field
+from typing import Optional
 # Это зависимость из `pip install sse-starlette`
 from sse_starlette.sse import EventSourceResponse
 import asyncio
-import io
+import json
 from dependency_injector.wiring import inject, Provide
 from containers import Container
+import settings
+from services.chat_service import ChatService
+from repositories.chat_repo import ChatRepository
 # Импортируем Broadcaster для внедрения в SSE-эндпоинт
-from services.chat_service import ChatService, Broadcaster
+from services.broadcaster import Broadcaster, SubscriptionClosed
 from services.transcription_service import TranscriptionService
-from gtts import gTTS
+from services.streaming_transcription import StreamingTranscriber
+from services.speech_pipeline import DEFAULT_VOICE_PARAMS
 from .utils import get_current_user_id_from_request
-from services.local_tts_service import LocalTextToVoiceService
+from services.local_tts_service import LocalTextToVoiceService, split_into_sentences
+from services.audio_encoding import OUTPUT_FORMATS, negotiate_format, pick_sample_rate
+from services.worker_pool import BoundedWorkerPool, PoolSaturatedError
+from services.model_registry import ModelNotReadyError
+from services.llm_gateway import LLMGateway
+from services.tts_cache import TTSAudioCache
+from services.tts_batcher import TTSBatchScheduler
 
 router = APIRouter()
 
+# Фоновые задачи эндпоинтов (держим ссылки, чтобы их не собрал GC)
+_background_tasks: set = set()
+
 
 @router.post("/chats/{chat_id}/send")
 @inject
@@ -31,21 +46,97 @@ async def send_message(
         chat_id: int,
         background_tasks: BackgroundTasks,
         content: str = Form(...),
-        chat_service: ChatService = Depends(Provide[Container.chat_service])
+        voice: bool = Form(False),
+        speaker: str = Form("aidar"),
+        speed: float = Form(1.0),
+        pitch_semitones: float = Form(0),
+        gain_db: float = Form(0),
+        reverb_time: float = Form(0),
+        reverb_decay: float = Form(0),
+        chat_service: ChatService = Depends(Provide[Container.chat_service]),
+        cr: ChatRepository = Depends(Provide[Container.chat_repo])
 ):
     user_id = get_current_user_id_from_request(request)
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
+    # Проверяем до постановки в очередь записи: сообщение в чужой или удаленный чат не пишем
+    if not await _owns_chat(cr, chat_id, user_id):
+        raise HTTPException(status_code=404, detail="chat not found")
 
     background_tasks.add_task(
         chat_service.process_user_message,
         chat_id=chat_id,
         content=content,
-        user_id=user_id
+        user_id=user_id,
+        voice=voice,
+        voice_params={
+            "speaker": speaker,
+            "speed": speed,
+            "pitch_semitones": pitch_semitones,
+            "gain_db": gain_db,
+            "reverb_time": reverb_time,
+            "reverb_decay": reverb_decay,
+        }
     )
 
     return Response(status_code=204)
 
+async def _owns_chat(cr: ChatRepository, chat_id: int, user_id: int) -> bool:
+    chat = await cr.get_chat(chat_id)
+    return chat is not None and chat.user_id == user_id
+
+
+@router.post("/chats/{chat_id}/cancel")
+@inject
+async def cancel_generation(
+        request: Request,
+        chat_id: int,
+        llm_gateway: LLMGateway = Depends(Provide[Container.llm_gateway]),
+        broadcaster: Broadcaster = Depends(Provide[Container.broadcaster]),
+        cr: ChatRepository = Depends(Provide[Container.chat_repo])
+):
+    """
+    Останавливает генерацию ответа в чате (пользователь закрыл чат).
+    Не сразу: pagehide приходит и при перезагрузке страницы, а чат может быть
+    открыт еще в одной вкладке — если за LLM_CANCEL_GRACE_S на чат снова кто-то
+    подписан, генерация продолжается.
+    """
+    user_id = get_current_user_id_from_request(request)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if not await _owns_chat(cr, chat_id, user_id):
+        raise HTTPException(status_code=404, detail="chat not found")
+
+    async def cancel_if_abandoned():
+        await asyncio.sleep(settings.LLM_CANCEL_GRACE_S)
+        if not broadcaster.subscriber_count(chat_id):
+            llm_gateway.cancel_chat(chat_id)
+
+    task = asyncio.create_task(cancel_if_abandoned())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return Response(status_code=204)
+
+
+async def _cancel_on_disconnect(request: Request, coro, poll_interval: float = 0.5):
+    """
+    Ждет coro, пока клиент на связи. Если клиент отключился, задача отменяется —
+    место в очереди пула освобождается, а начатый инференс прерывается.
+    """
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
 # ЭНДПОИНТ ДЛЯ ТРАНСКРИПЦИИ АУДИО-
 @router.post("/chats/transcribe_voice")
 @inject
@@ -62,7 +153,7 @@ async def transcribe_voice(
         raise HTTPException(status_code=400, detail="Uploaded file is not an audio file.")
 
     try:
-        user_prompt = await transcription_service.transcribe_audio(audio_file)
+        user_prompt = await _cancel_on_disconnect(request, transcription_service.transcribe_audio(audio_file))
         return JSONResponse({"content": user_prompt})
     except HTTPException as e:
         raise e
@@ -71,6 +162,111 @@ async def transcribe_voice(
         raise HTTPException(status_code=500, detail=f"Критическая ошибка обработки аудио: {e}")
 
 
+def _ws_voice_params(raw: dict) -> dict:
+    """Параметры голоса из JSON-команды WebSocket: только известные ключи и нужные типы."""
+    params = {}
+    for key, default in DEFAULT_VOICE_PARAMS.items():
+        if key not in raw:
+            continue
+        try:
+            params[key] = type(default)(raw[key])
+        except (TypeError, ValueError):
+            continue
+    return params
+
+
+@router.websocket("/chats/{chat_id}/transcribe_stream")
+@inject
+async def transcribe_stream(
+        websocket: WebSocket,
+        chat_id: int,
+        transcription_service: TranscriptionService = Depends(Provide[Container.transcription_service]),
+        chat_service: ChatService = Depends(Provide[Container.chat_service]),
+        cr: ChatRepository = Depends(Provide[Container.chat_repo])
+):
+    """
+    Потоковое распознавание речи.
+    Клиент шлет бинарные куски записи MediaRecorder, а в конце текстовое
+    сообщение {"type": "stop", "send": true|false}. Сервер отвечает событиями
+    {"type": "partial"|"final", "text": ...} по мере распознавания и
+    {"type": "done", "text": ...} в конце. Если запись превысила предел длины
+    или размера, сервер сам шлет {"type": "limit"}, итог (done) и закрывает
+    соединение. При send=true итоговый текст сразу
+    уходит в ChatService как сообщение пользователя (voice/voice_params — как
+    у обычной отправки, для озвучки ответа).
+    """
+    user_id = get_current_user_id_from_request(websocket)
+    if not user_id:
+        await websocket.close(code=4401)
+        return
+    if not await _owns_chat(cr, chat_id, user_id):
+        await websocket.close(code=4404)
+        return
+
+    await websocket.accept()
+    if not transcription_service.ready:
+        await websocket.send_json({"type": "error", "detail": "Модель распознавания недоступна или еще загружается."})
+        await websocket.close(code=1011)
+        return
+
+    transcriber = StreamingTranscriber(
+        transcription_service,
+        max_session_s=settings.STT_STREAM_MAX_SESSION_S,
+        max_bytes=settings.STT_STREAM_MAX_BYTES,
+    )
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+            if message.get("bytes"):
+                transcriber.feed(message["bytes"])
+                if transcriber.step_due():
+                    for event in await transcriber.step():
+                        await websocket.send_json(event)
+                if transcriber.exhausted:
+                    # Предел длины записи: отдаем распознанное и закрываем сессию
+                    await websocket.send_json({"type": "limit", "detail": "Запись слишком длинная, распознавание остановлено."})
+                    for event in await transcriber.finish():
+                        await websocket.send_json(event)
+                    await websocket.close(code=1009)
+                    return
+                continue
+
+            command = json.loads(message.get("text") or "{}")
+            if command.get("type") != "stop":
+                continue
+
+            for event in await transcriber.finish():
+                await websocket.send_json(event)
+
+            text = transcriber.text
+            if command.get("send") and text:
+                # Модель начинает отвечать сразу, как только пользователь замолчал
+                voice_params = command.get("voice_params")
+                task = asyncio.create_task(
+                    chat_service.process_user_message(
+                        chat_id=chat_id, content=text, user_id=user_id,
+                        voice=bool(command.get("voice")),
+                        voice_params=_ws_voice_params(voice_params) if isinstance(voice_params, dict) else None,
+                    )
+                )
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+            await websocket.close()
+            return
+    except WebSocketDisconnect:
+        return
+    except Exception as e:
+        print(f"Streaming transcription error: {e}")
+        try:
+            await websocket.send_json({"type": "error", "detail": "Ошибка потокового распознавания."})
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+
+
 @router.get("/chats/{chat_id}/events")
 @inject
 async def sse_chat_events(
@@ -84,18 +280,21 @@ async def sse_chat_events(
 
     async def event_generator():
         """Генератор, который слушает очередь и отправляет данные клиенту."""
-        queue = await broadcaster.subscribe(chat_id)
+        # EventSource сам присылает Last-Event-ID при переподключении — досылаем только пропущенное
+        subscription = await broadcaster.subscribe(chat_id, request.headers.get("last-event-id"))
         try:
             while True:
-                # Ждем новое событие (словарь) из очереди
-                event_data_dict = await queue.get()
+                # В очереди уже закодированные кадры SSE (bytes) — отдаем как есть
+                frame = await subscription.get()
 
-                yield event_data_dict
+                yield frame
 
-        except asyncio.CancelledError:
-            # Клиент отключился
-            broadcaster.unsubscribe(chat_id, queue)
-            raise
+        except SubscriptionClosed:
+            # Отключен политикой медленного клиента или после resync
+            return
+        finally:
+            # Клиент отключился или поток завершен
+            broadcaster.unsubscribe(chat_id, subscription)
 
     return EventSourceResponse(event_generator())
 
@@ -107,16 +306,117 @@ class TTSRequest(BaseModel):
     gain_db: float = 0
     reverb_time: float = 0
     reverb_decay: float = 0
+    # Потоковый режим: аудио отдается по предложениям по мере синтеза (mp3 — все равно целиком)
+    stream: bool = False
+    # Формат ответа (wav, opus, ogg, mp3); если не задан — выбирается по Accept
+    format: Optional[str] = None
+    # Частота дискретизации ответа (по умолчанию — частота модели)
+    sample_rate: Optional[int] = Field(None, ge=8000, le=48000)
+
+    def synthesis_params(self) -> dict:
+        return self.model_dump(exclude={"text", "stream", "format", "sample_rate"})
+
+
+def _tts_http_error(e: Exception) -> HTTPException:
+    """Переводит ошибки пула/синтеза в HTTP-ответы."""
+    if isinstance(e, PoolSaturatedError):
+        return HTTPException(
+            status_code=429,
+            detail="Сервис озвучки перегружен, попробуйте позже.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    if isinstance(e, ModelNotReadyError):
+        return HTTPException(
+            status_code=503,
+            detail="Модель озвучки еще загружается, попробуйте позже.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    if isinstance(e, asyncio.TimeoutError):
+        return HTTPException(status_code=504, detail="Превышено время ожидания синтеза речи.")
+    if isinstance(e, ValueError):
+        return HTTPException(status_code=400, detail=str(e))
+    print(f"TTS synthesis error: {e}")
+    return HTTPException(status_code=500, detail="Ошибка при генерации речи.")
+
+
+def _etag_for(key: str) -> str:
+    return f'"{key}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
+
+
+@router.get("/tts/audio/{cache_key}")
+@inject
+async def tts_cached_audio(
+    request: Request,
+    cache_key: str,
+    tts_cache: TTSAudioCache = Depends(Provide[Container.tts_cache])
+):
+    """Отдает уже синтезированный сегмент (озвучка ответа модели по ходу генерации)."""
+    user_id = get_current_user_id_from_request(request)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    etag = _etag_for(cache_key)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    cached = await tts_cache.get(cache_key)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Аудио не найдено или уже вытеснено из кэша.")
+    return Response(
+        content=cached.data,
+        media_type=cached.media_type,
+        headers={"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    )
+
+
+@router.get("/tts", response_class=StreamingResponse)
+@inject
+async def text_to_speech_get(
+    request: Request,
+    tts_req: TTSRequest = Depends(),  # параметры в query — такой ответ кэшируется браузером
+    tts_service: "LocalTextToVoiceService" = Depends(Provide[Container.local_tts_service]),
+    tts_pool: BoundedWorkerPool = Depends(Provide[Container.tts_worker_pool]),
+    tts_batcher: TTSBatchScheduler = Depends(Provide[Container.tts_batcher]),
+    tts_cache: TTSAudioCache = Depends(Provide[Container.tts_cache])
+):
+    return await _handle_tts(request, tts_req, tts_service, tts_pool, tts_batcher, tts_cache)
+
 
 @router.post("/tts", response_class=StreamingResponse)
 @inject
 async def text_to_speech(
     request: Request,
     tts_req: TTSRequest = Body(...),  # теперь принимаем JSON
-    tts_service: "LocalTextToVoiceService" = Depends(Provide[Container.local_tts_service])
+    tts_service: "LocalTextToVoiceService" = Depends(Provide[Container.local_tts_service]),
+    tts_pool: BoundedWorkerPool = Depends(Provide[Container.tts_worker_pool]),
+    tts_batcher: TTSBatchScheduler = Depends(Provide[Container.tts_batcher]),
+    tts_cache: TTSAudioCache = Depends(Provide[Container.tts_cache])
+):
+    return await _handle_tts(request, tts_req, tts_service, tts_pool, tts_batcher, tts_cache)
+
+
+async def _handle_tts(
+    request: Request,
+    tts_req: TTSRequest,
+    tts_service: LocalTextToVoiceService,
+    tts_pool: BoundedWorkerPool,
+    tts_batcher: TTSBatchScheduler,
+    tts_cache: TTSAudioCache
 ):
     """
     Локальный TTS с использованием Silero (вместо gTTS).
+    Синтез выполняется в отдельном пуле потоков, чтобы не блокировать event loop;
+    одновременные запросы объединяются в пачки планировщиком.
+    Готовое аудио кэшируется по хэшу параметров; хэш же служит ETag,
+    поэтому повторный запрос с If-None-Match получает 304 без тела.
     """
 
     user_id = get_current_user_id_from_request(request)
@@ -126,24 +426,101 @@ async def text_to_speech(
     if not tts_req.text.strip():
         raise HTTPException(status_code=400, detail="Text content is required.")
 
-    try:
-        audio_bytes = tts_service.synthesize_to_bytes(
-            text=tts_req.text,
-            speaker=tts_req.speaker,
-            speed=tts_req.speed,
-            pitch_semitones=tts_req.pitch_semitones,
-            gain_db=tts_req.gain_db,
-            reverb_time=tts_req.reverb_time,
-            reverb_decay=tts_req.reverb_decay,
+    # Согласование формата: параметр format важнее заголовка Accept
+    output_format = negotiate_format(tts_req.format, request.headers.get("accept"))
+    if output_format is None:
+        raise HTTPException(
+            status_code=406,
+            detail=f"Неподдерживаемый формат аудио. Доступные: {', '.join(OUTPUT_FORMATS)}"
         )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        print(f"TTS synthesis error: {e}")
-        raise HTTPException(status_code=500, detail="Ошибка при генерации речи.")
+    fmt = OUTPUT_FORMATS[output_format]
+    output_sample_rate = pick_sample_rate(output_format, tts_req.sample_rate or tts_service.sample_rate)
 
-    return StreamingResponse(
-        io.BytesIO(audio_bytes),
-        media_type="audio/wav",
-        headers={"Content-Disposition": "inline; filename=tts_audio.wav"}
+    params = tts_req.synthesis_params()
+    params.update(output_format=output_format, output_sample_rate=output_sample_rate)
+    cache_key = tts_cache.make_key(
+        text=tts_req.text,
+        silence_before=0.0,
+        silence_after=0.0,
+        stream=tts_req.stream,
+        **params,
+        **tts_service.cache_identity()
     )
+    headers = {
+        "Content-Disposition": f"inline; filename=tts_audio.{fmt.extension}",
+        "ETag": _etag_for(cache_key),
+        "Cache-Control": "private, max-age=86400",
+        "Vary": "Accept",
+    }
+
+    if _etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers={k: headers[k] for k in ("ETag", "Cache-Control", "Vary")})
+
+    cached = await tts_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached.data, media_type=cached.media_type, headers=headers)
+
+    # MP3 потоком не отдается (см. OutputFormat.streamable) — тогда файл целиком
+    if tts_req.stream and fmt.streamable:
+        return await _stream_tts(
+            tts_req, tts_service, tts_pool, tts_cache, cache_key, headers, output_format, output_sample_rate
+        )
+
+    try:
+        audio_bytes = await tts_batcher.synthesize(text=tts_req.text, **params)
+    except Exception as e:
+        raise _tts_http_error(e)
+
+    await tts_cache.put(cache_key, audio_bytes, output_format)
+    return Response(content=audio_bytes, media_type=fmt.media_type, headers=headers)
+
+
+async def _stream_tts(
+    tts_req: TTSRequest,
+    tts_service: LocalTextToVoiceService,
+    tts_pool: BoundedWorkerPool,
+    tts_cache: TTSAudioCache,
+    cache_key: str,
+    headers: dict,
+    output_format: str,
+    output_sample_rate: int
+) -> StreamingResponse:
+    """
+    Потоковый TTS: текст режется на предложения, каждое синтезируется и кодируется
+    отдельной задачей пула, клиент получает байты сразу после первого предложения
+    (для WAV — потоковый заголовок и PCM, для OGG/MP3 — готовые страницы кодека).
+    Полностью отданный поток сохраняется в кэш.
+    """
+    sentences = split_into_sentences(tts_req.text)
+    params = tts_req.synthesis_params()
+    try:
+        state = tts_service.start_stream(output_format, output_sample_rate)
+    except Exception as e:
+        raise _tts_http_error(e)
+
+    # Первый сегмент синтезируем до начала ответа, чтобы ошибки
+    # (неизвестный голос, перегрузка пула) вернулись нормальным HTTP-статусом.
+    try:
+        tts_service.validate_speaker(tts_req.speaker)
+        first_chunk = await tts_pool.submit(tts_service.synthesize_segment, sentences[0], state, **params)
+    except Exception as e:
+        raise _tts_http_error(e)
+
+    async def audio_chunks():
+        chunks = [first_chunk]
+        yield first_chunk
+        try:
+            for sentence in sentences[1:]:
+                chunk = await tts_pool.submit(tts_service.synthesize_segment, sentence, state, **params)
+                chunks.append(chunk)
+                yield chunk
+            chunk = await tts_pool.submit(tts_service.finish_stream, state)
+        except Exception as e:
+            # Заголовки уже отправлены — просто обрываем поток (и не кэшируем его)
+            print(f"TTS stream error: {e}")
+            return
+        chunks.append(chunk)
+        yield chunk
+        await tts_cache.put(cache_key, b"".join(chunks), output_format)
+
+    return StreamingResponse(audio_chunks(), media_type=OUTPUT_FORMATS[output_format].media_type, headers=headers)
@@ -1,5 +1,4 @@
 # endpoints/web_pages.py
-from datetime import datetime
 from fastapi import (
     APIRouter, Request, Depends, Form
 )
@@ -9,10 +8,10 @@ from fastapi.responses import (
 from fastapi.templating import Jinja2Templates
 from dependency_injector.wiring import inject, Provide
 from containers import Container
-from dtos import MessageDTO
 from repositories.user_repo import UserRepository
 from repositories.chat_repo import ChatRepository
-from repositories.message_repo import MessageRepository
+from repositories.message_repo import MessageRepository, encode_message_cursor
+import settings
 from typing import Optional
 from .utils import get_current_user_id_from_request, COOKIE_NAME
 
@@ -52,7 +51,7 @@ async def chats_page(
     user_id = get_current_user_id_from_request(request)
     if not user_id:
         return RedirectResponse(url="/", status_code=302)
-    chats = await cr.list_chats_for_user(user_id)
+    chats = await cr.list_chat_summaries(user_id)
     return templates.TemplateResponse("chat.html", {"request": request, "user_id": user_id, "chats": chats, "selected_chat": None, "messages": []})
 
 @router.post("/chats/new")
@@ -80,22 +79,10 @@ async def open_chat(
     if not user_id:
         return RedirectResponse(url="/", status_code=302)
 
-    chats = await cr.list_chats_for_user(user_id)
-    messages_raw = await mr.get_messages_for_chat(chat_id)  # SQLAlchemy objects
-
-    # Pydantic модели для серверного рендера (с datetime)
-    messages_for_render = [MessageDTO.model_validate(m) for m in messages_raw]
-
-    # JSON-safe словари для JS (datetime -> ISO строки и т.д.)
-    initial_messages = [
-        {
-            "id": m.id,
-            "content": m.content,
-            "message_type": m.message_type.value,
-            "created_at": m.created_at.isoformat() if isinstance(m.created_at, datetime) else str(m.created_at),
-        }
-        for m in messages_for_render
-    ]
+    chats = await cr.list_chat_summaries(user_id)
+    # Только последняя страница; более старые сообщения JS подгружает при прокрутке вверх
+    # Строки без ORM-объектов и без MessageDTO: шаблону нужны только атрибуты
+    messages, next_cursor = await mr.get_message_rows_page(chat_id, limit=settings.CHAT_PAGE_SIZE)
 
     return templates.TemplateResponse(
         "chat.html",
@@ -104,9 +91,9 @@ async def open_chat(
             "user_id": user_id,
             "chats": chats,
             "selected_chat": chat_id,
-            # messages — оставляем для partials/messages.html (ожидает datetime)
-            "messages": messages_for_render,
-            # initial_messages — для вставки в JS
-            "initial_messages": initial_messages,
+            # messages — для partials/messages.html (created_at — datetime, типы — enum)
+            "messages": messages,
+            # курсор для подгрузки более старых сообщений (None — история загружена целиком)
+            "next_cursor": encode_message_cursor(next_cursor) if next_cursor else None,
         }
     )
\ No newline at end of file
@@ -1,13 +1,17 @@
 # main.py
+import asyncio
 import uvicorn
 from fastapi import FastAPI
-from db import init_db
+from db import init_db, recover_interrupted_messages, run_recovery_sweeps
+import settings
 # --- ИЗМЕНЕНИЯ ---
 # Импортируем роутеры из новой директории
 from endpoints.web_pages import router as web_pages_router
 from endpoints.web_actions import router as web_actions_router
 from endpoints.api_users import router as api_users_router
 from endpoints.api_messages import router as api_messages_router
+from endpoints.api_metrics import router as api_metrics_router
+from endpoints.api_health import router as api_health_router
 # --- КОНЕЦ ИЗМЕНЕНИЙ ---
 
 from fastapi.staticfiles import StaticFiles
@@ -20,6 +24,8 @@ import endpoints.web_pages as web_pages_module
 import endpoints.web_actions as web_actions_module
 import endpoints.api_users as api_users_module
 import endpoints.api_messages as api_messages_module
+import endpoints.api_metrics as api_metrics_module
+import endpoints.api_health as api_health_module
 # --- КОНЕЦ ИЗМЕНЕНИЙ ---
 
 import services.chat_service as chat_service_module
@@ -27,7 +33,24 @@ import services.chat_service as chat_service_module
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    recovered = await recover_interrupted_messages(settings.STREAM_RECOVERY_GRACE_S)
+    if recovered:
+        print(f"Восстановлено прерванных ответов: {recovered}")
+    recovery = asyncio.create_task(
+        run_recovery_sweeps(settings.STREAM_RECOVERY_GRACE_S, settings.STREAM_RECOVERY_INTERVAL_S)
+    )
+    await container.broadcaster().start()
+    # Модели грузятся в фоне: сервер начинает отвечать сразу,
+    # готовность моделей видна в /health/ready
+    model_loading = asyncio.create_task(container.model_registry().load_all())
     yield
+    model_loading.cancel()
+    recovery.cancel()
+    # Дописываем в базу отложенные сообщения до закрытия соединений
+    await container.message_writer().close()
+    await container.broadcaster().close()
+    container.tts_worker_pool().shutdown()
+    container.stt_worker_pool().shutdown()
 
 app = FastAPI(title="Async Chat App with DTOs & Repositories", lifespan=lifespan)
 
@@ -39,6 +62,8 @@ container.wire(modules=[
     web_actions_module,
     api_users_module,
     api_messages_module,
+    api_metrics_module,
+    api_health_module,
     chat_service_module
 ])
 
@@ -47,6 +72,8 @@ app.include_router(web_pages_router)
 app.include_router(web_actions_router)
 app.include_router(api_users_router)
 app.include_router(api_messages_router)
+app.include_router(api_metrics_router)
+app.include_router(api_health_router)
 # --- КОНЕЦ ИЗМЕНЕНИЙ ---
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -1,46 +1,77 @@
 # models.py
 import enum
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Text, Index, text
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
 
+# Связи не загружаются неявно (lazy="raise"): каждый запрос сам решает, что
+# подгрузить (selectinload/joinedload), а случайное обращение к незагруженной
+# связи — ошибка, а не скрытый N+1. Каскадное удаление делает база (ON DELETE CASCADE).
+
 class MessageType(enum.Enum):
     USER = "user"
     MODEL = "model"
 
 
+class MessageStatus(enum.Enum):
+    STREAMING = "streaming"  # ответ модели еще генерируется (в базе — последняя контрольная точка)
+    COMPLETE = "complete"
+    FAILED = "failed"        # генерация упала или процесс завершился посреди ответа
+    CANCELLED = "cancelled"  # генерацию остановили (новое сообщение или закрытый чат)
+
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(150), unique=True, nullable=False, index=True)
     password = Column(String(256), nullable=True)  # можно хранить хэш (опционально)
 
-    chats = relationship("Chat", back_populates="user", cascade="all, delete-orphan", lazy="selectin")
+    chats = relationship("Chat", back_populates="user", cascade="all, delete-orphan", lazy="raise",
+                         passive_deletes=True)
 
 
 class Chat(Base):
     __tablename__ = "chats"
+    __table_args__ = (
+        # Список чатов пользователя, новые сверху
+        Index("ix_chats_user_created", "user_id", "created_at"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
 
-    user = relationship("User", back_populates="chats", lazy="joined")
-    messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan", lazy="selectin",
-                            order_by="Message.created_at")
+    # Сводка старых реплик, не помещающихся в контекст LLM,
+    # и ID последнего сообщения, которое в нее уже вошло
+    summary = Column(Text, nullable=True)
+    summary_upto_id = Column(Integer, nullable=True)
+
+    user = relationship("User", back_populates="chats", lazy="raise")
+    messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan", lazy="raise",
+                            passive_deletes=True, order_by="Message.created_at")
 
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # История и пагинация по ключу (created_at, id) внутри чата
+        Index("ix_messages_chat_created_id", "chat_id", "created_at", "id"),
+        # Поиск незавершенных ответов при старте; в индекс попадают только они
+        Index("ix_messages_streaming", "status", sqlite_where=text("status = 'STREAMING'")),
+    )
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text, nullable=False)
     message_type = Column(Enum(MessageType), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
+    status = Column(Enum(MessageStatus), nullable=False, default=MessageStatus.COMPLETE,
+                    server_default=MessageStatus.COMPLETE.name)
+    # Время последней записи текста (контрольной точки для ответа в процессе генерации)
+    updated_at = Column(DateTime, nullable=True)
 
     # --- НОВАЯ КОЛОНКА ---
     user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
 
-    chat = relationship("Chat", back_populates="messages", lazy="joined")
\ No newline at end of file
+    chat = relationship("Chat", back_populates="messages", lazy="raise")
\ No newline at end of file
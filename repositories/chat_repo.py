@@ -1,30 +1,113 @@
 # repositories/chat_repo.py
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
-from models import Chat
-from typing import List, Optional
+from sqlalchemy import select, delete, update, func
+from sqlalchemy.orm import aliased, selectinload
+from models import Chat, Message
+from typing import Callable, List, Optional, Tuple
+from services.history_cache import HistoryCache
+
+# Сколько символов последнего сообщения показывать в списке чатов
+PREVIEW_CHARS = 80
 
 class ChatRepository:
-    def __init__(self, session: AsyncSession):
+    def __init__(
+            self,
+            session: AsyncSession,
+            cache: Optional[HistoryCache] = None,
+            on_delete: Optional[Callable[[int], None]] = None
+    ):
         self.session = session
+        # Кэш списков чатов пользователей (list_chat_summaries); сбрасывается при записи
+        self.cache = cache
+        # Вызывается с chat_id после удаления чата (сброс состояния чата в памяти сервисов)
+        self.on_delete = on_delete
 
     async def create_chat(self, user_id: int, title: str) -> Chat:
         chat = Chat(user_id=user_id, title=title)
         self.session.add(chat)
         await self.session.commit()
         await self.session.refresh(chat)
+        if self.cache is not None:
+            self.cache.invalidate_user(user_id)
         return chat
 
     async def list_chats_for_user(self, user_id: int) -> List[Chat]:
+        """Чаты пользователя без сообщений (связи не загружаются)."""
         q = await self.session.execute(
             select(Chat).where(Chat.user_id == user_id).order_by(Chat.created_at.desc())
         )
         return q.scalars().all()
 
-    async def get_chat(self, chat_id: int) -> Optional[Chat]:
-        q = await self.session.execute(select(Chat).where(Chat.id == chat_id))
+    async def list_chat_summaries(self, user_id: int, preview_chars: int = PREVIEW_CHARS) -> list:
+        """
+        Список чатов для боковой панели и API одним запросом: число сообщений
+        и начало последнего из них считаются в базе, сами сообщения не читаются.
+        Строки совместимы с ChatSummaryDTO.
+        """
+        use_cache = self.cache is not None and preview_chars == PREVIEW_CHARS
+        if use_cache:
+            cached = self.cache.get_chat_list(user_id)
+            if cached is not None:
+                return cached
+        stats = (
+            select(
+                Message.chat_id,
+                func.count(Message.id).label("message_count"),
+                func.max(Message.id).label("last_id"),
+            )
+            # Агрегируем только сообщения чатов этого пользователя (по индексу chat_id)
+            .where(Message.chat_id.in_(select(Chat.id).where(Chat.user_id == user_id)))
+            .group_by(Message.chat_id)
+            .subquery()
+        )
+        last = aliased(Message)
+        q = await self.session.execute(
+            select(
+                Chat.id,
+                Chat.title,
+                Chat.created_at,
+                func.coalesce(stats.c.message_count, 0).label("message_count"),
+                func.substr(last.content, 1, preview_chars).label("last_message_preview"),
+                last.created_at.label("last_message_at"),
+            )
+            .outerjoin(stats, stats.c.chat_id == Chat.id)
+            .outerjoin(last, last.id == stats.c.last_id)
+            .where(Chat.user_id == user_id)
+            .order_by(Chat.created_at.desc())
+        )
+        rows = q.all()
+        if use_cache:
+            self.cache.put_chat_list(user_id, rows)
+        return rows
+
+    async def get_chat(self, chat_id: int, with_messages: bool = False) -> Optional[Chat]:
+        """Чат по ID; сообщения загружаются только по явному with_messages=True."""
+        query = select(Chat).where(Chat.id == chat_id)
+        if with_messages:
+            query = query.options(selectinload(Chat.messages))
+        q = await self.session.execute(query)
         return q.scalars().first()
 
     async def delete_chat(self, chat_id: int) -> None:
         await self.session.execute(delete(Chat).where(Chat.id == chat_id))
         await self.session.commit()
+        if self.cache is not None:
+            self.cache.invalidate_chat(chat_id)
+        if self.on_delete is not None:
+            self.on_delete(chat_id)
+
+    async def get_summary(self, chat_id: int) -> Tuple[str, int]:
+        """Сводка старых реплик чата и ID последнего вошедшего в нее сообщения."""
+        q = await self.session.execute(
+            select(Chat.summary, Chat.summary_upto_id).where(Chat.id == chat_id)
+        )
+        row = q.first()
+        if row is None:
+            return "", 0
+        return row.summary or "", row.summary_upto_id or 0
+
+    async def update_summary(self, chat_id: int, summary: str, upto_id: int) -> None:
+        await self.session.execute(
+            update(Chat).where(Chat.id == chat_id).values(summary=summary, summary_upto_id=upto_id)
+        )
+        await self.session.commit()
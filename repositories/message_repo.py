@@ -1,20 +1,103 @@
+import base64
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import update
-from models import Message, \
+from sqlalchemy import bindparam, insert, update, tuple_, text, DateTime, Enum as SAEnum
+from models import Message, MessageStatus, \
     MessageType  # Предполагается, что 'Message' имеет поля 'id', 'chat_id', 'user_id', 'content', 'message_type', 'created_at'
-from typing import List
+from typing import Dict, List
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Tuple
+from services.history_cache import HistoryCache
+from services.search_query import build_match_query
+
+# Курсор страницы истории: (created_at, id) самого старого сообщения на странице
+MessageCursor = Tuple[datetime, int]
+
+
+def encode_message_cursor(cursor: MessageCursor) -> str:
+    """Непрозрачная строка курсора для API."""
+    created_at, message_id = cursor
+    raw = f"{created_at.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_message_cursor(value: str) -> MessageCursor:
+    """Обратное к encode_message_cursor; ValueError для испорченного курсора."""
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        created_at, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except Exception as e:
+        raise ValueError(f"Некорректный курсор: {value!r}") from e
+
+
+# Курсор страницы поиска: (bm25, id) последнего результата на странице
+SearchCursor = Tuple[float, int]
+
+
+def encode_search_cursor(cursor: SearchCursor) -> str:
+    rank, message_id = cursor
+    # repr(float) восстанавливается без потерь — сравнение с bm25 в базе точное
+    raw = f"{rank!r}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_search_cursor(value: str) -> SearchCursor:
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        rank, message_id = raw.rsplit("|", 1)
+        return float(rank), int(message_id)
+    except Exception as e:
+        raise ValueError(f"Некорректный курсор: {value!r}") from e
+
+
+# Чаты пользователя ограничивают поиск внутри FTS (колонка chat_id индекса),
+# а не фильтром по всем совпадениям базы; вес chat_id в bm25 нулевой — ранжирует только текст
+_SEARCH_SQL = """
+WITH scope AS (
+    SELECT :content_match || ' AND chat_id : (' || coalesce(group_concat(id, ' OR '), '0') || ')' AS match
+    FROM chats WHERE user_id = :user_id {chat_filter}
+),
+hits AS MATERIALIZED (
+    SELECT r.id, r.rank
+    FROM (
+        SELECT messages_fts.rowid AS id, bm25(messages_fts, 1.0, 0.0) AS rank
+        FROM messages_fts WHERE messages_fts MATCH (SELECT match FROM scope)
+    ) AS r
+    {after_filter}
+    ORDER BY r.rank, r.id
+    LIMIT :limit
+)
+SELECT hits.id, hits.rank, m.chat_id, c.title AS chat_title, m.message_type, m.created_at, m.status, m.content
+FROM hits
+JOIN messages AS m ON m.id = hits.id
+JOIN chats AS c ON c.id = m.chat_id
+ORDER BY hits.rank, hits.id
+"""
+
+
+def exchange_rows(chat_id: int, content: str, user_id: Optional[int]) -> List[dict]:
+    """Строки для вставки: сообщение пользователя и пустой плейсхолдер ответа модели."""
+    return [
+        # Одинаковый набор ключей у строк — один INSERT на всю группу
+        {"chat_id": chat_id, "content": content, "message_type": MessageType.USER, "user_id": user_id,
+         "status": MessageStatus.COMPLETE, "updated_at": None},
+        {"chat_id": chat_id, "content": "", "message_type": MessageType.MODEL, "user_id": None,
+         "status": MessageStatus.STREAMING, "updated_at": datetime.utcnow()},
+    ]
 
 
 class MessageRepository:
     """
     Репозиторий для управления сообщениями в базе данных.
+
+    Если передан cache, последняя страница чата читается через него,
+    а все записи (после коммита) дописывают и обновляют закэшированные окна.
     """
 
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, cache: Optional[HistoryCache] = None):
         self.session = session
+        self.cache = cache
 
     async def add_message(
             self,
@@ -24,25 +107,150 @@ class MessageRepository:
             user_id: Optional[int] = None  # <-- ДОБАВЛЕНО: Теперь user_id опционален
     ) -> Message:
         """Сохраняет новое сообщение в базу данных."""
-        message = Message(
-            chat_id=chat_id,
-            content=content,
-            message_type=message_type,
-            user_id=user_id  # <-- ПЕРЕДАЕМ user_id в конструктор модели
-        )
-        self.session.add(message)
+        [message] = await self.insert_messages([{
+            "chat_id": chat_id,
+            "content": content,
+            "message_type": message_type,
+            "user_id": user_id,  # <-- ПЕРЕДАЕМ user_id в конструктор модели
+        }])
         await self.session.commit()
-        await self.session.refresh(message)
+        self.remember_inserted([message])
         return message
 
-    async def update_message_content(self, message_id: int, new_content: str):
+    async def add_exchange(self, chat_id: int, content: str, user_id: Optional[int]) -> Tuple[Message, Message]:
+        """
+        Сообщение пользователя и пустой плейсхолдер ответа модели —
+        одной транзакцией (один коммит вместо двух коммитов с refresh).
+        """
+        user_msg, model_msg = await self.insert_messages(exchange_rows(chat_id, content, user_id))
+        await self.session.commit()
+        self.remember_inserted([user_msg, model_msg])
+        return user_msg, model_msg
+
+    async def insert_messages(self, rows: List[dict]) -> List[Message]:
+        """
+        Вставляет строки одним INSERT ... RETURNING без коммита; сообщения
+        возвращаются в порядке rows, со всеми полями (id, created_at) без refresh.
+        """
+        if not rows:
+            return []
+        q = await self.session.scalars(
+            insert(Message).returning(Message, sort_by_parameter_order=True),
+            rows,
+        )
+        return list(q.all())
+
+    async def update_contents(
+            self,
+            contents: Dict[int, Tuple[str, Optional[MessageStatus]]],
+            streaming_only: bool = False
+    ) -> None:
+        """
+        Обновляет текст (и статус, если он не None) нескольких сообщений
+        одним executemany, без коммита. Это UPDATE таблицы по id, а не ORM:
+        удаленное к этому моменту сообщение просто не обновится (0 строк — не ошибка).
+        streaming_only — менять только строки, которые еще в статусе streaming.
+        """
+        if not contents:
+            return
+        now = datetime.utcnow()
+        table = Message.__table__
+        # Строки со статусом и без — разные наборы колонок, у каждого свой UPDATE
+        groups: Dict[bool, List[dict]] = {}
+        for message_id, (content, status) in contents.items():
+            row = {"b_id": message_id, "b_content": content, "b_updated_at": now}
+            if status is not None:
+                row["b_status"] = status
+            groups.setdefault(status is not None, []).append(row)
+        for with_status, rows in groups.items():
+            values = {"content": bindparam("b_content"), "updated_at": bindparam("b_updated_at")}
+            if with_status:
+                values["status"] = bindparam("b_status")
+            stmt = update(table).where(table.c.id == bindparam("b_id")).values(values)
+            if streaming_only:
+                stmt = stmt.where(table.c.status == MessageStatus.STREAMING)
+            await self.session.execute(stmt, rows)
+
+    async def update_streaming_contents(
+            self,
+            contents: Dict[int, Tuple[int, str, Optional[MessageStatus]]]
+    ) -> Dict[int, Tuple[str, Optional[MessageStatus]]]:
+        """
+        Текст стримящихся ответов: message_id -> (chat_id, текст, статус или None), без коммита.
+
+        Пишутся только сообщения, которые все еще streaming и лежат в том же
+        чате. Иначе сообщение удалено вместе с чатом, а его id мог уже
+        достаться новому сообщению (SQLite переиспользует наибольший rowid) —
+        такое обновление пропускается, чужой текст не перетирается.
+        Возвращает примененные обновления в виде для remember_updated.
+        """
+        if not contents:
+            return {}
+        q = await self.session.execute(
+            select(Message.id, Message.chat_id).where(
+                Message.id.in_(list(contents)),
+                Message.status == MessageStatus.STREAMING,
+            )
+        )
+        applied = {
+            row.id: contents[row.id][1:]
+            for row in q.all()
+            if row.chat_id == contents[row.id][0]
+        }
+        await self.update_contents(applied, streaming_only=True)
+        return applied
+
+    def remember_inserted(self, messages: List[Message]) -> None:
+        """Хук кэша для вставок insert_messages; вызывать после коммита."""
+        if self.cache is not None:
+            self.cache.append(messages)
+
+    def remember_updated(self, contents: Dict[int, Tuple[str, Optional[MessageStatus]]]) -> None:
+        """Хук кэша для обновлений update_contents; вызывать после коммита."""
+        if self.cache is not None:
+            for message_id, (content, status) in contents.items():
+                self.cache.update(message_id, content, status)
+
+    async def finalize_interrupted(self, stale_before: datetime, marker: str) -> int:
+        """
+        Ответы, оставшиеся в статусе streaming после падения процесса:
+        текст последней контрольной точки сохраняется с пометкой marker,
+        статус — failed. Трогаем только не обновлявшиеся с stale_before
+        (их точно не пишет другой живой воркер).
+        """
+        q = await self.session.execute(
+            select(Message.id, Message.content).where(
+                Message.status == MessageStatus.STREAMING,
+                (Message.updated_at < stale_before) | (Message.updated_at.is_(None)),
+            )
+        )
+        rows = q.all()
+        if not rows:
+            return 0
+        contents = {
+            row.id: ((row.content + marker) if row.content else marker.strip(), MessageStatus.FAILED)
+            for row in rows
+        }
+        await self.update_contents(contents, streaming_only=True)
+        await self.session.commit()
+        self.remember_updated(contents)
+        return len(rows)
+
+    async def update_message_content(
+            self,
+            message_id: int,
+            new_content: str,
+            status: MessageStatus = MessageStatus.COMPLETE
+    ):
         """Обновляет содержимое существующего сообщения по ID."""
-        message = await self.session.get(Message, message_id)
-        if message:
-            message.content = new_content
-            await self.session.commit()
-            return True
-        return False
+        result = await self.session.execute(
+            update(Message)
+            .where(Message.id == message_id)
+            .values(content=new_content, status=status, updated_at=datetime.utcnow())
+        )
+        await self.session.commit()
+        self.remember_updated({message_id: (new_content, status)})
+        return result.rowcount > 0
 
     async def get_messages_for_chat(self, chat_id: int) -> List[Message]:
         """
@@ -55,6 +263,110 @@ class MessageRepository:
         )
         return q.scalars().all()
 
+    async def get_messages_page(
+            self,
+            chat_id: int,
+            limit: int = 50,
+            before: Optional[MessageCursor] = None
+    ) -> Tuple[List[Message], Optional[MessageCursor]]:
+        """
+        Страница истории чата: до limit сообщений старше курсора before
+        (без него — самые новые), по возрастанию времени.
+        Пагинация по ключу (created_at, id): стоимость не зависит от глубины страницы.
+        Второе значение — курсор следующей (более старой) страницы или None, если это начало чата.
+        Последняя страница (before=None) при включенном кэше отдается из него
+        неизменяемыми снимками CachedMessage с теми же полями.
+        """
+        if before is None and self.cache is not None:
+            cached = self.cache.get_latest(chat_id, limit)
+            if cached is not None:
+                return cached
+        q = await self.session.execute(self._page_query(select(Message), chat_id, limit, before))
+        return self._page_result(list(q.scalars().all()), chat_id, limit, before)
+
+    async def get_message_rows_page(
+            self,
+            chat_id: int,
+            limit: int = 50,
+            before: Optional[MessageCursor] = None
+    ) -> Tuple[list, Optional[MessageCursor]]:
+        """
+        То же, что get_messages_page, но без ORM-объектов: только нужные
+        колонки кортежами (Row с доступом по атрибутам). Для ответов, которые
+        сразу сериализуются (dtos.dump_messages_json) или рендерятся в шаблон.
+        """
+        if before is None and self.cache is not None:
+            cached = self.cache.get_latest(chat_id, limit)
+            if cached is not None:
+                return cached
+        q = await self.session.execute(self._page_query(
+            select(Message.id, Message.chat_id, Message.user_id, Message.content,
+                   Message.message_type, Message.created_at, Message.status),
+            chat_id, limit, before,
+        ))
+        return self._page_result(list(q.all()), chat_id, limit, before)
+
+    @staticmethod
+    def _page_query(query, chat_id: int, limit: int, before: Optional[MessageCursor]):
+        query = query.where(Message.chat_id == chat_id)
+        if before is not None:
+            query = query.where(tuple_(Message.created_at, Message.id) < tuple_(*before))
+        # limit + 1: лишняя строка показывает, есть ли страница старше
+        return query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1)
+
+    def _page_result(self, messages: list, chat_id: int, limit: int, before: Optional[MessageCursor]):
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            oldest = messages[-1]
+            next_cursor = (oldest.created_at, oldest.id)
+        messages.reverse()
+        if before is None and self.cache is not None:
+            self.cache.put_latest(chat_id, messages, complete=next_cursor is None)
+        return messages, next_cursor
+
+    async def search_messages(
+            self,
+            user_id: int,
+            query: str,
+            chat_id: Optional[int] = None,
+            limit: int = 20,
+            after: Optional[SearchCursor] = None
+    ) -> Tuple[list, Optional[SearchCursor]]:
+        """
+        Полнотекстовый поиск по сообщениям чатов пользователя (или одного его чата)
+        по индексу messages_fts. Результаты — от лучших по bm25; пагинация по ключу
+        (bm25, id) курсором after. Строки: id, rank, chat_id, chat_title, message_type,
+        created_at, status, content (фрагмент с подсветкой — services.search_query.make_snippet).
+        ValueError — в запросе нет слов; без FTS5 в SQLite — OperationalError.
+        """
+        match = build_match_query(query)
+        if match is None:
+            raise ValueError("Пустой поисковый запрос")
+        chat_filter = after_filter = ""
+        params = {
+            "content_match": f"content : ({match})", "user_id": user_id, "limit": limit + 1,
+        }
+        if chat_id is not None:
+            # Чужой chat_id не найдет ничего: он не входит в чаты пользователя
+            chat_filter = "AND id = :chat_id"
+            params["chat_id"] = chat_id
+        if after is not None:
+            after_filter = "WHERE r.rank > :after_rank OR (r.rank = :after_rank AND r.id > :after_id)"
+            params["after_rank"], params["after_id"] = after
+        statement = text(_SEARCH_SQL.format(chat_filter=chat_filter, after_filter=after_filter)).columns(
+            message_type=SAEnum(MessageType),
+            created_at=DateTime(),
+            status=SAEnum(MessageStatus),
+        )
+        q = await self.session.execute(statement, params)
+        rows = list(q.all())
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1].rank, rows[-1].id)
+        return rows, next_cursor
+
     async def get_recent_messages_for_chat(self, chat_id: int, limit: int = 100) -> List[Message]:
         """
         Получает последние N сообщений для контекста LLM.
@@ -66,4 +378,15 @@ class MessageRepository:
             .limit(limit)
         )
         # Результат нужно развернуть, так как мы получаем его в обратном порядке
-        return list(q.scalars().all())[::-1]
\ No newline at end of file
+        return list(q.scalars().all())[::-1]
+
+    async def get_messages_after(self, chat_id: int, after_id: int, before_id: Optional[int] = None) -> List[Message]:
+        """
+        Сообщения чата с ID в интервале (after_id, before_id), по порядку.
+        Нужны для дозагрузки в контекст LLM только новых реплик.
+        """
+        query = select(Message).where(Message.chat_id == chat_id, Message.id > after_id)
+        if before_id is not None:
+            query = query.where(Message.id < before_id)
+        q = await self.session.execute(query.order_by(Message.id))
+        return list(q.scalars().all())
@@ -0,0 +1,229 @@
+# services/audio_encoding.py
+import io
+import struct
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    name: str
+    media_type: str
+    extension: str
+    sf_format: Optional[str]  # None — пишем сами (потоковый WAV)
+    sf_subtype: Optional[str]
+    # Частоты, которые поддерживает кодек (None — любые)
+    sample_rates: Optional[Tuple[int, ...]] = None
+    # Можно ли отдавать по мере кодирования: MP3 — нельзя, libsndfile при закрытии
+    # переписывает тег Xing/LAME в начале файла, а без него декодер обрезает звук
+    streamable: bool = True
+
+
+OUTPUT_FORMATS: Dict[str, OutputFormat] = {
+    "wav": OutputFormat("wav", "audio/wav", "wav", None, None),
+    "opus": OutputFormat("opus", "audio/ogg; codecs=opus", "ogg", "OGG", "OPUS", (8000, 12000, 16000, 24000, 48000)),
+    "ogg": OutputFormat("ogg", "audio/ogg", "ogg", "OGG", "VORBIS"),
+    "mp3": OutputFormat("mp3", "audio/mpeg", "mp3", "MP3", "MPEG_LAYER_III",
+                        (8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000), streamable=False),
+}
+
+# Медиа-типы из Accept -> формат
+_ACCEPT_TYPES = {
+    "audio/ogg;codecs=opus": "opus",
+    "audio/opus": "opus",
+    "audio/ogg": "ogg",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/wav": "wav",
+    "audio/wave": "wav",
+    "audio/x-wav": "wav",
+}
+
+DEFAULT_FORMAT = "wav"
+
+
+def is_format_available(name: str) -> bool:
+    """Собран ли установленный libsndfile с нужным кодеком."""
+    fmt = OUTPUT_FORMATS.get(name)
+    if fmt is None:
+        return False
+    if fmt.sf_format is None:
+        return True
+    return fmt.sf_format in sf.available_formats() and fmt.sf_subtype in sf.available_subtypes(fmt.sf_format)
+
+
+def negotiate_format(explicit: Optional[str], accept: Optional[str]) -> Optional[str]:
+    """
+    Выбирает формат ответа: явный параметр важнее заголовка Accept.
+    Возвращает None, если клиент не принимает ни один доступный формат.
+    """
+    if explicit:
+        return explicit if is_format_available(explicit) else None
+    if not accept:
+        return DEFAULT_FORMAT
+
+    candidates: List[Tuple[float, int, str]] = []
+    for order, item in enumerate(accept.split(",")):
+        parts = [p.strip() for p in item.split(";") if p.strip()]
+        if not parts:
+            continue
+        media = parts[0].lower()
+        q = 1.0
+        params = []
+        for p in parts[1:]:
+            if p.startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+            else:
+                params.append(p.replace(" ", "").lower())
+        if q <= 0:
+            continue
+        if media in ("*/*", "audio/*"):
+            candidates.append((q, order, DEFAULT_FORMAT))
+            continue
+        key = media + "".join(f";{p}" for p in params)
+        name = _ACCEPT_TYPES.get(key) or _ACCEPT_TYPES.get(media)
+        if name and is_format_available(name):
+            candidates.append((q, order, name))
+
+    if not candidates:
+        return None
+    candidates.sort(key=lambda c: (-c[0], c[1]))
+    return candidates[0][2]
+
+
+def pick_sample_rate(name: str, requested: int) -> int:
+    """Ближайшая поддерживаемая кодеком частота не ниже запрошенной (или максимальная)."""
+    rates = OUTPUT_FORMATS[name].sample_rates
+    if not rates:
+        return requested
+    higher = [r for r in rates if r >= requested]
+    return min(higher) if higher else max(rates)
+
+
+def wav_stream_header(sample_rate: int, channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """
+    Заголовок WAV (PCM) для потоковой отдачи: итоговый размер неизвестен,
+    поэтому размеры RIFF и data выставлены в максимум (так делают стримеры).
+    """
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    unknown = 0xFFFFFFFF
+    return (
+        b'RIFF' + struct.pack('<I', unknown) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b'data' + struct.pack('<I', unknown)
+    )
+
+
+def to_pcm16(wav: np.ndarray) -> bytes:
+    return (np.clip(wav, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+class _StreamSink:
+    """
+    Файлоподобный буфер для виртуального ввода-вывода libsndfile.
+    drain() отдает байты, дописанные с прошлого вызова, — так закодированные
+    страницы уходят клиенту, не дожидаясь конца кодирования. Поздние правки
+    заголовка (запись по уже отданному смещению) клиенту не попадут — поэтому
+    поток строится только для форматов со streamable=True (OGG переписывать
+    начало не нужно, MP3 — нужно).
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+        self._drained = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        end = self._pos + len(data)
+        if end > len(self._buf):
+            self._buf.extend(b"\0" * (end - len(self._buf)))
+        self._buf[self._pos:end] = data
+        self._pos = end
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._buf) if size < 0 else min(len(self._buf), self._pos + size)
+        data = bytes(self._buf[self._pos:end])
+        self._pos = end
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self._pos, 2: len(self._buf)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = bytes(self._buf[self._drained:])
+        self._drained = len(self._buf)
+        return data
+
+
+class StreamingEncoder:
+    """
+    Потоковый кодировщик: encode() принимает очередной кусок float32-аудио
+    и возвращает уже готовые байты, close() — остаток.
+    WAV пишется как 16-битный PCM с потоковым заголовком, Opus/Vorbis в OGG —
+    через libsndfile. Форматы без streamable (MP3) не поддерживаются.
+    """
+
+    def __init__(self, format_name: str, sample_rate: int):
+        self.format = OUTPUT_FORMATS[format_name]
+        if not self.format.streamable:
+            raise ValueError(f"Формат {format_name} нельзя отдавать потоком")
+        self.sample_rate = sample_rate
+        self._header_sent = False
+        self._sink: Optional[_StreamSink] = None
+        self._file: Optional[sf.SoundFile] = None
+        if self.format.sf_format is not None:
+            self._sink = _StreamSink()
+            self._file = sf.SoundFile(
+                self._sink, mode="w", samplerate=sample_rate, channels=1,
+                format=self.format.sf_format, subtype=self.format.sf_subtype,
+            )
+
+    @property
+    def media_type(self) -> str:
+        return self.format.media_type
+
+    def encode(self, wav: np.ndarray) -> bytes:
+        if self._file is None:
+            out = to_pcm16(wav)
+            if not self._header_sent:
+                self._header_sent = True
+                out = wav_stream_header(self.sample_rate) + out
+            return out
+        self._file.write(np.asarray(wav, dtype=np.float32))
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        if self._file is None:
+            if not self._header_sent:
+                self._header_sent = True
+                return wav_stream_header(self.sample_rate)
+            return b""
+        self._file.close()
+        return self._sink.drain()
+
+
+def encode_audio(wav: np.ndarray, format_name: str, sample_rate: int) -> bytes:
+    """Кодирует целый фрагмент аудио в выбранный формат."""
+    fmt = OUTPUT_FORMATS[format_name]
+    # Файл целиком: libsndfile при закрытии дописывает заголовок (размеры WAV, тег Xing у MP3)
+    buffer = io.BytesIO()
+    if fmt.sf_format is None:
+        sf.write(buffer, wav, sample_rate, format="WAV", subtype="PCM_16")
+    else:
+        sf.write(buffer, np.asarray(wav, dtype=np.float32), sample_rate,
+                 format=fmt.sf_format, subtype=fmt.sf_subtype)
+    return buffer.getvalue()
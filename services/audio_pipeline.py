@@ -0,0 +1,132 @@
+# services/audio_pipeline.py
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+# librosa и scipy импортируются при первом использовании: они тяжелые,
+# а страницам приложения не нужны
+
+REVERB_WET = 0.7
+TARGET_PEAK = 0.98
+
+
+@lru_cache(maxsize=32)
+def impulse_response(reverb_time: float, decay: float, sample_rate: int) -> np.ndarray:
+    """
+    Экспоненциально затухающая импульсная характеристика реверберации.
+    Кэшируется по (reverb_time, decay, sample_rate); массив только для чтения,
+    потому что один и тот же объект разделяется между потоками пула.
+    """
+    n = int(sample_rate * reverb_time)
+    t = np.arange(n, dtype=np.float32)
+    ir = (decay ** (t / (sample_rate * reverb_time))).astype(np.float32)
+    ir /= (np.sum(np.abs(ir)) + 1e-9)
+    ir.setflags(write=False)
+    return ir
+
+
+def fft_convolve(wav: np.ndarray, ir: np.ndarray) -> np.ndarray:
+    """Полная свертка overlap-add через FFT: O(N log M) вместо O(N·M) у np.convolve."""
+    from scipy.signal import oaconvolve
+
+    return oaconvolve(wav, ir, mode='full').astype(np.float32, copy=False)
+
+
+class AudioPostProcessor:
+    """
+    Цепочка пост-обработки TTS: pitch → tempo → reverb → gain/normalize → паузы.
+
+    - реверберация считается FFT-сверткой (overlap-add) с кэшированной ИХ;
+    - громкость и нормализация объединены в один множитель, применяемый на месте;
+    - паузы добавляются при записи результата в заранее выделенный буфер,
+      поэтому цепочка делает одну итоговую аллокацию вместо копии на каждом шаге.
+    Входной массив может быть изменен на месте.
+    """
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+
+    def process(
+        self,
+        wav: np.ndarray,
+        speed: float = 1.0,
+        pitch_semitones: float = 0.0,
+        gain_db: float = 0.0,
+        reverb_time: float = 0.0,
+        reverb_decay: float = 0.0,
+        silence_before: float = 0.0,
+        silence_after: float = 0.0,
+        normalize: bool = True,
+    ) -> np.ndarray:
+        wav = np.asarray(wav, dtype=np.float32)
+        wav = self.pitch_shift(wav, pitch_semitones)
+        wav = self.time_stretch(wav, speed)
+
+        # Паузы добавлялись до изменения темпа, поэтому их длина масштабируется так же
+        tempo = speed if abs(speed - 1.0) >= 1e-6 else 1.0
+        b = int(round(silence_before / tempo * self.sample_rate))
+        a = int(round(silence_after / tempo * self.sample_rate))
+
+        if reverb_time > 0 and reverb_decay > 0:
+            if b or a:
+                # Хвост реверберации должен звучать и в паузе после речи
+                wav = self._pad(wav, b, a)
+                b = a = 0
+            convolved = fft_convolve(wav, impulse_response(reverb_time, reverb_decay, self.sample_rate))
+            # Свертка — новый массив, дальше работаем в нем без копий
+            out = convolved[:len(wav)]
+            out *= REVERB_WET
+            out += wav
+            wav = out
+
+        # Усиление и нормализация к пику: при нормализации gain сокращается,
+        # поэтому достаточно одного множителя.
+        if normalize:
+            peak = float(np.max(np.abs(wav))) if wav.size else 0.0
+            scale = TARGET_PEAK / peak if peak > 0 else 1.0
+        else:
+            scale = 10 ** (gain_db / 20)
+
+        if b or a:
+            return self._pad(wav, b, a, scale)
+        if scale != 1.0:
+            if not wav.flags.writeable:
+                wav = wav.copy()
+            wav *= scale
+        return wav
+
+    @staticmethod
+    def _pad(wav: np.ndarray, before: int, after: int, scale: float = 1.0) -> np.ndarray:
+        out = np.zeros(before + len(wav) + after, dtype=np.float32)
+        np.multiply(wav, scale, out=out[before:before + len(wav)])
+        return out
+
+    def reverb_full(self, wav: np.ndarray, reverb_time: float, reverb_decay: float) -> Optional[np.ndarray]:
+        """Полная свертка с хвостом (для потокового режима) или None без реверберации."""
+        if reverb_time <= 0 or reverb_decay <= 0:
+            return None
+        return fft_convolve(wav, impulse_response(reverb_time, reverb_decay, self.sample_rate))
+
+    @staticmethod
+    def resample(wav: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+        """Передискретизация (soxr) для вывода с меньшей частотой."""
+        if orig_sr == target_sr:
+            return wav
+        import librosa
+
+        return librosa.resample(wav, orig_sr=orig_sr, target_sr=target_sr, res_type="soxr_hq").astype(np.float32, copy=False)
+
+    def time_stretch(self, wav: np.ndarray, speed: float) -> np.ndarray:
+        if abs(speed - 1.0) < 1e-6:
+            return wav
+        import librosa
+
+        return librosa.effects.time_stretch(wav, rate=speed).astype(np.float32, copy=False)
+
+    def pitch_shift(self, wav: np.ndarray, n_steps: float) -> np.ndarray:
+        if abs(n_steps) < 1e-6:
+            return wav
+        import librosa
+
+        return librosa.effects.pitch_shift(wav, sr=self.sample_rate, n_steps=n_steps).astype(np.float32, copy=False)
@@ -0,0 +1,410 @@
+# services/broadcaster.py
+import asyncio
+import itertools
+import json
+from collections import OrderedDict, defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from services.pubsub import InProcessBackend, PubSubBackend
+
+SSE_LINE_SEP = "\r\n"
+
+# Что делать с подписчиком, который не успевает вычитывать события
+DROP_OLDEST = "drop_oldest"  # выбрасывать самые старые токены
+RESYNC = "resync"            # заменить очередь одним событием resync (клиент перезагрузит чат)
+DISCONNECT = "disconnect"    # закрыть соединение
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST, RESYNC, DISCONNECT)
+
+
+def encode_sse_frame(event: str, data: str, event_id: Optional[str] = None) -> bytes:
+    """
+    Готовый кадр SSE в байтах. EventSourceResponse отдает bytes как есть,
+    поэтому кадр кодируется один раз и переиспользуется всеми подписчиками.
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.splitlines() or [""])
+    return (SSE_LINE_SEP.join(lines) + SSE_LINE_SEP * 2).encode("utf-8")
+
+
+RESYNC_FRAME = encode_sse_frame("resync", "{}")
+
+
+class SubscriptionClosed(Exception):
+    """Подписка закрыта (клиент отписался или отключен политикой медленного клиента)."""
+
+
+class Subscription:
+    """
+    Ограниченная очередь кадров SSE одного клиента.
+
+    offer() никогда не блокирует публикующего: при превышении max_events
+    или max_bytes срабатывает политика медленного клиента, поэтому память
+    на соединение ограничена.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, chat_id: int, policy: str = RESYNC, max_events: int = 1000, max_bytes: int = 1024 * 1024):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Неизвестная политика '{policy}', допустимы: {SLOW_CONSUMER_POLICIES}")
+        self.id = next(self._ids)
+        self.chat_id = chat_id
+        self.policy = policy
+        self.max_events = max(1, max_events)
+        self.max_bytes = max(1, max_bytes)
+        # (кадр, можно ли выбросить при переполнении)
+        self._frames: Deque[Tuple[bytes, bool]] = deque()
+        self._bytes = 0
+        self._ready = asyncio.Event()
+        self._resync = False
+        self.closed = False
+
+        self.delivered = 0
+        self.dropped = 0
+        self.overflows = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._bytes
+
+    def empty(self) -> bool:
+        return not self._frames
+
+    def offer(self, frame: bytes, droppable: bool = False) -> bool:
+        """Кладет кадр в очередь; False — кадр не принят (подписка закрыта или ждет resync)."""
+        if self.closed or self._resync:
+            self.dropped += 1
+            return False
+        self._frames.append((frame, droppable))
+        self._bytes += len(frame)
+        if len(self._frames) > self.max_events or self._bytes > self.max_bytes:
+            self._overflow()
+        self.max_depth = max(self.max_depth, len(self._frames))
+        self._ready.set()
+        return not self.closed
+
+    async def get(self) -> bytes:
+        """Следующий кадр; SubscriptionClosed, когда подписка закрыта и очередь пуста."""
+        while not self._frames:
+            if self.closed:
+                raise SubscriptionClosed()
+            self._ready.clear()
+            await self._ready.wait()
+        frame, _ = self._frames.popleft()
+        self._bytes -= len(frame)
+        self.delivered += 1
+        if frame is RESYNC_FRAME:
+            # После resync клиент перезагружает чат и подписывается заново
+            self.close()
+        return frame
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+    def resync(self) -> None:
+        """Заменяет очередь одним событием resync: клиент перечитает чат целиком."""
+        self._clear()
+        self._resync = True
+        self._frames.append((RESYNC_FRAME, False))
+        self._bytes = len(RESYNC_FRAME)
+        self._ready.set()
+
+    def _overflow(self) -> None:
+        self.overflows += 1
+        if self.policy == DROP_OLDEST:
+            self._drop_oldest()
+        elif self.policy == RESYNC:
+            self.resync()
+        else:
+            self._clear()
+            self.close()
+
+    def _drop_oldest(self) -> None:
+        # Освобождаем место с запасом (до 90%), чтобы не чистить очередь на каждом событии;
+        # сначала выбрасываются старые токены, остальные события — только если токенов нет
+        max_events = int(self.max_events * 0.9)
+        max_bytes = int(self.max_bytes * 0.9)
+
+        def over(count: int) -> bool:
+            return count > max_events or self._bytes > max_bytes
+
+        kept: Deque[Tuple[bytes, bool]] = deque()
+        while self._frames and over(len(kept) + len(self._frames)):
+            frame, droppable = self._frames.popleft()
+            if droppable:
+                self._bytes -= len(frame)
+                self.dropped += 1
+            else:
+                kept.append((frame, droppable))
+        kept.extend(self._frames)
+        self._frames = kept
+        while self._frames and over(len(self._frames)):
+            frame, _ = self._frames.popleft()
+            self._bytes -= len(frame)
+            self.dropped += 1
+
+    def _clear(self) -> None:
+        self.dropped += len(self._frames)
+        self._frames.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "id": self.id,
+            "policy": self.policy,
+            "depth": self.depth,
+            "queued_bytes": self._bytes,
+            "max_depth": self.max_depth,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "overflows": self.overflows,
+            "closed": self.closed,
+        }
+
+
+class Broadcaster:
+    """
+    Управляет подписчиками SSE и рассылает сообщения (полные или токены).
+
+    Каждое событие сериализуется в кадр SSE один раз, и в очереди всех
+    подписчиков чата кладутся одни и те же байты.
+    В режиме объединения (coalesce_ms > 0) токены одного сообщения копятся
+    и уходят одним событием stream_token раз в coalesce_ms миллисекунд или
+    при накоплении coalesce_max_chars символов. Перед любым другим событием
+    чата буфер токенов сбрасывается, поэтому порядок событий сохраняется.
+    Рассылка не блокируется: у каждого подписчика ограниченная очередь
+    (Subscription) со своей политикой для медленных клиентов.
+    События идут через backend (PubSubBackend): по умолчанию в пределах
+    процесса, с Redis — всем воркерам и узлам, где есть подписчики чата.
+
+    У каждого события есть id "<экземпляр>:<номер>" (номер растет монотонно),
+    последние replay_events кадров чата хранятся в кольцевом буфере. Клиент,
+    переподключившийся с Last-Event-ID, получает только пропущенные события,
+    а если id уже вытеснен из буфера — событие resync.
+    """
+
+    def __init__(
+        self,
+        coalesce_ms: float = 0.0,
+        coalesce_max_chars: int = 512,
+        slow_consumer_policy: str = RESYNC,
+        max_queue_events: int = 1000,
+        max_queue_bytes: int = 1024 * 1024,
+        backend: Optional[PubSubBackend] = None,
+        replay_events: int = 512,
+        replay_chats: int = 1024,
+    ):
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Неизвестная политика '{slow_consumer_policy}', допустимы: {SLOW_CONSUMER_POLICIES}")
+        self._listeners: Dict[int, set] = defaultdict(set)
+        self.backend = backend or InProcessBackend()
+        self.backend.bind(self._deliver)
+        self.slow_consumer_policy = slow_consumer_policy
+        self.max_queue_events = max_queue_events
+        self.max_queue_bytes = max_queue_bytes
+        self.coalesce_window = max(0.0, coalesce_ms) / 1000
+        self.coalesce_max_chars = coalesce_max_chars
+        # (chat_id, msg_id) -> накопленные токены и их суммарная длина
+        self._pending: Dict[Tuple[int, int], Tuple[List[str], int]] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._seq = itertools.count(1)
+        # chat_id -> последние кадры (event_id, кадр, можно ли выбросить); чаты вытесняются по LRU
+        self.replay_events = max(0, replay_events)
+        self.replay_chats = max(1, replay_chats)
+        self._replay: "OrderedDict[int, Deque[Tuple[str, bytes, bool]]]" = OrderedDict()
+        self._replay_hits = 0
+        self._replay_misses = 0
+        self._replayed = 0
+
+        self._events = 0
+        self._frames = 0
+        self._tokens = 0
+        self._bytes = 0
+        # Счетчики отключенных подписок, чтобы метрики не терялись после отписки
+        self._closed_dropped = 0
+        self._disconnected = 0
+
+    async def start(self) -> None:
+        """Подключение к брокеру событий (для Redis — при старте приложения)."""
+        await self.backend.start()
+
+    async def close(self) -> None:
+        for chat_id in list(self._timers):
+            self.flush(chat_id)
+        await self.backend.close()
+
+    async def subscribe(self, chat_id: int, last_event_id: Optional[str] = None) -> Subscription:
+        """
+        Подписывает клиента на обновления чата и возвращает его очередь готовых кадров SSE.
+        С last_event_id (переподключение) в очередь сначала попадают пропущенные события.
+        """
+        subscription = Subscription(
+            chat_id,
+            policy=self.slow_consumer_policy,
+            max_events=self.max_queue_events,
+            max_bytes=self.max_queue_bytes,
+        )
+        if last_event_id:
+            self._replay_into(chat_id, last_event_id, subscription)
+        self._listeners[chat_id].add(subscription)
+        return subscription
+
+    def subscriber_count(self, chat_id: int) -> int:
+        """Сколько клиентов этого процесса сейчас подписаны на чат."""
+        return len(self._listeners.get(chat_id, ()))
+
+    def _replay_into(self, chat_id: int, last_event_id: str, subscription: Subscription) -> None:
+        buffer = self._replay.get(chat_id, ())
+        for index in range(len(buffer) - 1, -1, -1):
+            if buffer[index][0] == last_event_id:
+                missed = list(buffer)[index + 1:]
+                for _, frame, droppable in missed:
+                    subscription.offer(frame, droppable)
+                self._replay_hits += 1
+                self._replayed += len(missed)
+                return
+        # Пропущенные события уже вытеснены (или сервер перезапускался) — нужна полная перезагрузка
+        self._replay_misses += 1
+        subscription.resync()
+
+    def unsubscribe(self, chat_id: int, subscription: Subscription):
+        """Отписывает клиента от обновлений."""
+        subscription.close()
+        try:
+            self._listeners[chat_id].remove(subscription)
+            if not self._listeners[chat_id]:
+                del self._listeners[chat_id]
+        except (KeyError, ValueError):
+            return  # Игнорируем, если уже отписан
+        self._closed_dropped += subscription.dropped
+
+    async def publish_message(self, chat_id: int, message_json: str):
+        """Публикует полное новое сообщение."""
+        self._send(chat_id, "new_message", message_json)
+
+    async def publish_token(self, chat_id: int, msg_id: int, token: str):
+        """Публикует токен для существующего сообщения (или копит его при объединении)."""
+        self._tokens += 1
+        if not self.coalesce_window:
+            self._send_tokens(chat_id, msg_id, token)
+            return
+
+        key = (chat_id, msg_id)
+        tokens, size = self._pending.get(key, ([], 0))
+        tokens.append(token)
+        size += len(token)
+        self._pending[key] = (tokens, size)
+        if size >= self.coalesce_max_chars:
+            self.flush(chat_id)
+        elif chat_id not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[chat_id] = loop.call_later(self.coalesce_window, self.flush, chat_id)
+
+    async def publish_queue_position(self, chat_id: int, msg_id: int, position: int):
+        """Позиция ответа в очереди генерации (0 — генерация началась)."""
+        self._send(chat_id, "queue_position", json.dumps({"msg_id": msg_id, "position": position}))
+
+    async def publish_audio(self, chat_id: int, msg_id: int, seq: int, url: str):
+        """Публикует готовый аудио-сегмент озвучки сообщения модели."""
+        self._send(chat_id, "audio_segment", json.dumps({"msg_id": msg_id, "seq": seq, "url": url}))
+
+    def flush(self, chat_id: int) -> None:
+        """Отправляет накопленные токены чата."""
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        for key in [k for k in self._pending if k[0] == chat_id]:
+            tokens, _ = self._pending.pop(key)
+            self._send_tokens(chat_id, key[1], "".join(tokens))
+
+    def _send_tokens(self, chat_id: int, msg_id: int, text: str) -> None:
+        self._fan_out(chat_id, "stream_token", json.dumps({"msg_id": msg_id, "token": text}))
+
+    def _send(self, chat_id: int, event: str, data: str) -> None:
+        # Токены, пришедшие раньше, должны уйти раньше этого события
+        if chat_id in self._timers:
+            self.flush(chat_id)
+        self._fan_out(chat_id, event, data)
+
+    def _fan_out(self, chat_id: int, event: str, data: str) -> None:
+        self._events += 1
+        self.backend.publish(chat_id, event, data, f"{self.backend.instance_id}:{next(self._seq)}")
+
+    def _deliver(self, chat_id: int, event: str, data: str, event_id: str) -> None:
+        """Событие от backend (свое или другого воркера) — в буфер повтора и локальным подписчикам чата."""
+        frame = encode_sse_frame(event, data, event_id)
+        droppable = event == "stream_token"
+        self._remember(chat_id, event_id, frame, droppable)
+        listeners = self._listeners.get(chat_id)
+        if not listeners:
+            return
+        self._frames += len(listeners)
+        self._bytes += len(frame) * len(listeners)
+        closed = []
+        for subscription in listeners:
+            if not subscription.offer(frame, droppable) and subscription.closed:
+                closed.append(subscription)
+        for subscription in closed:
+            # Отключен политикой медленного клиента
+            self._disconnected += 1
+            self.unsubscribe(chat_id, subscription)
+
+    def _remember(self, chat_id: int, event_id: str, frame: bytes, droppable: bool) -> None:
+        if not self.replay_events:
+            return
+        buffer = self._replay.get(chat_id)
+        if buffer is None:
+            buffer = self._replay[chat_id] = deque(maxlen=self.replay_events)
+            while len(self._replay) > self.replay_chats:
+                self._replay.popitem(last=False)
+        else:
+            self._replay.move_to_end(chat_id)
+        buffer.append((event_id, frame, droppable))
+
+    def stats(self, detail: bool = False) -> dict:
+        """Общие счетчики и очереди по чатам; detail=True добавляет каждого подписчика."""
+        chats = {}
+        for chat_id, subscriptions in self._listeners.items():
+            chat = {
+                "subscribers": len(subscriptions),
+                "queued_events": sum(s.depth for s in subscriptions),
+                "queued_bytes": sum(s.queued_bytes for s in subscriptions),
+                "max_depth": max((s.max_depth for s in subscriptions), default=0),
+                "dropped": sum(s.dropped for s in subscriptions),
+            }
+            if detail:
+                chat["subscriptions"] = [s.stats() for s in subscriptions]
+            chats[chat_id] = chat
+        return {
+            "chats": chats,
+            "subscribers": sum(len(s) for s in self._listeners.values()),
+            "slow_consumer_policy": self.slow_consumer_policy,
+            "max_queue_events": self.max_queue_events,
+            "max_queue_bytes": self.max_queue_bytes,
+            "dropped_total": self._closed_dropped + sum(c["dropped"] for c in chats.values()),
+            "disconnected_slow": self._disconnected,
+            "coalesce_ms": round(self.coalesce_window * 1000, 1),
+            "tokens_published": self._tokens,
+            "events_sent": self._events,
+            "frames_enqueued": self._frames,
+            "bytes_enqueued": self._bytes,
+            "pending_messages": len(self._pending),
+            "pubsub": self.backend.stats(),
+            "replay": {
+                "chats": len(self._replay),
+                "events": sum(len(b) for b in self._replay.values()),
+                "bytes": sum(len(f) for b in self._replay.values() for _, f, _ in b),
+                "hits": self._replay_hits,
+                "misses": self._replay_misses,
+                "replayed_events": self._replayed,
+            },
+        }
@@ -1,131 +1,217 @@
 # services/chat_service.py
-from models import MessageType
-from langchain_ollama.llms import OllamaLLM
 import asyncio
+import time
+from models import MessageStatus
 from dtos import MessageDTO
-import json
-from collections import defaultdict
 from repositories.message_repo import MessageRepository
+from repositories.chat_repo import ChatRepository
+# Broadcaster живет в services/broadcaster.py, импорт отсюда оставлен для совместимости
+from services.broadcaster import Broadcaster
+from services.context_builder import ConversationContextBuilder, ContextTurn, render_turns
+from services.llm_gateway import GenerationCancelled, LLMGateway
+from services.message_writer import MessageWriter
+from services.local_tts_service import LocalTextToVoiceService
+from services.speech_pipeline import SpeechPipeline
+from services.tts_cache import TTSAudioCache
+from services.tts_batcher import TTSBatchScheduler
+from typing import List, Optional
 
 
-class Broadcaster:
-    """
-    Управляет подписчиками SSE и рассылает сообщения (полные или токены).
-    """
+# Дописываются к тексту ответа — и в потоке клиенту, и в базе
+CANCELLED_MARKER = "\n[ОТВЕТ ОСТАНОВЛЕН]"
+FAILED_MARKER = "\n[ОШИБКА ГЕНЕРАЦИИ ОТВЕТА]"
 
-    def __init__(self):
-        # Очереди теперь хранят словари (полные SSE-события)
-        self._listeners: dict[int, set[asyncio.Queue[dict]]] = defaultdict(set)
-
-    async def subscribe(self, chat_id: int) -> asyncio.Queue[dict]:
-        """Подписывает клиента на обновления чата и возвращает очередь."""
-        queue = asyncio.Queue()
-        self._listeners[chat_id].add(queue)
-        return queue
-
-    def unsubscribe(self, chat_id: int, queue: asyncio.Queue[dict]):
-        """Отписывает клиента от обновлений."""
-        try:
-            self._listeners[chat_id].remove(queue)
-            if not self._listeners[chat_id]:
-                del self._listeners[chat_id]
-        except (KeyError, ValueError):
-            pass  # Игнорируем, если уже отписан
-
-    async def publish_message(self, chat_id: int, message_json: str):
-        """Публикует полное новое сообщение."""
-        event_data = {
-            "event": "new_message",
-            "data": message_json
-        }
-        for queue in self._listeners.get(chat_id, set()):
-            await queue.put(event_data)
-
-    async def publish_token(self, chat_id: int, msg_id: int, token: str):
-        """Публикует один токен для существующего сообщения."""
-        token_data = {"msg_id": msg_id, "token": token}
-        event_data = {
-            "event": "stream_token",
-            "data": json.dumps(token_data)
-        }
-        for queue in self._listeners.get(chat_id, set()):
-            await queue.put(event_data)
+SUMMARY_PROMPT = (
+    "Ниже краткое содержание начала разговора и его продолжение. "
+    "Обнови краткое содержание: сохрани факты, договоренности и вопросы пользователя, "
+    "пиши кратко, без вступлений.\n\n"
+    "Краткое содержание: {summary}\n\n"
+    "Продолжение:\n{dialog}\n"
+    "Обновленное краткое содержание:"
+)
 
 
 class ChatService:
-    def __init__(self, message_repo: MessageRepository, broadcaster: Broadcaster):
+    def __init__(
+            self,
+            message_repo: MessageRepository,
+            chat_repo: ChatRepository,
+            message_writer: MessageWriter,
+            broadcaster: Broadcaster,
+            context_builder: ConversationContextBuilder,
+            llm_gateway: LLMGateway,
+            tts_service: LocalTextToVoiceService,
+            tts_batcher: TTSBatchScheduler,
+            tts_cache: TTSAudioCache,
+            checkpoint_tokens: int = 64,
+            checkpoint_ms: float = 2000.0,
+            heartbeat_s: float = 30.0
+    ):
         self.message_repo = message_repo
+        self.chat_repo = chat_repo
+        # Вставки и обновления сообщений группами, без коммита на каждую строку
+        self.message_writer = message_writer
         self.broadcaster = broadcaster
-        # Используйте вашу фактическую модель Ollama
-        self.llm = OllamaLLM(model="saiga_llama3_8b:latest")
+        self.context_builder = context_builder
+        # Общий для приложения клиент Ollama с очередью генераций
+        self.llm_gateway = llm_gateway
+        self.tts_service = tts_service
+        self.tts_batcher = tts_batcher
+        self.tts_cache = tts_cache
+        # Контрольные точки ответа: каждые checkpoint_tokens токенов или checkpoint_ms мс
+        self.checkpoint_tokens = max(1, checkpoint_tokens)
+        self.checkpoint_interval = max(0.0, checkpoint_ms) / 1000
+        # Пока ответ жив (даже ждет в очереди без токенов), его updated_at обновляется:
+        # периодическая проверка прерванных ответов его не тронет
+        self.heartbeat_interval = max(1.0, heartbeat_s)
 
         # Обратите внимание: аргумент user_id остался для получения ID текущего пользователя
 
-    async def process_user_message(self, chat_id: int, content: str, user_id: int) -> None:
+    async def process_user_message(
+            self,
+            chat_id: int,
+            content: str,
+            user_id: int,
+            voice: bool = False,
+            voice_params: Optional[dict] = None
+    ) -> None:
         """
         Обрабатывает сообщение пользователя, запускает стриминг ответа модели.
+        В голосовом режиме (voice=True) ответ озвучивается по предложениям
+        параллельно с генерацией, аудио-сегменты приходят событием audio_segment.
         """
 
-        # 1. Сохраняем и публикуем сообщение пользователя
+        # 1-2. Сохраняем сообщение пользователя и ПУСТОЕ сообщение-плейсхолдер от модели
+        # одной транзакцией (вместе с сообщениями других чатов, пришедшими в то же окно)
         try:
-            # --- ИСПРАВЛЕНО: user_id теперь передается для сообщения пользователя ---
-            user_msg = await self.message_repo.add_message(
+            user_msg, model_msg = await self.message_writer.add_exchange(
                 chat_id=chat_id,
                 content=content,
-                message_type=MessageType.USER,
-                user_id=user_id  # <-- АКТИВИРОВАНО: Передаем ID пользователя
-            )
-            await self.broadcaster.publish_message(
-                chat_id,
-                MessageDTO.model_validate(user_msg).model_dump_json()
+                user_id=user_id  # Сообщение модели не принадлежит пользователю (user_id=None)
             )
         except Exception as e:
-            print(f"Error saving user message: {e}")
+            print(f"Error saving messages: {e}")
             return
 
-        # 2. Создаем ПУСТОЕ сообщение-плейсхолдер от модели
-        try:
-            # --- ИСПРАВЛЕНО: Передаем user_id=None для сообщения модели ---
-            model_msg = await self.message_repo.add_message(
+        # 3. Публикуем оба сообщения, чтобы JS создал div
+        await self.broadcaster.publish_message(
+            chat_id,
+            MessageDTO.model_validate(user_msg).model_dump_json()
+        )
+        await self.broadcaster.publish_message(
+            chat_id,
+            MessageDTO.model_validate(model_msg).model_dump_json()
+        )
+
+        # 4. Запускаем стриминг LLM и публикуем токены
+        speech = None
+        if voice:
+            speech = SpeechPipeline(
                 chat_id=chat_id,
-                content="",
-                message_type=MessageType.MODEL,
-                user_id=None  # <-- АКТИВИРОВАНО: Сообщение модели не принадлежит пользователю
+                msg_id=model_msg.id,
+                tts_service=self.tts_service,
+                tts_batcher=self.tts_batcher,
+                tts_cache=self.tts_cache,
+                broadcaster=self.broadcaster,
+                voice_params=voice_params,
             )
-            # 3. Публикуем это пустое сообщение, чтобы JS создал div
-            await self.broadcaster.publish_message(
-                chat_id,
-                MessageDTO.model_validate(model_msg).model_dump_json()
+
+        # История диалога под бюджет токенов (из кэша + только новые сообщения)
+        try:
+            prompt = await self.context_builder.build(
+                chat_id, self.message_repo, self.chat_repo, before_id=model_msg.id
             )
         except Exception as e:
-            print(f"Error creating placeholder model message: {e}")
-            return
+            print(f"Error building LLM context: {e}")
+            prompt = content
+
+        async def report_queue_position(position: int) -> None:
+            await self.broadcaster.publish_queue_position(chat_id, model_msg.id, position)
 
-        # 4. Запускаем стриминг LLM и публикуем токены
         full_content = []
+        final_status = MessageStatus.COMPLETE
+        # Текст ответа периодически сохраняется в плейсхолдер (в фоне, без записи на каждый токен):
+        # если процесс упадет, в базе останется ответ до последней контрольной точки
+        tokens_since_checkpoint = 0
+        last_checkpoint = time.monotonic()
+
+        async def keep_alive() -> None:
+            while True:
+                await asyncio.sleep(self.heartbeat_interval)
+                if time.monotonic() - last_checkpoint >= self.heartbeat_interval:
+                    self.message_writer.checkpoint(chat_id, model_msg.id, "".join(full_content))
+
+        heartbeat = asyncio.create_task(keep_alive())
         try:
-            # В production-коде здесь нужно передавать контекст (предыдущие сообщения)
-            async for token in self.llm.astream(content):
+            async for token in self.llm_gateway.stream(
+                    prompt,
+                    user_id=user_id,
+                    chat_id=chat_id,
+                    on_queue_position=report_queue_position
+            ):
                 full_content.append(token)
                 await self.broadcaster.publish_token(
                     chat_id,
                     model_msg.id,
                     token
                 )
+                if speech:
+                    speech.feed(token)
+                tokens_since_checkpoint += 1
+                if (tokens_since_checkpoint >= self.checkpoint_tokens
+                        or time.monotonic() - last_checkpoint >= self.checkpoint_interval):
+                    self.message_writer.checkpoint(chat_id, model_msg.id, "".join(full_content))
+                    tokens_since_checkpoint = 0
+                    last_checkpoint = time.monotonic()
+        except GenerationCancelled:
+            # Пользователь отправил новое сообщение или закрыл чат
+            final_status = MessageStatus.CANCELLED
+            full_content.append(CANCELLED_MARKER)
+            await self.broadcaster.publish_token(
+                chat_id,
+                model_msg.id,
+                CANCELLED_MARKER
+            )
+            if speech:
+                speech.cancel()
+                speech = None
         except Exception as e:
             print(f"Error during LLM stream: {e}")
+            final_status = MessageStatus.FAILED
+            full_content.append(FAILED_MARKER)
             await self.broadcaster.publish_token(
                 chat_id,
                 model_msg.id,
-                "\n[ОШИБКА ГЕНЕРАЦИИ ОТВЕТА]"
+                FAILED_MARKER
             )
 
-        # 5. Сохраняем полный ответ в БД
+        finally:
+            heartbeat.cancel()
+
+        # 5. Сохраняем полный ответ в БД (в режиме write-behind — в фоне, ближайшей группой)
         final_content = "".join(full_content)
         try:
-            await self.message_repo.update_message_content(
+            await self.message_writer.update_content(
+                chat_id,
                 model_msg.id,
-                final_content
+                final_content,
+                final_status
             )
         except Exception as e:
-            print(f"Error updating model message content: {e}")
\ No newline at end of file
+            print(f"Error updating model message content: {e}")
+        self.context_builder.complete_turn(chat_id, model_msg.id, final_content)
+
+        # 6. Дожидаемся озвучки хвоста ответа
+        if speech:
+            await speech.finish()
+
+        # 7. Старые реплики, не влезающие в контекст, сворачиваем в сводку
+        # (ответ уже отдан, пользователь этого не ждет)
+        async def summarize(summary: str, turns: List[ContextTurn]) -> str:
+            prompt = SUMMARY_PROMPT.format(summary=summary or "(пока нет)", dialog=render_turns(turns))
+            return await self.llm_gateway.complete(prompt, user_id=user_id)
+
+        try:
+            await self.context_builder.compact(chat_id, self.chat_repo, summarize)
+        except Exception as e:
+            print(f"Error updating chat summary: {e}")
\ No newline at end of file
@@ -0,0 +1,248 @@
+# services/context_builder.py
+import asyncio
+import math
+import weakref
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, List, Optional
+
+from models import Message, MessageType
+from repositories.chat_repo import ChatRepository
+from repositories.message_repo import MessageRepository
+
+# Оценка длины без токенизатора модели: для русского текста у Llama 3
+# в среднем ~3 символа на токен, плюс служебные токены на каждую реплику
+CHARS_PER_TOKEN = 3.0
+TURN_OVERHEAD_TOKENS = 4
+
+_ROLE_PREFIX = {
+    MessageType.USER: "Пользователь",
+    MessageType.MODEL: "Ассистент",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) + TURN_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    max_chars = max(0, int((tokens - TURN_OVERHEAD_TOKENS) * CHARS_PER_TOKEN))
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + "…"
+
+
+@dataclass
+class ContextTurn:
+    message_id: int
+    role: MessageType
+    content: str
+    tokens: int
+
+    def render(self) -> str:
+        return f"{_ROLE_PREFIX[self.role]}: {self.content}\n"
+
+
+def render_turns(turns: List[ContextTurn]) -> str:
+    return "".join(turn.render() for turn in turns)
+
+
+@dataclass
+class ChatContext:
+    """Собранный контекст одного чата: сводка + последние реплики в пределах бюджета."""
+    summary: str = ""
+    summary_upto_id: int = 0
+    turns: Deque[ContextTurn] = field(default_factory=deque)
+    turn_tokens: int = 0
+    last_message_id: int = 0
+    # Реплики, вытесненные из окна, но еще не вошедшие в сводку
+    evicted: List[ContextTurn] = field(default_factory=list)
+    # Отрисованные реплики окна; при добавлении дописываются в конец
+    rendered: Optional[str] = None
+    # Сводка уже считается (compact) — второй вызов ее не дублирует
+    compacting: bool = False
+
+    @property
+    def summary_tokens(self) -> int:
+        return estimate_tokens(self.summary) if self.summary else 0
+
+
+Summarizer = Callable[[str, List[ContextTurn]], Awaitable[str]]
+
+
+class ConversationContextBuilder:
+    """
+    Сборка истории диалога для LLM под бюджет токенов.
+
+    Контекст каждого чата кэшируется в памяти (LRU по чатам): на новом ходу
+    из БД читаются только сообщения новее последнего учтенного, и токены
+    считаются только для них — стоимость хода O(новых сообщений).
+    Когда окно не помещается в бюджет, старые реплики вытесняются и после
+    ответа сворачиваются в сводку (Chat.summary), которая хранится в БД.
+
+    Блокировки чатов держатся только пока кто-то их ждет или держит
+    (слабые ссылки), контекст удаленного чата убирает forget.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 3072,
+        reply_reserve_tokens: int = 512,
+        summary_max_tokens: int = 384,
+        max_chats: int = 256,
+        cold_load_limit: int = 100,
+    ):
+        self.budget = max(256, max_tokens - reply_reserve_tokens)
+        # Вытесняем с запасом, чтобы сводка пересчитывалась не на каждом ходу
+        self.low_watermark = int(self.budget * 0.75)
+        self.summary_max_tokens = summary_max_tokens
+        self.max_chats = max_chats
+        self.cold_load_limit = cold_load_limit
+        self._chats: "OrderedDict[int, ChatContext]" = OrderedDict()
+        # Блокировка живет, пока на нее ссылается ожидающий или держащий ее ход
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+        self._cold_loads = 0
+        self._delta_loads = 0
+        self._delta_messages = 0
+        self._summaries = 0
+
+    def _lock(self, chat_id: int) -> asyncio.Lock:
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        return lock
+
+    async def build(
+        self,
+        chat_id: int,
+        message_repo: MessageRepository,
+        chat_repo: ChatRepository,
+        before_id: Optional[int] = None,
+    ) -> str:
+        """
+        Промпт для модели: сводка, реплики чата с ID < before_id (последняя из
+        них — текущий вопрос пользователя) и приглашение ассистенту ответить.
+        """
+        async with self._lock(chat_id):
+            ctx = self._chats.get(chat_id)
+            if ctx is None:
+                ctx = await self._cold_load(chat_id, message_repo, chat_repo, before_id)
+            else:
+                self._chats.move_to_end(chat_id)
+                delta = await message_repo.get_messages_after(chat_id, ctx.last_message_id, before_id)
+                self._delta_loads += 1
+                self._delta_messages += len(delta)
+                for message in delta:
+                    self._append(ctx, message)
+            self._trim(ctx)
+            return self._render(ctx)
+
+    def complete_turn(self, chat_id: int, message_id: int, content: str) -> None:
+        """
+        Ответ модели дописан. Нужен, если плейсхолдер ответа попал в контекст
+        еще пустым (следующее сообщение отправили до конца генерации).
+        """
+        ctx = self._chats.get(chat_id)
+        if ctx is None:
+            return
+        for turn in ctx.turns:
+            if turn.message_id == message_id:
+                tokens = estimate_tokens(content)
+                ctx.turn_tokens += tokens - turn.tokens
+                turn.content, turn.tokens = content, tokens
+                ctx.rendered = None
+                return
+
+    def forget(self, chat_id: int) -> None:
+        """Чат удален: его контекст больше не нужен."""
+        self._chats.pop(chat_id, None)
+
+    async def compact(self, chat_id: int, chat_repo: ChatRepository, summarize: Summarizer) -> None:
+        """
+        Сворачивает вытесненные реплики в сводку и сохраняет ее в БД.
+
+        Вызов LLM идет вне блокировки чата — следующий ход не ждет сводку.
+        Под блокировкой берется снимок, а результат применяется, только если
+        контекст тот же (чат не вытеснен и не удален) и сводка с тех пор
+        не менялась; реплики, вытесненные за это время, ждут следующего раза.
+        """
+        async with self._lock(chat_id):
+            ctx = self._chats.get(chat_id)
+            if ctx is None or not ctx.evicted or ctx.compacting:
+                return
+            ctx.compacting = True
+            previous, version, turns = ctx.summary, ctx.summary_upto_id, list(ctx.evicted)
+        try:
+            summary = await summarize(previous, turns)
+            async with self._lock(chat_id):
+                if self._chats.get(chat_id) is not ctx or ctx.summary_upto_id != version:
+                    return
+                ctx.summary = truncate_to_tokens(summary.strip(), self.summary_max_tokens)
+                ctx.summary_upto_id = turns[-1].message_id
+                ctx.evicted = ctx.evicted[len(turns):]
+            await chat_repo.update_summary(chat_id, ctx.summary, ctx.summary_upto_id)
+            self._summaries += 1
+        finally:
+            ctx.compacting = False
+
+    async def _cold_load(
+        self,
+        chat_id: int,
+        message_repo: MessageRepository,
+        chat_repo: ChatRepository,
+        before_id: Optional[int],
+    ) -> ChatContext:
+        summary, upto_id = await chat_repo.get_summary(chat_id)
+        ctx = ChatContext(summary=summary, summary_upto_id=upto_id, last_message_id=upto_id)
+        # Все, что старше сводки и последних cold_load_limit сообщений, в окно все равно не попадет
+        recent = await message_repo.get_recent_messages_for_chat(chat_id, limit=self.cold_load_limit)
+        for message in recent:
+            if message.id > upto_id and (before_id is None or message.id < before_id):
+                self._append(ctx, message)
+        self._cold_loads += 1
+
+        self._chats[chat_id] = ctx
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+        return ctx
+
+    def _append(self, ctx: ChatContext, message: Message) -> None:
+        turn = ContextTurn(message.id, message.message_type, message.content, estimate_tokens(message.content))
+        ctx.turns.append(turn)
+        ctx.turn_tokens += turn.tokens
+        ctx.last_message_id = max(ctx.last_message_id, message.id)
+        if ctx.rendered is not None:
+            ctx.rendered += turn.render()
+
+    def _trim(self, ctx: ChatContext) -> None:
+        if ctx.summary_tokens + ctx.turn_tokens <= self.budget:
+            return
+        target = self.low_watermark - min(ctx.summary_tokens, self.summary_max_tokens)
+        # Текущий вопрос пользователя (последняя реплика) остается всегда
+        while len(ctx.turns) > 1 and ctx.turn_tokens > target:
+            turn = ctx.turns.popleft()
+            ctx.turn_tokens -= turn.tokens
+            if turn.content:
+                ctx.evicted.append(turn)
+        if ctx.turns and ctx.turn_tokens > self.budget - ctx.summary_tokens:
+            # Один огромный вопрос: оставляем начало, чтобы промпт влез в окно
+            turn = ctx.turns[0]
+            turn.content = truncate_to_tokens(turn.content, self.budget - ctx.summary_tokens)
+            turn.tokens = estimate_tokens(turn.content)
+            ctx.turn_tokens = turn.tokens
+        ctx.rendered = None
+
+    @staticmethod
+    def _render(ctx: ChatContext) -> str:
+        if ctx.rendered is None:
+            ctx.rendered = render_turns(list(ctx.turns))
+        prefix = f"Краткое содержание предыдущего разговора: {ctx.summary}\n\n" if ctx.summary else ""
+        return f"{prefix}{ctx.rendered}{_ROLE_PREFIX[MessageType.MODEL]}:"
+
+    def stats(self) -> dict:
+        return {
+            "cached_chats": len(self._chats),
+            "cold_loads": self._cold_loads,
+            "delta_loads": self._delta_loads,
+            "avg_delta_messages": round(self._delta_messages / self._delta_loads, 2) if self._delta_loads else 0.0,
+            "summaries": self._summaries,
+        }
@@ -0,0 +1,226 @@
+# services/history_cache.py
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models import MessageStatus, MessageType
+
+
+@dataclass(frozen=True)
+class CachedMessage:
+    """Неизменяемый снимок сообщения: безопасно отдавать разным запросам (в отличие от ORM-объекта)."""
+    id: int
+    chat_id: int
+    content: str
+    message_type: MessageType
+    created_at: datetime
+    status: MessageStatus
+    user_id: Optional[int] = None
+
+    @classmethod
+    def of(cls, message) -> "CachedMessage":
+        return cls(
+            id=message.id,
+            chat_id=message.chat_id,
+            content=message.content,
+            message_type=message.message_type,
+            created_at=message.created_at,
+            status=message.status,
+            user_id=message.user_id,
+        )
+
+
+class _ChatWindow:
+    __slots__ = ("messages", "complete")
+
+    def __init__(self, messages: List[CachedMessage], complete: bool):
+        self.messages = messages
+        # True — в окне вся история чата (старее ничего нет)
+        self.complete = complete
+
+
+class HistoryCache:
+    """
+    Кэш чтения для активных чатов: последние window сообщений чата
+    и список чатов пользователя (строки list_chat_summaries).
+
+    Наполняется при чтении (read-through) в репозиториях, а пути записи
+    MessageRepository/ChatRepository поддерживают его согласованным:
+    новые сообщения дописываются в окно, обновления текста (в том числе
+    контрольные точки стримящегося ответа) заменяют снимок, список чатов
+    владельца (число сообщений, превью) сбрасывается при любой записи в чат.
+    Память ограничена: не больше max_chats окон и max_users списков, LRU.
+
+    Кэш локален для процесса: при нескольких воркерах записи соседей он
+    не видит, поэтому там его лучше выключить (max_chats=0).
+    """
+
+    def __init__(self, max_chats: int = 512, max_users: int = 1024, window: int = 50):
+        self.max_chats = max(0, max_chats)
+        self.max_users = max(0, max_users)
+        self.window = max(1, window)
+        self._windows: "OrderedDict[int, _ChatWindow]" = OrderedDict()
+        self._chat_lists: "OrderedDict[int, list]" = OrderedDict()
+        # chat_id -> user_id для чатов из закэшированных списков
+        self._chat_owner: Dict[int, int] = {}
+        # message_id -> chat_id для сообщений из закэшированных окон
+        self._message_chat: Dict[int, int] = {}
+        # message_id -> chat_id стримящихся ответов: их обновления сбрасывают
+        # список чатов, даже если окна чата в кэше нет
+        self._streaming: Dict[int, int] = {}
+
+        self._hits = {"window": 0, "chat_list": 0}
+        self._misses = {"window": 0, "chat_list": 0}
+        self._evictions = {"window": 0, "chat_list": 0}
+        self._appends = 0
+        self._updates = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_chats > 0
+
+    # --- окна сообщений ---
+
+    def get_latest(
+        self, chat_id: int, limit: int
+    ) -> Optional[Tuple[List[CachedMessage], Optional[Tuple[datetime, int]]]]:
+        """Последние limit сообщений чата и курсор более старой страницы — или None, если их нет в кэше."""
+        window = self._windows.get(chat_id)
+        if window is None or (len(window.messages) < limit and not window.complete):
+            self._misses["window"] += 1
+            return None
+        self._windows.move_to_end(chat_id)
+        self._hits["window"] += 1
+        page = window.messages[-limit:]
+        has_older = len(window.messages) > limit or not window.complete
+        cursor = (page[0].created_at, page[0].id) if has_older and page else None
+        return list(page), cursor
+
+    def put_latest(self, chat_id: int, messages: Iterable, complete: bool) -> None:
+        """Кладет последнюю страницу чата, прочитанную из базы (messages по возрастанию)."""
+        if not self.enabled:
+            return
+        snapshots = [CachedMessage.of(m) for m in messages]
+        if len(snapshots) > self.window:
+            snapshots = snapshots[-self.window:]
+            complete = False
+        self._drop_window(chat_id)
+        self._windows[chat_id] = _ChatWindow(snapshots, complete)
+        for m in snapshots:
+            self._message_chat[m.id] = chat_id
+        while len(self._windows) > self.max_chats:
+            evicted, _ = next(iter(self._windows.items()))
+            self._drop_window(evicted)
+            self._evictions["window"] += 1
+
+    def append(self, messages: Iterable) -> None:
+        """Хук записи: новые сообщения (после коммита)."""
+        for message in messages:
+            self._invalidate_owner_list(message.chat_id)
+            if message.status == MessageStatus.STREAMING:
+                self._streaming[message.id] = message.chat_id
+            window = self._windows.get(message.chat_id)
+            if window is None:
+                continue
+            snapshot = CachedMessage.of(message)
+            items = window.messages
+            items.append(snapshot)
+            if len(items) > 1 and (items[-2].created_at, items[-2].id) > (snapshot.created_at, snapshot.id):
+                items.sort(key=lambda m: (m.created_at, m.id))
+            self._message_chat[snapshot.id] = message.chat_id
+            while len(items) > self.window:
+                self._message_chat.pop(items.pop(0).id, None)
+                window.complete = False
+            self._appends += 1
+
+    def update(self, message_id: int, content: str, status: Optional[MessageStatus]) -> None:
+        """Хук записи: новый текст сообщения (status=None — контрольная точка, статус не меняется)."""
+        chat_id = self._message_chat.get(message_id) or self._streaming.get(message_id)
+        if status is not None:
+            self._streaming.pop(message_id, None)
+        if chat_id is None:
+            return
+        # Новый текст может быть превью в списке чатов
+        self._invalidate_owner_list(chat_id)
+        window = self._windows.get(chat_id)
+        if window is None:
+            return
+        for i in range(len(window.messages) - 1, -1, -1):
+            if window.messages[i].id == message_id:
+                changes = {"content": content}
+                if status is not None:
+                    changes["status"] = status
+                window.messages[i] = replace(window.messages[i], **changes)
+                self._updates += 1
+                return
+
+    def invalidate_chat(self, chat_id: int) -> None:
+        self._invalidations += 1
+        self._drop_window(chat_id)
+        self._invalidate_owner_list(chat_id)
+
+    def _drop_window(self, chat_id: int) -> None:
+        window = self._windows.pop(chat_id, None)
+        if window is not None:
+            for m in window.messages:
+                self._message_chat.pop(m.id, None)
+
+    # --- списки чатов ---
+
+    def get_chat_list(self, user_id: int) -> Optional[list]:
+        rows = self._chat_lists.get(user_id)
+        if rows is None:
+            self._misses["chat_list"] += 1
+            return None
+        self._chat_lists.move_to_end(user_id)
+        self._hits["chat_list"] += 1
+        return list(rows)
+
+    def put_chat_list(self, user_id: int, rows: list) -> None:
+        if not self.max_users:
+            return
+        self.invalidate_user(user_id)
+        self._chat_lists[user_id] = list(rows)
+        for row in rows:
+            self._chat_owner[row.id] = user_id
+        while len(self._chat_lists) > self.max_users:
+            evicted, _ = next(iter(self._chat_lists.items()))
+            self.invalidate_user(evicted)
+            self._evictions["chat_list"] += 1
+
+    def invalidate_user(self, user_id: int) -> None:
+        rows = self._chat_lists.pop(user_id, None)
+        for row in rows or ():
+            if self._chat_owner.get(row.id) == user_id:
+                del self._chat_owner[row.id]
+
+    def _invalidate_owner_list(self, chat_id: int) -> None:
+        user_id = self._chat_owner.get(chat_id)
+        if user_id is not None:
+            self.invalidate_user(user_id)
+
+    def stats(self) -> dict:
+        def hit_rate(kind: str) -> float:
+            total = self._hits[kind] + self._misses[kind]
+            return round(self._hits[kind] / total, 3) if total else 0.0
+
+        return {
+            "enabled": self.enabled,
+            "window": self.window,
+            "chats": len(self._windows),
+            "max_chats": self.max_chats,
+            "cached_messages": sum(len(w.messages) for w in self._windows.values()),
+            "cached_bytes": sum(len(m.content.encode("utf-8")) for w in self._windows.values() for m in w.messages),
+            "streaming": len(self._streaming),
+            "user_lists": len(self._chat_lists),
+            "max_users": self.max_users,
+            "hits": dict(self._hits),
+            "misses": dict(self._misses),
+            "hit_rate": {kind: hit_rate(kind) for kind in self._hits},
+            "evictions": dict(self._evictions),
+            "appends": self._appends,
+            "updates": self._updates,
+            "invalidations": self._invalidations,
+        }
@@ -0,0 +1,314 @@
+# services/llm_gateway.py
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+QueuePositionCallback = Callable[[int], Awaitable[None]]
+
+
+class GenerationCancelled(Exception):
+    """Генерация остановлена: пользователь отправил новое сообщение или закрыл чат."""
+
+
+class _Ticket:
+    __slots__ = ("key", "future", "position", "changed", "enqueued_at")
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.position = 0
+        self.changed = asyncio.Event()
+        self.enqueued_at = time.perf_counter()
+
+
+class FairScheduler:
+    """
+    Ограничитель параллельных генераций одной модели со справедливой очередью.
+
+    Не более max_concurrency генераций одновременно. Ожидающие запросы
+    сгруппированы по ключу (пользователю) и выдаются по кругу: по одному
+    запросу от каждого пользователя, поэтому пользователь с десятком
+    сообщений в очереди не задерживает остальных дольше, чем на один ход.
+    """
+
+    def __init__(self, max_concurrency: int = 2):
+        self.max_concurrency = max(1, max_concurrency)
+        self._running = 0
+        # Порядок ключей — порядок обхода по кругу
+        self._queues: "OrderedDict[Hashable, Deque[_Ticket]]" = OrderedDict()
+
+        self._granted = 0
+        self._abandoned = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def acquire(self, key: Hashable, on_position: Optional[QueuePositionCallback] = None) -> None:
+        """
+        Ждет свободного слота. Если пришлось встать в очередь, on_position получает
+        позицию при каждом ее изменении и 0, когда слот выдан.
+        """
+        if self._running < self.max_concurrency and not self._queues:
+            self._running += 1
+            self._granted += 1
+            return
+
+        ticket = _Ticket(key)
+        self._queues.setdefault(key, deque()).append(ticket)
+        self._update_positions()
+        reported = None
+        try:
+            while not ticket.future.done():
+                if on_position is not None and ticket.position != reported:
+                    reported = ticket.position
+                    await on_position(reported)
+                    continue
+                ticket.changed.clear()
+                changed = asyncio.ensure_future(ticket.changed.wait())
+                try:
+                    await asyncio.wait({ticket.future, changed}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+            if on_position is not None:
+                await on_position(0)  # вышли из очереди, генерация начинается
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Слот выдали одновременно с отменой — возвращаем его
+                self.release()
+            else:
+                ticket.future.cancel()
+                self._remove(ticket)
+            self._abandoned += 1
+            raise
+
+        wait = time.perf_counter() - ticket.enqueued_at
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+    def release(self) -> None:
+        self._running -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._running < self.max_concurrency and self._queues:
+            key, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            # Ключ уходит в конец круга; пустые очереди удаляются
+            del self._queues[key]
+            if queue:
+                self._queues[key] = queue
+            if ticket.future.done():
+                continue
+            self._running += 1
+            self._granted += 1
+            ticket.future.set_result(None)
+        self._update_positions()
+
+    def _remove(self, ticket: _Ticket) -> None:
+        queue = self._queues.get(ticket.key)
+        if queue is None:
+            return
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[ticket.key]
+        self._update_positions()
+
+    def _update_positions(self) -> None:
+        # Позиция = сколько запросов будет выдано раньше этого при обходе по кругу (+1)
+        queues = [list(q) for q in self._queues.values()]
+        position = 0
+        depth = 0
+        while True:
+            advanced = False
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    ticket = queue[depth]
+                    if ticket.position != position:
+                        ticket.position = position
+                        ticket.changed.set()
+                    advanced = True
+            if not advanced:
+                return
+            depth += 1
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "queued": self.queued,
+            "queued_keys": len(self._queues),
+            "granted": self._granted,
+            "abandoned": self._abandoned,
+            "avg_queue_wait_ms": round(1000 * self._total_wait / self._granted, 2) if self._granted else 0.0,
+            "max_queue_wait_ms": round(1000 * self._max_wait, 2),
+        }
+
+
+_DONE = object()
+
+
+class _Generation:
+    """Одна потоковая генерация; cancel() прерывает ее на любом этапе."""
+
+    def __init__(self):
+        self.tokens: asyncio.Queue = asyncio.Queue()
+        self.acquire_task: Optional[asyncio.Task] = None
+        self.producer: Optional[asyncio.Task] = None
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self.acquire_task is not None:
+            self.acquire_task.cancel()
+        if self.producer is not None:
+            # Закрытие HTTP-стрима останавливает генерацию и на стороне Ollama
+            self.producer.cancel()
+        self.tokens.put_nowait(GenerationCancelled())
+
+
+class LLMGateway:
+    """
+    Единая точка доступа к Ollama для всего приложения.
+
+    - один клиент OllamaLLM на модель: его httpx-клиент держит пул соединений
+      и переиспользуется всеми запросами;
+    - FairScheduler на модель ограничивает число одновременных генераций
+      и справедливо делит очередь между пользователями;
+    - в каждом чате идет не больше одной генерации: новое сообщение
+      (или cancel_chat при закрытии чата) останавливает предыдущую.
+    """
+
+    def __init__(self, base_url: str, default_model: str, max_concurrency: int = 2):
+        self.base_url = base_url
+        self.default_model = default_model
+        self.max_concurrency = max_concurrency
+        self._clients: Dict[str, Any] = {}
+        self._schedulers: Dict[str, FairScheduler] = {}
+        self._active: Dict[int, _Generation] = {}
+
+        self._started = 0
+        self._completed = 0
+        self._cancelled = 0
+        self._failed = 0
+
+    def client(self, model: Optional[str] = None):
+        model = model or self.default_model
+        llm = self._clients.get(model)
+        if llm is None:
+            # langchain тяжелый — импортируем при первом обращении, а не при старте
+            from langchain_ollama.llms import OllamaLLM
+
+            llm = self._clients[model] = OllamaLLM(model=model, base_url=self.base_url)
+        return llm
+
+    def scheduler(self, model: Optional[str] = None) -> FairScheduler:
+        model = model or self.default_model
+        scheduler = self._schedulers.get(model)
+        if scheduler is None:
+            scheduler = self._schedulers[model] = FairScheduler(self.max_concurrency)
+        return scheduler
+
+    def cancel_chat(self, chat_id: int) -> bool:
+        """Останавливает текущую генерацию в чате (в очереди или уже идущую)."""
+        generation = self._active.pop(chat_id, None)
+        if generation is None:
+            return False
+        generation.cancel()
+        return True
+
+    async def stream(
+        self,
+        prompt: str,
+        *,
+        user_id: int,
+        chat_id: int,
+        on_queue_position: Optional[QueuePositionCallback] = None,
+        model: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация ответа в чате. Бросает GenerationCancelled,
+        если генерацию остановили.
+        """
+        scheduler = self.scheduler(model)
+        self.cancel_chat(chat_id)
+        generation = _Generation()
+        self._active[chat_id] = generation
+        try:
+            generation.acquire_task = asyncio.create_task(scheduler.acquire(user_id, on_queue_position))
+            try:
+                await generation.acquire_task
+            except asyncio.CancelledError:
+                if generation.cancelled:
+                    self._cancelled += 1
+                    raise GenerationCancelled()
+                raise
+            if generation.cancelled:
+                # Слот выдали, но генерацию уже остановили
+                scheduler.release()
+                self._cancelled += 1
+                raise GenerationCancelled()
+
+            self._started += 1
+            generation.producer = asyncio.create_task(self._produce(self.client(model), prompt, generation.tokens))
+            try:
+                while True:
+                    item = await generation.tokens.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+                self._completed += 1
+            except GenerationCancelled:
+                self._cancelled += 1
+                raise
+            except Exception:
+                self._failed += 1
+                raise
+            finally:
+                generation.producer.cancel()
+                scheduler.release()
+        finally:
+            if self._active.get(chat_id) is generation:
+                del self._active[chat_id]
+
+    async def complete(self, prompt: str, *, user_id: int, model: Optional[str] = None) -> str:
+        """Генерация целиком (служебные запросы, например сводка диалога), через ту же очередь."""
+        scheduler = self.scheduler(model)
+        await scheduler.acquire(user_id)
+        try:
+            return await self.client(model).ainvoke(prompt)
+        finally:
+            scheduler.release()
+
+    @staticmethod
+    async def _produce(llm, prompt: str, tokens: asyncio.Queue) -> None:
+        try:
+            async for token in llm.astream(prompt):
+                tokens.put_nowait(token)
+            tokens.put_nowait(_DONE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            tokens.put_nowait(e)
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "active_chats": len(self._active),
+            "started": self._started,
+            "completed": self._completed,
+            "cancelled": self._cancelled,
+            "failed": self._failed,
+            "models": {model: scheduler.stats() for model, scheduler in self._schedulers.items()},
+        }
@@ -1,12 +1,18 @@
-import io
-import torch
-import soundfile as sf
+import inspect
+import re
+import threading
 import numpy as np
-from typing import List, Optional, Tuple
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple, Union
 
-import librosa  # для pitch/time-stretch
+from services.audio_pipeline import AudioPostProcessor, REVERB_WET
+from services.audio_encoding import DEFAULT_FORMAT, StreamingEncoder, encode_audio
+from services.model_registry import ModelNotReadyError
+
+
+def _select_device():
+    import torch
 
-def _select_device() -> torch.device:
     if torch.cuda.is_available():
         print("🚀 Используется CUDA (GPU).")
         return torch.device('cuda')
@@ -15,6 +21,89 @@ def _select_device() -> torch.device:
         return torch.device('cpu')
 
 
+# Границы предложений: после . ! ? … (с возможными кавычками/скобками) и переводы строк
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+|(?<=[.!?…]["»)\]])\s+|\n+')
+_SOFT_BOUNDARY = re.compile(r'(?<=[,;:])\s+')
+
+
+def split_into_sentences(text: str, max_chars: int = 300, min_chars: int = 20) -> List[str]:
+    """
+    Делит текст на предложения для поэтапного синтеза.
+    Слишком короткие куски склеиваются с соседними, слишком длинные
+    дополнительно режутся по запятым и пробелам (Silero не любит длинный ввод).
+    """
+    parts: List[str] = []
+    for raw in _SENTENCE_BOUNDARY.split(text):
+        raw = raw.strip()
+        if not raw:
+            continue
+        while len(raw) > max_chars:
+            cut = -1
+            for m in _SOFT_BOUNDARY.finditer(raw, 0, max_chars):
+                cut = m.start()
+            if cut <= 0:
+                cut = raw.rfind(' ', 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            parts.append(raw[:cut].strip())
+            raw = raw[cut:].strip()
+        if raw:
+            parts.append(raw)
+
+    merged: List[str] = []
+    for part in parts:
+        if merged and len(merged[-1]) < min_chars and len(merged[-1]) + len(part) < max_chars:
+            merged[-1] = f"{merged[-1]} {part}"
+        else:
+            merged.append(part)
+    return merged
+
+
+class SentenceChunker:
+    """
+    Накопитель токенов LLM: отдает готовые предложения, как только в потоке
+    встречается граница предложения, остаток ждет следующих токенов.
+    """
+
+    def __init__(self, max_chars: int = 300, min_chars: int = 20):
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, token: str) -> List[str]:
+        self._buffer += token
+        last = None
+        for m in _SENTENCE_BOUNDARY.finditer(self._buffer):
+            last = m
+        if last is not None and last.start() >= self.min_chars:
+            complete, self._buffer = self._buffer[:last.start()], self._buffer[last.end():]
+            return split_into_sentences(complete, self.max_chars, self.min_chars)
+        if len(self._buffer) > self.max_chars:
+            # Длинный кусок без точки: режем по запятым/пробелам, хвост оставляем
+            parts = split_into_sentences(self._buffer, self.max_chars, self.min_chars)
+            self._buffer = parts.pop() if parts else ""
+            return parts
+        return []
+
+    def flush(self) -> List[str]:
+        rest, self._buffer = self._buffer, ""
+        return split_into_sentences(rest, self.max_chars, self.min_chars)
+
+
+@dataclass
+class TTSStreamState:
+    """
+    Состояние потокового синтеза между сегментами:
+    хвост реверберации переносится в следующий сегмент, а пик для нормализации
+    только растет, чтобы громкость не прыгала на стыках. Кодировщик один на
+    весь поток, чтобы OGG/MP3 получались одним непрерывным файлом.
+    """
+    encoder: StreamingEncoder
+    output_sample_rate: int
+    reverb_tail: Optional[np.ndarray] = None
+    peak: float = 0.0
+
+
 class LocalTextToVoiceService:
     """
     Локальный сервис TTS (Text-to-Speech) на базе Silero.
@@ -32,14 +121,32 @@ class LocalTextToVoiceService:
         self.language = language
         self.model_id = model_id
         self.sample_rate = sample_rate
-        self.device = _select_device()
+        self.post = AudioPostProcessor(sample_rate)
+        self.device = None
         self.model = None
         self.speakers: List[str] = []
-        self._load_model()
+        # Умеет ли модель синтезировать список текстов за один вызов
+        self.supports_batch = False
+        # Модель грузится не в конструкторе, а через load() (в фоне после старта)
+        self._load_lock = threading.Lock()
+        self._load_attempted = False
+
+    def load(self) -> None:
+        """Загружает модель (один раз). Бросает исключение, если загрузка не удалась."""
+        with self._load_lock:
+            if not self._load_attempted:
+                self._load_model()
+                self._load_attempted = True
+        if not self.model:
+            raise RuntimeError("TTS модель не загружена")
 
     def _load_model(self):
+        # torch импортируется только здесь: старт приложения не платит за него
+        import torch
+
         print(f"Загрузка модели Silero ({self.model_id})...")
         try:
+            self.device = _select_device()
             self.model, _ = torch.hub.load(
                 repo_or_dir='snakers4/silero-models',
                 model='silero_tts',
@@ -48,6 +155,7 @@ class LocalTextToVoiceService:
             )
             self.model.to(self.device)
             self.speakers = getattr(self.model, "speakers", [self.model_id])
+            self.supports_batch = self._detect_batch_support()
             print(f"✅ Модель загружена. Доступные дикторы: {self.speakers}")
         except Exception as e:
             print(f"❌ Ошибка загрузки модели: {e}")
@@ -63,82 +171,205 @@ class LocalTextToVoiceService:
         reverb_time: float = 0.0,
         reverb_decay: float = 0.0,
         silence_before: float = 0.0,
-        silence_after: float = 0.0
+        silence_after: float = 0.0,
+        output_format: str = DEFAULT_FORMAT,
+        output_sample_rate: Optional[int] = None
     ) -> bytes:
         """
         Синтез речи и пост-обработка с применением всех параметров.
-        Возвращает WAV в виде байтов.
+        Возвращает аудио в виде байтов (по умолчанию WAV 16 бит с частотой модели;
+        output_format/output_sample_rate позволяют получить Opus/OGG/MP3 и меньшую частоту).
         """
+        self.validate_speaker(speaker)
+
+        # Генерация исходного аудио (numpy float32)
+        wav = self._apply_tts(text, speaker)
+
+        wav = self._postprocess(
+            wav, speed, pitch_semitones, gain_db, reverb_time, reverb_decay, silence_before, silence_after
+        )
+        return self._encode(wav, output_format, output_sample_rate)
+
+    def synthesize_batch(self, requests: List[dict]) -> List[Union[bytes, Exception]]:
+        """
+        Синтез пачки запросов за один проход (для микробатчинга).
+        Каждый элемент requests — kwargs для synthesize_to_bytes.
+        Запросы группируются по голосу; если модель принимает список текстов,
+        группа синтезируется одним вызовом, иначе — последовательно.
+        Ошибка одного запроса не ломает остальные: на ее месте в результате
+        возвращается исключение.
+        """
+        results: List[Union[bytes, Exception, None]] = [None] * len(requests)
+        groups: dict = {}
+        for i, req in enumerate(requests):
+            try:
+                self.validate_speaker(req.get("speaker", "aidar"))
+            except Exception as e:
+                results[i] = e
+                continue
+            groups.setdefault(req.get("speaker", "aidar"), []).append(i)
+
+        for speaker, indices in groups.items():
+            texts = [requests[i]["text"] for i in indices]
+            try:
+                wavs = self._apply_tts_batch(texts, speaker)
+            except Exception as e:
+                for i in indices:
+                    results[i] = e
+                continue
+            for i, wav in zip(indices, wavs):
+                params = {k: v for k, v in requests[i].items() if k not in ("text", "speaker")}
+                output_format = params.pop("output_format", DEFAULT_FORMAT)
+                output_sample_rate = params.pop("output_sample_rate", None)
+                try:
+                    results[i] = self._encode(self._postprocess(wav, **params), output_format, output_sample_rate)
+                except Exception as e:
+                    results[i] = e
+        return results
+
+    def cache_identity(self) -> dict:
+        """Параметры модели, от которых зависит результат синтеза (для ключа кэша)."""
+        return {"model_id": self.model_id, "sample_rate": self.sample_rate}
+
+    def validate_speaker(self, speaker: str) -> None:
         if not self.model:
+            if not self._load_attempted:
+                raise ModelNotReadyError("tts")
             raise RuntimeError("TTS модель не загружена")
 
         if speaker not in self.speakers:
             raise ValueError(f"Голос '{speaker}' не найден. Доступные: {self.speakers}")
 
-        # Генерация исходного аудио (numpy float32)
+    def _apply_tts(self, text: str, speaker: str) -> np.ndarray:
         wav_tensor = self.model.apply_tts(
             text=text,
             speaker=speaker,
             sample_rate=self.sample_rate
         )
-        wav = wav_tensor.detach().cpu().numpy().astype(np.float32)
-
-        # -----------------------
-        # Пост-обработка
-        # -----------------------
-        wav = self._add_silence(wav, silence_before, silence_after)
-        wav = self._pitch_shift(wav, pitch_semitones)
-        wav = self._time_stretch(wav, speed)
-        wav = self._change_volume(wav, gain_db)
-        wav = self._add_reverb(wav, reverb_time, reverb_decay)
-        wav = self._normalize(wav)
-
-        # Конвертация в WAV байты
-        buffer = io.BytesIO()
-        sf.write(buffer, wav, self.sample_rate, format='WAV')
-        buffer.seek(0)
-        return buffer.read()
+        return wav_tensor.detach().cpu().numpy().astype(np.float32)
+
+    def _detect_batch_support(self) -> bool:
+        # Старые модели Silero принимают texts=[...], v3/v4 — только один text
+        try:
+            return "texts" in inspect.signature(self.model.apply_tts).parameters
+        except (TypeError, ValueError):
+            return False
+
+    def _apply_tts_batch(self, texts: List[str], speaker: str) -> List[np.ndarray]:
+        if self.supports_batch and len(texts) > 1:
+            wav_tensors = self.model.apply_tts(
+                texts=texts,
+                speaker=speaker,
+                sample_rate=self.sample_rate
+            )
+            return [w.detach().cpu().numpy().astype(np.float32) for w in wav_tensors]
+        import torch
+
+        with torch.inference_mode():
+            return [self._apply_tts(text, speaker) for text in texts]
+
+    def _postprocess(
+        self,
+        wav: np.ndarray,
+        speed: float = 1.0,
+        pitch_semitones: float = 0.0,
+        gain_db: float = 0.0,
+        reverb_time: float = 0.0,
+        reverb_decay: float = 0.0,
+        silence_before: float = 0.0,
+        silence_after: float = 0.0
+    ) -> np.ndarray:
+        return self.post.process(
+            wav,
+            speed=speed,
+            pitch_semitones=pitch_semitones,
+            gain_db=gain_db,
+            reverb_time=reverb_time,
+            reverb_decay=reverb_decay,
+            silence_before=silence_before,
+            silence_after=silence_after,
+        )
+
+    def _encode(self, wav: np.ndarray, output_format: str, output_sample_rate: Optional[int]) -> bytes:
+        sample_rate = output_sample_rate or self.sample_rate
+        wav = self.post.resample(wav, self.sample_rate, sample_rate)
+        return encode_audio(wav, output_format, sample_rate)
 
     # -----------------------
-    # Пост-обработка
+    # Потоковый синтез
     # -----------------------
-    def _normalize(self, wav: np.ndarray, target_peak: float = 0.98) -> np.ndarray:
-        peak = np.max(np.abs(wav))
-        if peak > 0:
-            wav = wav * (target_peak / peak)
-        return wav.astype(np.float32)
-
-    def _change_volume(self, wav: np.ndarray, db: float) -> np.ndarray:
-        factor = 10 ** (db / 20)
-        return (wav * factor).astype(np.float32)
-
-    def _time_stretch(self, wav: np.ndarray, speed: float) -> np.ndarray:
-        if abs(speed - 1.0) < 1e-6:
-            return wav
-        return librosa.effects.time_stretch(wav, rate=speed).astype(np.float32)
+    STREAM_FADE_SECONDS = 0.005
 
-    def _pitch_shift(self, wav: np.ndarray, n_steps: float) -> np.ndarray:
-        if abs(n_steps) < 1e-6:
-            return wav
-        return librosa.effects.pitch_shift(wav, sr=self.sample_rate, n_steps=n_steps).astype(np.float32)
+    def start_stream(self, output_format: str = DEFAULT_FORMAT,
+                     output_sample_rate: Optional[int] = None) -> TTSStreamState:
+        sample_rate = output_sample_rate or self.sample_rate
+        return TTSStreamState(encoder=StreamingEncoder(output_format, sample_rate), output_sample_rate=sample_rate)
+
+    def finish_stream(self, state: TTSStreamState) -> bytes:
+        """Дописывает хвост кодировщика (последние страницы OGG/MP3)."""
+        return state.encoder.close()
+
+    def synthesize_segment(
+        self,
+        text: str,
+        state: TTSStreamState,
+        speaker: str = 'aidar',
+        speed: float = 1.0,
+        pitch_semitones: float = 0.0,
+        gain_db: float = 0.0,
+        reverb_time: float = 0.0,
+        reverb_decay: float = 0.0,
+    ) -> bytes:
+        """
+        Синтезирует один сегмент (предложение) потокового ответа и возвращает
+        байты, готовые к отправке в кодировке потока (state.encoder).
+        """
+        self.validate_speaker(speaker)
+
+        wav = self._apply_tts(text, speaker)
+        # Нормализация здесь не делается — в потоке она считается по накопленному пику
+        wav = self.post.process(wav, speed=speed, pitch_semitones=pitch_semitones, gain_db=gain_db, normalize=False)
+        wav = self._fade_edges(wav)
+        wav = self._add_reverb_streaming(wav, reverb_time, reverb_decay, state)
+
+        # Нормализация по накопленному пику: коэффициент может только уменьшаться
+        state.peak = max(state.peak, float(np.max(np.abs(wav))) if wav.size else 0.0)
+        if state.peak > 0:
+            wav *= 0.98 / state.peak
+        wav = self.post.resample(wav, self.sample_rate, state.output_sample_rate)
+        return state.encoder.encode(wav)
+
+    def synthesize_stream(self, text: str, output_format: str = DEFAULT_FORMAT,
+                          output_sample_rate: Optional[int] = None, **params) -> Iterator[bytes]:
+        """Синхронный генератор: закодированное аудио по предложениям."""
+        state = self.start_stream(output_format, output_sample_rate)
+        for sentence in split_into_sentences(text):
+            yield self.synthesize_segment(sentence, state, **params)
+        yield self.finish_stream(state)
 
-    def _add_silence(self, wav: np.ndarray, before: float, after: float) -> np.ndarray:
-        b = int(round(before * self.sample_rate))
-        a = int(round(after * self.sample_rate))
-        if b == 0 and a == 0:
+    def _fade_edges(self, wav: np.ndarray) -> np.ndarray:
+        # Короткие фейды на краях сегмента убирают щелчки на стыках
+        n = min(int(self.sample_rate * self.STREAM_FADE_SECONDS), len(wav) // 2)
+        if n <= 0:
             return wav
-        silence_before = np.zeros(b, dtype=np.float32)
-        silence_after = np.zeros(a, dtype=np.float32)
-        return np.concatenate([silence_before, wav, silence_after]).astype(np.float32)
+        ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)
+        wav[:n] *= ramp
+        wav[-n:] *= ramp[::-1]
+        return wav
 
-    def _add_reverb(self, wav: np.ndarray, reverb_time: float, decay: float) -> np.ndarray:
-        if reverb_time <= 0 or decay <= 0:
+    def _add_reverb_streaming(self, wav: np.ndarray, reverb_time: float, decay: float,
+                              state: TTSStreamState) -> np.ndarray:
+        convolved = self.post.reverb_full(wav, reverb_time, decay)
+        if convolved is None:
             return wav
-        n = int(self.sample_rate * reverb_time)
-        t = np.arange(n, dtype=np.float32)
-        ir = (decay ** (t / (self.sample_rate * reverb_time))).astype(np.float32)
-        ir /= (np.sum(np.abs(ir)) + 1e-9)
-        convolved = np.convolve(wav, ir, mode='full')[:len(wav)]
-        out = wav + convolved * 0.7
-        out /= max(1.0, np.max(np.abs(out)) + 1e-9)
-        return out.astype(np.float32)
+        # Хвост предыдущего сегмента доигрывает поверх начала текущего
+        tail = state.reverb_tail
+        if tail is not None and tail.size:
+            if tail.size > convolved.size:
+                convolved = np.concatenate([convolved, np.zeros(tail.size - convolved.size, dtype=np.float32)])
+            convolved[:tail.size] += tail
+        state.reverb_tail = convolved[len(wav):]
+        out = convolved[:len(wav)]
+        out *= REVERB_WET
+        out += wav
+        return out
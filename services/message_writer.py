@@ -0,0 +1,279 @@
+# services/message_writer.py
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models import Message, MessageStatus
+from services.history_cache import HistoryCache
+from repositories.message_repo import MessageRepository, exchange_rows
+
+
+class _PendingExchange:
+    __slots__ = ("rows", "future")
+
+    def __init__(self, rows: List[dict]):
+        self.rows = rows
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class MessageWriter:
+    """
+    Запись сообщений чатов группами (group commit).
+
+    Вставки всех чатов, пришедшие за окно batch_ms, уходят в базу одной
+    транзакцией: один INSERT ... RETURNING и один коммит (fsync) на всю
+    группу вместо пары коммитов с refresh на каждое сообщение.
+    add_exchange ждет коммита своей группы — ID сообщений нужны сразу.
+
+    Обновления текста (update_content) в режиме write_behind не ждут
+    записи: они копятся (для одного сообщения остается последний текст)
+    и попадают в ближайшую группу. Контрольные точки стримящегося ответа
+    (checkpoint) не ждут записи никогда. close() при остановке приложения
+    дописывает все накопленное.
+
+    Если группа не записалась, каждая пара повторяется отдельной транзакцией:
+    ошибка одной пары (например, чат удален — FOREIGN KEY) достается только
+    ее отправителю. Обновления удаленных сообщений пропускаются без ошибки;
+    не записавшееся обновление повторяется не больше update_retries раз.
+
+    cache (HistoryCache) получает вставки и обновления после коммита группы,
+    поэтому закэшированная история видит и стримящийся ответ модели.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable,
+        batch_ms: float = 5.0,
+        max_batch: int = 256,
+        write_behind: bool = True,
+        cache: Optional[HistoryCache] = None,
+        update_retries: int = 3,
+    ):
+        self.session_factory = session_factory
+        self.cache = cache
+        self.batch_window = max(0.0, batch_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self.write_behind = write_behind
+        self.update_retries = max(0, update_retries)
+
+        self._exchanges: List[_PendingExchange] = []
+        # message_id -> (chat_id, последний текст, новый статус или None); future ждут синхронные обновления
+        self._updates: Dict[int, Tuple[int, str, Optional[MessageStatus]]] = {}
+        # message_id -> сколько раз обновление уже не записалось
+        self._update_failures: Dict[int, int] = {}
+        self._update_waiters: List[asyncio.Future] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        # Группы пишутся строго по очереди: более новый текст сообщения не обгонит старый
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self._batches = 0
+        self._rows_inserted = 0
+        self._rows_updated = 0
+        self._updates_coalesced = 0
+        self._checkpoints = 0
+        self._updates_skipped = 0
+        self._updates_dropped = 0
+        self._errors = 0
+        self._total_flush = 0.0
+        self._max_flush = 0.0
+
+    async def add_exchange(self, chat_id: int, content: str, user_id: Optional[int]) -> Tuple[Message, Message]:
+        """Сообщение пользователя и плейсхолдер ответа модели; возвращается после коммита."""
+        if self._closed:
+            raise RuntimeError("MessageWriter закрыт")
+        pending = _PendingExchange(exchange_rows(chat_id, content, user_id))
+        self._exchanges.append(pending)
+        self._kick()
+        user_msg, model_msg = await asyncio.shield(pending.future)
+        return user_msg, model_msg
+
+    async def update_content(
+        self,
+        chat_id: int,
+        message_id: int,
+        content: str,
+        status: MessageStatus = MessageStatus.COMPLETE,
+    ) -> None:
+        """Итоговый текст и статус ответа; в режиме write_behind возвращается сразу, не дожидаясь записи."""
+        if self._closed:
+            raise RuntimeError("MessageWriter закрыт")
+        if message_id in self._updates:
+            self._updates_coalesced += 1
+        self._updates[message_id] = (chat_id, content, status)
+        if self.write_behind:
+            self._kick()
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._update_waiters.append(waiter)
+        self._kick()
+        await asyncio.shield(waiter)
+
+    def checkpoint(self, chat_id: int, message_id: int, content: str) -> None:
+        """Промежуточный текст стримящегося ответа (статус не меняется); запись в фоне."""
+        if self._closed:
+            return
+        pending = self._updates.get(message_id)
+        if pending is not None:
+            if pending[2] is not None:
+                return  # Итоговый текст уже в очереди — контрольная точка его не перетирает
+            self._updates_coalesced += 1
+        self._updates[message_id] = (chat_id, content, None)
+        self._checkpoints += 1
+        self._kick()
+
+    async def flush(self, max_errors: int = 3) -> None:
+        """Записывает все накопленное прямо сейчас; после max_errors ошибок подряд сдается."""
+        errors = self._errors
+        while (self._exchanges or self._updates) and self._errors - errors < max_errors:
+            await self._flush_batch()
+
+    async def close(self) -> None:
+        """Остановка приложения: больше не принимаем записи и дописываем очередь."""
+        self._closed = True
+        await self.flush()
+        if self._updates:
+            print(f"MessageWriter: не удалось записать {len(self._updates)} обновлений при остановке")
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _kick(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Окно группировки: ждем остальных, если группа еще не набрана
+            if self.batch_window and len(self._exchanges) < self.max_batch:
+                await asyncio.sleep(self.batch_window)
+            while self._exchanges or self._updates:
+                await self._flush_batch()
+
+    async def _flush_batch(self) -> None:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if self._exchanges or self._updates:
+                await self._write_batch()
+
+    async def _write_batch(self) -> None:
+        exchanges = self._exchanges[:self.max_batch]
+        self._exchanges = self._exchanges[self.max_batch:]
+        updates, self._updates = self._updates, {}
+        waiters, self._update_waiters = self._update_waiters, []
+
+        try:
+            await self._write(exchanges, updates, waiters)
+            return
+        except Exception as e:
+            self._errors += 1
+            print(f"MessageWriter: ошибка записи группы ({len(exchanges)} вставок, {len(updates)} обновлений): {e}")
+            error = e
+
+        parts = [([pending], {}, []) for pending in exchanges]
+        if updates or waiters:
+            parts.append(([], updates, waiters))
+        if len(parts) == 1:
+            self._fail(*parts[0], error)
+        else:
+            # Повторяем каждую пару отдельно: плохая пара не должна ронять чужие
+            for part in parts:
+                try:
+                    await self._write(*part)
+                except Exception as e:
+                    self._errors += 1
+                    print(f"MessageWriter: ошибка записи ({len(part[0])} вставок, {len(part[1])} обновлений): {e}")
+                    self._fail(*part, e)
+        if self.write_behind and self._updates and not self._closed:
+            await asyncio.sleep(0.5)
+
+    async def _write(
+        self,
+        exchanges: List[_PendingExchange],
+        updates: Dict[int, Tuple[int, str, Optional[MessageStatus]]],
+        waiters: List[asyncio.Future],
+    ) -> None:
+        """Одна транзакция: вставки и обновления; после коммита — кэш, статистика и future."""
+        started = time.perf_counter()
+        async with self.session_factory() as session:
+            repo = MessageRepository(session, cache=self.cache)
+            rows = [row for pending in exchanges for row in pending.rows]
+            inserted = await repo.insert_messages(rows)
+            applied = await repo.update_streaming_contents(updates)
+            await session.commit()
+
+        elapsed = time.perf_counter() - started
+        repo.remember_inserted(inserted)
+        repo.remember_updated(applied)
+        for message_id in updates:
+            self._update_failures.pop(message_id, None)
+        self._batches += 1
+        self._rows_inserted += len(inserted)
+        self._rows_updated += len(applied)
+        self._updates_skipped += len(updates) - len(applied)
+        self._total_flush += elapsed
+        self._max_flush = max(self._max_flush, elapsed)
+        for i, pending in enumerate(exchanges):
+            if not pending.future.done():
+                pending.future.set_result((inserted[2 * i], inserted[2 * i + 1]))
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _fail(
+        self,
+        exchanges: List[_PendingExchange],
+        updates: Dict[int, Tuple[int, str, Optional[MessageStatus]]],
+        waiters: List[asyncio.Future],
+        error: Exception,
+    ) -> None:
+        for pending in exchanges:
+            if not pending.future.done():
+                pending.future.set_exception(error)
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(error)
+        if not self.write_behind:
+            return
+        # Обновления никто не ждет — вернем их в очередь, если не пришел текст новее,
+        # но не бесконечно: после update_retries неудач обновление отбрасывается
+        for message_id, update in updates.items():
+            failures = self._update_failures.get(message_id, 0) + 1
+            if message_id in self._updates:
+                continue
+            if failures > self.update_retries:
+                self._update_failures.pop(message_id, None)
+                self._updates_dropped += 1
+                print(f"MessageWriter: обновление сообщения {message_id} отброшено после {failures} ошибок")
+                continue
+            self._update_failures[message_id] = failures
+            self._updates[message_id] = update
+
+    def stats(self) -> dict:
+        return {
+            "write_behind": self.write_behind,
+            "batch_ms": round(self.batch_window * 1000, 2),
+            "pending_exchanges": len(self._exchanges),
+            "pending_updates": len(self._updates),
+            "batches": self._batches,
+            "rows_inserted": self._rows_inserted,
+            "rows_updated": self._rows_updated,
+            "updates_coalesced": self._updates_coalesced,
+            "checkpoints": self._checkpoints,
+            "updates_skipped": self._updates_skipped,
+            "updates_dropped": self._updates_dropped,
+            "avg_rows_per_batch": round(
+                (self._rows_inserted + self._rows_updated) / self._batches, 2
+            ) if self._batches else 0.0,
+            "avg_flush_ms": round(1000 * self._total_flush / self._batches, 2) if self._batches else 0.0,
+            "max_flush_ms": round(1000 * self._max_flush, 2),
+            "errors": self._errors,
+        }
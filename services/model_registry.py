@@ -0,0 +1,68 @@
+# services/model_registry.py
+import asyncio
+import time
+from typing import Callable, Dict, Optional
+
+
+class ModelNotReadyError(Exception):
+    """
+    Модель еще загружается в фоне. retry_after — через сколько секунд
+    имеет смысл повторить запрос.
+    """
+
+    def __init__(self, model_name: str, retry_after: int = 5):
+        super().__init__(f"Модель '{model_name}' еще загружается, повторите через {retry_after} с.")
+        self.model_name = model_name
+        self.retry_after = retry_after
+
+
+class ModelRegistry:
+    """
+    Фоновая загрузка ML-моделей после старта сервера.
+
+    loaders — синхронные функции загрузки (например, LocalTextToVoiceService.load);
+    они выполняются по очереди в отдельном потоке, чтобы модели не дрались
+    за ядра и не блокировали event loop. Ошибка загрузки помечает модель
+    как failed и не мешает загрузке остальных.
+    """
+
+    PENDING = "pending"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self, loaders: Dict[str, Callable[[], None]]):
+        self._loaders = dict(loaders)
+        self._state: Dict[str, dict] = {
+            name: {"state": self.PENDING, "load_seconds": None, "error": None} for name in self._loaders
+        }
+        self._started_at: Optional[float] = None
+
+    async def load_all(self) -> None:
+        self._started_at = time.monotonic()
+        for name, loader in self._loaders.items():
+            await self.load(name, loader)
+
+    async def load(self, name: str, loader: Callable[[], None]) -> None:
+        entry = self._state[name]
+        entry["state"] = self.LOADING
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(loader)
+            entry["state"] = self.READY
+        except Exception as e:
+            entry["state"] = self.FAILED
+            entry["error"] = str(e)
+            print(f"❌ Модель '{name}' не загружена: {e}")
+        entry["load_seconds"] = round(time.perf_counter() - started, 3)
+
+    @property
+    def ready(self) -> bool:
+        return all(entry["state"] == self.READY for entry in self._state.values())
+
+    def status(self) -> dict:
+        """Состояние каждой модели для /health/ready."""
+        return {
+            "ready": self.ready,
+            "models": {name: dict(entry) for name, entry in self._state.items()},
+        }
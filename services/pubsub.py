@@ -0,0 +1,224 @@
+# services/pubsub.py
+import asyncio
+import json
+import uuid
+from typing import Callable, Dict, List, Optional
+
+# Получатель событий: (chat_id, event, data, event_id)
+EventHandler = Callable[[int, str, str, str], None]
+
+
+class PubSubBackend:
+    """
+    Транспорт событий чатов между процессами для Broadcaster.
+
+    publish() не блокирует и сохраняет порядок событий одного процесса;
+    события доставляются обработчику, переданному в bind(), во всех
+    процессах, подключенных к тому же каналу (включая текущий).
+    start()/close() открывают и закрывают соединения с внешним брокером.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self.instance_id = uuid.uuid4().hex[:12]
+        self._handler: Optional[EventHandler] = None
+        self._published = 0
+        self._received = 0
+
+    def bind(self, handler: EventHandler) -> None:
+        self._handler = handler
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def publish(self, chat_id: int, event: str, data: str, event_id: str) -> None:
+        raise NotImplementedError
+
+    def _deliver(self, chat_id: int, event: str, data: str, event_id: str) -> None:
+        self._received += 1
+        if self._handler is not None:
+            self._handler(chat_id, event, data, event_id)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "instance_id": self.instance_id,
+            "published": self._published,
+            "received": self._received,
+        }
+
+
+class InProcessBackend(PubSubBackend):
+    """Один процесс: событие сразу уходит локальным подписчикам (поведение по умолчанию)."""
+
+    name = "memory"
+
+    def publish(self, chat_id: int, event: str, data: str, event_id: str) -> None:
+        self._published += 1
+        self._deliver(chat_id, event, data, event_id)
+
+
+class LocalBus:
+    """
+    Общая шина в памяти для нескольких Broadcaster в одном процессе.
+    Заменяет Redis в проверках: каждый Broadcaster изображает отдельный воркер.
+    """
+
+    def __init__(self):
+        self._members: List["LocalBusBackend"] = []
+
+    def attach(self, member: "LocalBusBackend") -> None:
+        self._members.append(member)
+
+    def detach(self, member: "LocalBusBackend") -> None:
+        if member in self._members:
+            self._members.remove(member)
+
+    def send(self, sender: "LocalBusBackend", chat_id: int, event: str, data: str, event_id: str) -> None:
+        loop = asyncio.get_running_loop()
+        for member in list(self._members):
+            if member is not sender:
+                # Как и по сети, чужие воркеры получают событие не сразу; call_soon сохраняет порядок
+                loop.call_soon(member._deliver, chat_id, event, data, event_id)
+
+
+class LocalBusBackend(PubSubBackend):
+    """Воркер, подключенный к LocalBus: свои события — сразу, чужие — через шину."""
+
+    name = "local"
+
+    def __init__(self, bus: LocalBus):
+        super().__init__()
+        self.bus = bus
+
+    def bind(self, handler: EventHandler) -> None:
+        super().bind(handler)
+        self.bus.attach(self)
+
+    async def close(self) -> None:
+        self.bus.detach(self)
+
+    def publish(self, chat_id: int, event: str, data: str, event_id: str) -> None:
+        self._published += 1
+        self._deliver(chat_id, event, data, event_id)
+        self.bus.send(self, chat_id, event, data, event_id)
+
+
+class RedisBackend(PubSubBackend):
+    """
+    Redis pub/sub: все воркеры и узлы подписаны на один канал.
+
+    Свои события доставляются локально сразу, в Redis они уходят через
+    очередь с одной задачей-отправителем: одно соединение и строгая
+    очередность публикаций, поэтому new_message и stream_token одного чата
+    приходят на другие воркеры в том же порядке. Сообщения со своим
+    instance_id из канала пропускаются.
+
+    Неудачная публикация повторяется с растущей паузой (до max_retries раз),
+    следующие события ждут в очереди, чтобы не обогнать ее; после этого
+    событие отбрасывается и учитывается в dropped.
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        url: str,
+        channel: str = "voice-chat:events",
+        max_pending: int = 10000,
+        max_retries: int = 5,
+        retry_delay: float = 0.1,
+        max_retry_delay: float = 2.0,
+    ):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self.max_retries = max(0, max_retries)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._outgoing: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._client = None
+        self._tasks: List[asyncio.Task] = []
+        self._dropped = 0
+        self._errors = 0
+
+    async def start(self) -> None:
+        # redis нужен только при SSE_PUBSUB_BACKEND=redis
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(self.url)
+        pubsub = self._client.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._tasks = [
+            asyncio.create_task(self._send_loop()),
+            asyncio.create_task(self._listen_loop(pubsub)),
+        ]
+        print(f"Pub/sub: Redis {self.url}, канал '{self.channel}', экземпляр {self.instance_id}")
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def publish(self, chat_id: int, event: str, data: str, event_id: str) -> None:
+        self._published += 1
+        self._deliver(chat_id, event, data, event_id)
+        payload = json.dumps({"o": self.instance_id, "c": chat_id, "e": event, "d": data, "i": event_id}, ensure_ascii=False)
+        try:
+            self._outgoing.put_nowait(payload)
+        except asyncio.QueueFull:
+            # Redis недоступен слишком долго — другие воркеры пропустят событие
+            self._dropped += 1
+
+    async def _send_loop(self) -> None:
+        while True:
+            payload = await self._outgoing.get()
+            attempt = 0
+            while True:
+                try:
+                    await self._client.publish(self.channel, payload)
+                    break
+                except Exception as e:
+                    self._errors += 1
+                    if attempt >= self.max_retries:
+                        self._dropped += 1
+                        print(f"Pub/sub: событие не опубликовано в Redis после {attempt + 1} попыток, "
+                              f"отброшено: {e}")
+                        break
+                    delay = min(self.max_retry_delay, self.retry_delay * 2 ** attempt)
+                    print(f"Pub/sub: ошибка публикации в Redis, повтор через {delay:.1f} с: {e}")
+                    attempt += 1
+                    await asyncio.sleep(delay)
+
+    async def _listen_loop(self, pubsub) -> None:
+        while True:
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                self._errors += 1
+                print(f"Pub/sub: ошибка чтения из Redis: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None or message.get("type") != "message":
+                continue
+            event: Dict = json.loads(message["data"])
+            if event["o"] == self.instance_id:
+                continue
+            self._deliver(event["c"], event["e"], event["d"], event["i"])
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "channel": self.channel,
+            "pending": self._outgoing.qsize(),
+            "dropped": self._dropped,
+            "errors": self._errors,
+        }
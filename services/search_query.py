@@ -0,0 +1,123 @@
+# services/search_query.py
+import html
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_CYRILLIC_RE = re.compile(r"[а-яё]")
+
+# Запасной вариант без snowballstemmer: окончания русских слов, длинные первыми
+_RU_ENDINGS = sorted(
+    (
+        "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией", "иям", "иях",
+        "ах", "ях", "ов", "ев", "ей", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ую", "юю",
+        "ом", "ем", "ам", "ям", "ия", "ие", "ию", "ые", "ых", "их",
+        "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+    ),
+    key=len,
+    reverse=True,
+)
+
+# Короче — слово ищется целиком: префикс из 1-2 букв совпадает почти со всем
+MIN_STEM_CHARS = 3
+
+
+@lru_cache(maxsize=None)
+def _stemmer(language: str):
+    try:
+        # Необязательная зависимость: без нее окончания отрезаются по списку
+        import snowballstemmer
+    except ImportError:
+        return None
+    return snowballstemmer.stemmer(language)
+
+
+def stem(word: str) -> str:
+    """Основа слова: русский или английский стеммер Snowball по алфавиту слова."""
+    word = word.lower().replace("ё", "е")
+    cyrillic = bool(_CYRILLIC_RE.search(word))
+    stemmer = _stemmer("russian" if cyrillic else "english")
+    if stemmer is not None:
+        return stemmer.stemWord(word)
+    if cyrillic:
+        for ending in _RU_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_CHARS:
+                return word[:-len(ending)]
+    return word
+
+
+def parse_query(text: str, max_terms: int = 8) -> List[Tuple[str, bool]]:
+    """Слова запроса как (основа, искать_как_префикс)."""
+    terms = []
+    for word in _WORD_RE.findall(text)[:max_terms]:
+        base = stem(word)
+        if len(base) >= MIN_STEM_CHARS:
+            terms.append((base, True))
+        else:
+            terms.append((word.lower().replace("ё", "е"), False))
+    return terms
+
+
+def build_match_query(text: str, max_terms: int = 8) -> Optional[str]:
+    """
+    Выражение MATCH для FTS5 из пользовательского запроса.
+
+    В SQLite нет токенизатора с русской морфологией, поэтому индекс хранит
+    слова как есть (unicode61: регистр и ё/е свернуты), а формы слова
+    покрываются на стороне запроса: каждое слово сводится к основе и ищется
+    как префикс ("книгами" -> "книг"* найдет книга, книги, книгой).
+    Слова объединяются через AND; синтаксис FTS5 из ввода не проходит —
+    каждое слово в кавычках. None, если слов нет.
+    """
+    terms = [f'"{term}"*' if prefix else f'"{term}"' for term, prefix in parse_query(text, max_terms)]
+    return " ".join(terms) or None
+
+
+def make_snippet(content: str, query: str, max_words: int = 12) -> str:
+    """
+    Фрагмент сообщения для выдачи поиска: окно из max_words слов с наибольшим
+    числом совпадений, совпадения — в <mark>, остальной текст экранирован.
+
+    Строится здесь, а не snippet() FTS5: тот для каждой строки заново
+    вычисляет префиксный запрос по всему индексу. Совпадения считаются
+    так же, как в индексе: без регистра, ё = е, по основе слова.
+    """
+    terms = parse_query(query)
+    words = list(_WORD_RE.finditer(content))
+
+    def matches(word: str) -> bool:
+        word = word.lower().replace("ё", "е")
+        return any(word.startswith(term) if prefix else word == term for term, prefix in terms)
+
+    hits = [matches(w.group()) for w in words]
+    if not words:
+        return html.escape(content)
+    # Окно с наибольшим числом совпадений (первое из лучших)
+    best_start, best_count, count = 0, -1, 0
+    for i in range(len(words)):
+        count += hits[i]
+        if i >= max_words:
+            count -= hits[i - max_words]
+        start = max(0, i - max_words + 1)
+        if count > best_count and i >= min(max_words, len(words)) - 1:
+            best_start, best_count = start, count
+    # Сдвигаем окно, чтобы перед первым совпадением был контекст, не теряя совпадений окна
+    window_hits = [i for i in range(best_start, min(len(words), best_start + max_words)) if hits[i]]
+    if window_hits:
+        first, last = window_hits[0], window_hits[-1]
+        best_start = max(last - max_words + 1, min(first, first - max_words // 3))
+        best_start = max(0, min(best_start, len(words) - max_words))
+    end = min(len(words), best_start + max_words)
+
+    parts = ["…"] if best_start > 0 else []
+    pos = words[best_start].start() if best_start > 0 else 0
+    for w, hit in zip(words[best_start:end], hits[best_start:end]):
+        parts.append(html.escape(content[pos:w.start()]))
+        parts.append(f"<mark>{html.escape(w.group())}</mark>" if hit else html.escape(w.group()))
+        pos = w.end()
+    if end < len(words):
+        parts.append(html.escape(content[pos:words[end - 1].end()]) + "…")
+    else:
+        parts.append(html.escape(content[pos:]))
+    return "".join(parts)
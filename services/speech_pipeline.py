@@ -0,0 +1,98 @@
+# services/speech_pipeline.py
+import asyncio
+from typing import TYPE_CHECKING, Optional
+
+from services.audio_encoding import DEFAULT_FORMAT
+from services.local_tts_service import LocalTextToVoiceService, SentenceChunker
+from services.tts_cache import TTSAudioCache
+from services.tts_batcher import TTSBatchScheduler
+
+if TYPE_CHECKING:
+    from services.broadcaster import Broadcaster
+
+# Параметры голоса по умолчанию (совпадают с TTSRequest)
+DEFAULT_VOICE_PARAMS = {
+    "speaker": "aidar",
+    "speed": 1.0,
+    "pitch_semitones": 0.0,
+    "gain_db": 0.0,
+    "reverb_time": 0.0,
+    "reverb_decay": 0.0,
+}
+
+
+class SpeechPipeline:
+    """
+    Озвучка ответа модели параллельно с генерацией ("говорить по мере генерации").
+
+    Токены LLM подаются в feed(); как только набирается законченное предложение,
+    оно ставится в очередь синтеза. Отдельная задача синтезирует предложения
+    по порядку через планировщик пачек TTS, кладет WAV в кэш и публикует событие audio_segment
+    со ссылкой на аудио — клиент проигрывает сегменты, пока модель еще пишет.
+    """
+
+    def __init__(
+        self,
+        chat_id: int,
+        msg_id: int,
+        tts_service: LocalTextToVoiceService,
+        tts_batcher: TTSBatchScheduler,
+        tts_cache: TTSAudioCache,
+        broadcaster: "Broadcaster",
+        voice_params: Optional[dict] = None,
+    ):
+        self.chat_id = chat_id
+        self.msg_id = msg_id
+        self.tts_service = tts_service
+        self.tts_batcher = tts_batcher
+        self.tts_cache = tts_cache
+        self.broadcaster = broadcaster
+        self.voice_params = {**DEFAULT_VOICE_PARAMS, **(voice_params or {})}
+        self._chunker = SentenceChunker()
+        self._sentences: asyncio.Queue[Optional[str]] = asyncio.Queue()
+        self._seq = 0
+        self._worker = asyncio.create_task(self._run())
+
+    def feed(self, token: str) -> None:
+        for sentence in self._chunker.feed(token):
+            self._sentences.put_nowait(sentence)
+
+    async def finish(self) -> None:
+        """Досинтезирует остаток текста и дожидается публикации всех сегментов."""
+        for sentence in self._chunker.flush():
+            self._sentences.put_nowait(sentence)
+        self._sentences.put_nowait(None)
+        await self._worker
+
+    def cancel(self) -> None:
+        self._worker.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            sentence = await self._sentences.get()
+            if sentence is None:
+                return
+            try:
+                await self._synthesize_and_publish(sentence)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Пропущенный сегмент не должен останавливать остальную озвучку
+                print(f"Speech pipeline error (msg {self.msg_id}): {e}")
+
+    async def _synthesize_and_publish(self, sentence: str) -> None:
+        key = self.tts_cache.make_key(
+            text=sentence,
+            silence_before=0.0,
+            silence_after=0.0,
+            stream=False,
+            **self.voice_params,
+            **self.tts_service.cache_identity()
+        )
+        if await self.tts_cache.get(key) is None:
+            audio = await self.tts_batcher.synthesize(text=sentence, **self.voice_params)
+            await self.tts_cache.put(key, audio, DEFAULT_FORMAT)
+
+        seq = self._seq
+        self._seq += 1
+        await self.broadcaster.publish_audio(self.chat_id, self.msg_id, seq, f"/tts/audio/{key}")
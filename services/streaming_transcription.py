@@ -0,0 +1,268 @@
+# services/streaming_transcription.py
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from services.transcription_service import (
+    AudioDecodeError,
+    TranscriptionService,
+    WHISPER_SAMPLE_RATE,
+    decode_to_array,
+)
+from services.worker_pool import PoolSaturatedError
+
+# WebM от MediaRecorder: EBML-заголовок (с описанием дорожки), затем кластеры,
+# каждый начинается с ID и размера, первым дочерним элементом идет Timecode
+_EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+_CLUSTER_ID = b"\x1f\x43\xb6\x75"
+_TIMECODE_ID = 0xE7
+_TIMECODE_SCALE_ID = b"\x2a\xd7\xb1"
+_DEFAULT_TIMECODE_SCALE = 1_000_000  # нс на единицу Timecode — миллисекунды
+
+
+def _read_vint(data, pos: int) -> Optional[Tuple[int, int]]:
+    """Целое переменной длины EBML: (значение, длина в байтах) или None, если данных не хватает."""
+    if pos >= len(data):
+        return None
+    first = data[pos]
+    length, mask = 1, 0x80
+    while length <= 8 and not first & mask:
+        length, mask = length + 1, mask >> 1
+    if length > 8 or pos + length > len(data):
+        return None
+    value = first & (mask - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    return value, length
+
+
+def _read_uint(data, pos: int) -> Optional[Tuple[int, int]]:
+    """Элемент-число без ID: (значение, позиция после элемента)."""
+    size = _read_vint(data, pos)
+    if size is None or not 1 <= size[0] <= 8:
+        return None
+    start = pos + size[1]
+    if start + size[0] > len(data):
+        return None
+    return int.from_bytes(data[start:start + size[0]], "big"), start + size[0]
+
+
+def webm_clusters(data, start: int = 0) -> List[Tuple[int, int]]:
+    """
+    Кластеры WebM в data: (смещение, Timecode). Совпадение байтов ID внутри
+    аудиоданных отсекается проверкой, что за ним идет Timecode.
+    """
+    clusters = []
+    pos = data.find(_CLUSTER_ID, start)
+    while pos != -1:
+        size = _read_vint(data, pos + len(_CLUSTER_ID))
+        if size is not None:
+            child = pos + len(_CLUSTER_ID) + size[1]
+            if child < len(data) and data[child] == _TIMECODE_ID:
+                timecode = _read_uint(data, child + 1)
+                if timecode is not None:
+                    clusters.append((pos, timecode[0]))
+        pos = data.find(_CLUSTER_ID, pos + 1)
+    return clusters
+
+
+def _load_vad():
+    """Silero VAD из faster-whisper (импорт при первой сессии, не при старте)."""
+    try:
+        from faster_whisper.vad import VadOptions, get_speech_timestamps
+        return VadOptions, get_speech_timestamps
+    except ImportError:
+        # Без VAD вся запись считается одной фразой
+        return (lambda **kwargs: None,
+                lambda audio, vad_options=None, **kwargs: [{"start": 0, "end": len(audio)}] if len(audio) else [])
+
+
+class StreamingTranscriber:
+    """
+    Инкрементальная транскрипция одной голосовой сессии (WebSocket).
+
+    Клиент присылает куски записи MediaRecorder (WEBM/OGG). Куски контейнера
+    по отдельности не декодируются, поэтому копим байты и периодически
+    декодируем буфер, а распознаем только незафиксированный хвост
+    (скользящее окно):
+      - VAD (Silero VAD из faster-whisper) делит хвост на фразы;
+      - фразы, после которых уже прошла пауза min_silence_ms, распознаются
+        окончательно и отдаются как final, окно сдвигается за них;
+      - незаконченная фраза распознается как partial и может меняться.
+
+    Для WebM байты кластеров, целиком лежащих до зафиксированной позиции,
+    отбрасываются: декодируется заголовок и кластеры окна, а не вся запись
+    с начала. Сессия ограничена max_session_s секунд и max_bytes байт;
+    после предела (exhausted) новые куски не принимаются — вызывающий
+    должен завершить сессию через finish().
+    """
+
+    def __init__(
+        self,
+        service: TranscriptionService,
+        step_interval: float = 1.0,
+        min_silence_ms: int = 600,
+        max_window_s: float = 20.0,
+        max_session_s: float = 300.0,
+        max_bytes: int = 4 * 1024 * 1024,
+    ):
+        self.service = service
+        self.step_interval = step_interval
+        self.min_silence_samples = int(min_silence_ms * WHISPER_SAMPLE_RATE / 1000)
+        self.max_window_samples = int(max_window_s * WHISPER_SAMPLE_RATE)
+        self.max_session_samples = int(max_session_s * WHISPER_SAMPLE_RATE)
+        self.max_bytes = max_bytes
+        vad_options_cls, self._get_speech_timestamps = _load_vad()
+        self._vad_options = vad_options_cls(min_silence_duration_ms=min_silence_ms)
+
+        self._data = bytearray()
+        self._received = 0
+        # Заголовок WebM (до первого кластера); None — не WebM или заголовок еще не пришел целиком
+        self._header: Optional[bytes] = None
+        self._base_timecode = 0
+        self._trimmed = False
+        self._offset = 0  # с какого сэмпла сессии начинается аудио из _data
+        self._limit_reached = False
+        self._dirty = False
+        self._last_step = 0.0
+        self._committed = 0  # сэмплы до этой позиции уже распознаны окончательно
+        self._finals: List[str] = []
+        self._partial = ""
+
+    @property
+    def text(self) -> str:
+        return " ".join(t for t in self._finals if t).strip()
+
+    @property
+    def exhausted(self) -> bool:
+        """Достигнут предел длины или размера записи."""
+        return self._limit_reached or self._received > self.max_bytes
+
+    def feed(self, chunk: bytes) -> None:
+        self._received += len(chunk)
+        if self.exhausted:
+            return
+        self._data.extend(chunk)
+        self._dirty = True
+
+    def step_due(self) -> bool:
+        return self._dirty and time.monotonic() - self._last_step >= self.step_interval
+
+    async def step(self) -> List[dict]:
+        """Обрабатывает накопленное аудио и возвращает события для клиента."""
+        self._dirty = False
+        self._last_step = time.monotonic()
+        try:
+            return await self.service.run(self._step_sync, False)
+        except PoolSaturatedError:
+            # Промежуточные результаты необязательны: при перегрузке пропускаем шаг
+            self._dirty = True
+            return []
+
+    async def finish(self) -> List[dict]:
+        """Конец речи: все, что осталось в окне, распознается окончательно."""
+        events = await self.service.run(self._step_sync, True)
+        events.append({"type": "done", "text": self.text})
+        return events
+
+    def _step_sync(self, model, cancel_event: threading.Event, final: bool) -> List[dict]:
+        audio = self._decode()
+        if audio is None:
+            return []
+        if self._offset + len(audio) >= self.max_session_samples:
+            audio = audio[:self.max_session_samples - self._offset]
+            self._limit_reached = True
+
+        events: List[dict] = []
+        tail = audio[self._committed - self._offset:]
+        if final:
+            commit_end = len(tail)
+        else:
+            commit_end = self._closed_speech_end(tail)
+
+        if commit_end > 0:
+            text = self._transcribe(model, cancel_event, tail[:commit_end])
+            self._committed += commit_end
+            tail = tail[commit_end:]
+            if text:
+                self._finals.append(text)
+                events.append({"type": "final", "text": text})
+            if self._partial:
+                self._partial = ""
+            self._trim()
+
+        if not final and len(tail) and self._get_speech_timestamps(tail, self._vad_options):
+            partial = self._transcribe(model, cancel_event, tail)
+            if partial != self._partial:
+                self._partial = partial
+                events.append({"type": "partial", "text": partial})
+        return events
+
+    def _closed_speech_end(self, tail: np.ndarray) -> int:
+        """
+        Конец последней фразы, после которой уже тишина не короче min_silence.
+        Если речи нет — окно сдвигается по тишине; если фраза слишком длинная —
+        фиксируется целиком по размеру окна.
+        """
+        speech = self._get_speech_timestamps(tail, self._vad_options)
+        if not speech:
+            return max(0, len(tail) - self.min_silence_samples)
+        closed = [s for s in speech if s["end"] + self.min_silence_samples <= len(tail)]
+        if closed:
+            return closed[-1]["end"]
+        if len(tail) > self.max_window_samples:
+            return self.max_window_samples
+        return 0
+
+    def _decode(self) -> Optional[np.ndarray]:
+        data = bytes(self._data)
+        if self._trimmed:
+            data = self._header + data
+        try:
+            return decode_to_array(data)
+        except AudioDecodeError:
+            # Последний кусок контейнера может быть недописан — ждем следующих
+            return None
+
+    def _trim(self) -> None:
+        """
+        Отбрасывает кластеры WebM до последнего, начавшегося не позже
+        зафиксированной позиции: дальше декодируется заголовок + остаток.
+        Другие контейнеры не режутся (их предел — max_bytes).
+        """
+        if self._header is None:
+            if not self._data.startswith(_EBML_MAGIC):
+                return
+            clusters = webm_clusters(self._data)
+            if not clusters:
+                return
+            first, self._base_timecode = clusters[0]
+            header = bytes(self._data[:first])
+            scale = header.find(_TIMECODE_SCALE_ID)
+            if scale != -1:
+                value = _read_uint(header, scale + len(_TIMECODE_SCALE_ID))
+                if value is None or value[0] != _DEFAULT_TIMECODE_SCALE:
+                    return
+            self._header = header
+
+        # Timecode кластеров отсчитывается от первого кластера записи
+        committed_ms = self._committed * 1000 // WHISPER_SAMPLE_RATE + self._base_timecode
+        cut = None
+        for pos, timecode in webm_clusters(self._data, 0 if self._trimmed else len(self._header)):
+            if timecode > committed_ms:
+                break
+            cut = (pos, (timecode - self._base_timecode) * WHISPER_SAMPLE_RATE // 1000)
+        # Кластер, с которого окно уже начинается, резать незачем
+        if cut is None or cut[1] <= self._offset:
+            return
+        # feed только дописывает в конец, поэтому найденные смещения остаются верными
+        del self._data[:cut[0]]
+        self._trimmed = True
+        self._offset = cut[1]
+
+    def _transcribe(self, model, cancel_event: threading.Event, audio: np.ndarray) -> str:
+        if not len(audio):
+            return ""
+        return self.service.transcribe_array(model, audio, cancel_event)
@@ -1,48 +1,73 @@
-import os
 import io
 import asyncio
-import tempfile
-from typing import Optional
+import queue
+import threading
+from typing import TYPE_CHECKING, Any, Callable, List, Optional
 
+import numpy as np
 from fastapi import HTTPException, UploadFile
 
-# Предполагается, что эти библиотеки установлены: pip install pydub faster-whisper
-try:
-    from pydub import AudioSegment
-    from pydub.exceptions import CouldntDecodeError
+import settings
+from services.model_registry import ModelNotReadyError
+from services.worker_pool import BoundedWorkerPool, PoolSaturatedError
+
+# faster-whisper (pip install faster-whisper, вместе с ним ставится PyAV)
+# импортируется лениво — при загрузке модели и первом декодировании,
+# чтобы импорт модуля не тянул CTranslate2 и FFmpeg при старте приложения.
+if TYPE_CHECKING:
     from faster_whisper import WhisperModel
-except ImportError:
-    # Заглушки, если библиотеки не установлены
-    class AudioSegment:
-        @staticmethod
-        def from_file(file): raise NotImplementedError("pydub not installed")
 
+WHISPER_SAMPLE_RATE = 16000  # Whisper ожидает 16 кГц моно
 
-    class CouldntDecodeError(Exception):
-        pass
 
+class TranscriptionCancelled(Exception):
+    """Распознавание прервано: клиент ушел или истек таймаут."""
 
-    class WhisperModel:
-        def __init__(self, *args, **kwargs): pass
 
-        def transcribe(self, path, language): return [
-            type('Segment', (object,), {'text': 'Модель Whisper не загружена.'})], None
+class AudioDecodeError(Exception):
+    """Аудио не декодируется (битый или недописанный контейнер)."""
 
-# ---------------------------------------------------------------------
-# ИНИЦИАЛИЗАЦИЯ WHISPER
-# ---------------------------------------------------------------------
 
-WHISPER_MODEL_SIZE = "small"  # Используем небольшую модель для CPU
-whisper_model: Optional[WhisperModel] = None
+def load_whisper_replicas(
+    model_size: str = settings.WHISPER_MODEL_SIZE,
+    replicas: int = settings.STT_REPLICAS,
+    cpu_threads: int = settings.STT_CPU_THREADS,
+    num_workers: int = settings.STT_NUM_WORKERS,
+) -> List["WhisperModel"]:
+    """
+    Загружает replicas экземпляров модели. У каждого свои cpu_threads потоков
+    CTranslate2 и num_workers параллельных распознаваний.
+    """
+    models: List["WhisperModel"] = []
+    for _ in range(max(1, replicas)):
+        try:
+            from faster_whisper import WhisperModel
 
-try:
-    # Загружаем модель Whisper при старте модуля
-    # Внимание: для реального DI лучше загружать модель внутри контейнера
-    whisper_model = WhisperModel(WHISPER_MODEL_SIZE, device="cpu", compute_type="int8")
-    print(f"✅ STT Модель {WHISPER_MODEL_SIZE} загружена на CPU.")
-except Exception as e:
-    print(f"❌ Ошибка загрузки Whisper: {e}")
-    # Если загрузка не удалась, модель остается None
+            models.append(WhisperModel(
+                model_size, device="cpu", compute_type="int8",
+                cpu_threads=cpu_threads, num_workers=num_workers,
+            ))
+        except Exception as e:
+            print(f"❌ Ошибка загрузки Whisper: {e}")
+            break
+    if models:
+        print(f"✅ STT Модель {model_size} загружена на CPU: {len(models)} экз. "
+              f"x {num_workers} воркер(ов), cpu_threads={cpu_threads}.")
+    return models
+
+
+def decode_to_array(audio_bytes: bytes) -> np.ndarray:
+    """
+    Декодирует WEBM/OGG/любой формат FFmpeg прямо из памяти
+    в моно float32 16 кГц — без временных файлов.
+    """
+    from av.error import FFmpegError
+    from faster_whisper.audio import decode_audio
+
+    try:
+        return decode_audio(io.BytesIO(audio_bytes), sampling_rate=WHISPER_SAMPLE_RATE)
+    except FFmpegError as e:
+        raise AudioDecodeError(str(e)) from e
 
 
 # ---------------------------------------------------------------------
@@ -52,48 +77,130 @@ except Exception as e:
 class TranscriptionService:
     """
     Сервис для транскрипции аудио с использованием faster-whisper.
-    Обрабатывает загрузку, конвертацию pydub и транскрипцию.
-    """
-
-    def __init__(self, model: Optional[WhisperModel] = whisper_model):
-        self.model = model
 
-    async def transcribe_audio(self, audio_file: UploadFile) -> str:
-        if not self.model:
-            raise HTTPException(status_code=503, detail="Whisper model not loaded or failed to initialize.")
+    Инференс идет только через выделенный пул STT (BoundedWorkerPool):
+    число одновременных распознаваний равно replicas * num_workers, лишние
+    запросы ждут в ограниченной очереди, а при ее переполнении отклоняются.
+    Каждая задача берет свободный экземпляр модели из очереди реплик.
+    Отмена (уход клиента, таймаут) снимает задачу с очереди, а начатое
+    распознавание прерывается между сегментами.
+    """
 
-        # Шаг 1: Чтение и сохранение аудио во временный файл
-        # Используем tempfile для безопасного создания и управления временными файлами
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio_file:
-            temp_path = temp_audio_file.name
+    def __init__(
+        self,
+        stt_pool: BoundedWorkerPool,
+        models: Optional[List["WhisperModel"]] = None,
+        num_workers: int = settings.STT_NUM_WORKERS,
+    ):
+        self.pool = stt_pool
+        self.num_workers = max(1, num_workers)
+        self.models: List["WhisperModel"] = []
+        # Один экземпляр обслуживает num_workers распознаваний одновременно
+        self._replicas: "queue.Queue[WhisperModel]" = queue.Queue()
+        # Модели грузятся не в конструкторе, а через load() (в фоне после старта)
+        self._load_lock = threading.Lock()
+        self._load_attempted = False
+        if models is not None:
+            self._set_models(models)
+
+    def load(self) -> None:
+        """Загружает экземпляры модели (один раз). Бросает исключение, если не удалось."""
+        with self._load_lock:
+            if not self._load_attempted:
+                self._set_models(load_whisper_replicas(num_workers=self.num_workers))
+        if not self.models:
+            raise RuntimeError("Whisper model not loaded or failed to initialize.")
+
+    def _set_models(self, models: List["WhisperModel"]) -> None:
+        self.models = list(models)
+        for model in self.models:
+            for _ in range(self.num_workers):
+                self._replicas.put(model)
+        self._load_attempted = True
+
+    @property
+    def model(self) -> Optional["WhisperModel"]:
+        return self.models[0] if self.models else None
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.models)
+
+    def ensure_ready(self) -> None:
+        if not self.models:
+            if not self._load_attempted:
+                raise ModelNotReadyError("stt")
+            raise RuntimeError("Whisper model not loaded or failed to initialize.")
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Выполняет fn(model, cancel_event, *args) в пуле STT на свободном экземпляре модели.
+        Бросает ModelNotReadyError, PoolSaturatedError, asyncio.TimeoutError или CancelledError.
+        """
+        self.ensure_ready()
+        cancel_event = threading.Event()
+
+        def job():
+            model = self._replicas.get()
+            try:
+                return fn(model, cancel_event, *args)
+            finally:
+                self._replicas.put(model)
 
         try:
-            # Чтение загруженного файла
-            audio_bytes = await audio_file.read()
+            return await self.pool.submit(job)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Поток не прервать извне — просим его остановиться на следующем сегменте
+            cancel_event.set()
+            raise
 
-            # Pydub для конвертации (MediaRecorder может отдавать WEBM или OGG)
-            # и сохранения в WAV, который предпочитает Whisper
-            audio_segment = AudioSegment.from_file(io.BytesIO(audio_bytes))
-
-            # Конвертируем в WAV и сохраняем на диск
-            # Используем asyncio.to_thread для блокирующей операции ввода/вывода
-            await asyncio.to_thread(audio_segment.export, temp_path, format="wav")
+    async def transcribe_audio(self, audio_file: UploadFile) -> str:
+        try:
+            self.ensure_ready()
+        except ModelNotReadyError as e:
+            raise HTTPException(status_code=503, detail="Модель распознавания еще загружается.",
+                                headers={"Retry-After": str(e.retry_after)})
+        except RuntimeError as e:
+            raise HTTPException(status_code=503, detail=str(e))
 
-            # Шаг 2: Транскрипция с faster-whisper
-            # Также используем asyncio.to_thread, так как это блокирующая операция
-            segments, _ = await asyncio.to_thread(self.model.transcribe, temp_path, language="ru")
-            user_prompt = "".join([segment.text for segment in segments]).strip()
+        # Чтение загруженного файла
+        audio_bytes = await audio_file.read()
 
+        try:
+            # Декодирование и распознавание — одна задача пула
+            user_prompt = await self.run(self._decode_and_transcribe, audio_bytes)
             print(f"🎤 Транскрипция: {user_prompt}")
             return user_prompt
 
-        except CouldntDecodeError:
+        except AudioDecodeError:
             raise HTTPException(status_code=400,
-                                detail="Невозможно декодировать аудиофайл. Проверьте установку FFmpeg.")
+                                detail="Невозможно декодировать аудиофайл.")
+        except PoolSaturatedError as e:
+            raise HTTPException(status_code=429,
+                                detail="Сервис распознавания перегружен, попробуйте позже.",
+                                headers={"Retry-After": str(e.retry_after)})
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Превышено время ожидания распознавания.")
         except Exception as e:
             # Общая ошибка при обработке или транскрипции
             raise HTTPException(status_code=500, detail=f"Ошибка транскрипции на сервере: {e}")
-        finally:
-            # Шаг 3: Удаление временного файла
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
\ No newline at end of file
+
+    def _decode_and_transcribe(self, model: "WhisperModel", cancel_event: threading.Event, audio_bytes: bytes) -> str:
+        audio = decode_to_array(audio_bytes)
+        return self.transcribe_array(model, audio, cancel_event)
+
+    @staticmethod
+    def transcribe_array(model: "WhisperModel", audio: np.ndarray,
+                         cancel_event: Optional[threading.Event] = None) -> str:
+        """
+        Синхронная транскрипция массива 16 кГц (вызывается в потоке пула).
+        transcribe() возвращает ленивый генератор сегментов — распознавание
+        происходит при его обходе, поэтому между сегментами можно проверить отмену.
+        """
+        segments, _ = model.transcribe(audio, language="ru")
+        parts = []
+        for segment in segments:
+            if cancel_event is not None and cancel_event.is_set():
+                raise TranscriptionCancelled()
+            parts.append(segment.text)
+        return "".join(parts).strip()
@@ -0,0 +1,103 @@
+# services/tts_batcher.py
+import asyncio
+from typing import List, Optional, Tuple
+
+from services.local_tts_service import LocalTextToVoiceService
+from services.worker_pool import BoundedWorkerPool
+
+
+class TTSBatchScheduler:
+    """
+    Микробатчинг запросов TTS.
+
+    Запросы копятся window_ms миллисекунд (или пока не наберется max_batch),
+    затем вся пачка уходит в пул одной задачей synthesize_batch: модель
+    прогоняет тексты вместе, пост-обработка выполняется для каждого запроса
+    отдельно, и каждый вызывающий получает свой результат через future.
+    window_ms = 0 отключает батчинг — каждый запрос идет в пул сам по себе.
+    Так же, без окна ожидания, идут запросы, если модель не принимает список
+    текстов (supports_batch): пачка тогда синтезировалась бы последовательно
+    в одном потоке пула — ожидание окна и очередь внутри пачки без выигрыша,
+    а отдельные задачи пула выполняются параллельно.
+    """
+
+    def __init__(
+        self,
+        tts_service: LocalTextToVoiceService,
+        tts_pool: BoundedWorkerPool,
+        window_ms: float = 10.0,
+        max_batch: int = 8,
+    ):
+        self.tts_service = tts_service
+        self.tts_pool = tts_pool
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+        self._direct = 0
+        self._batches = 0
+        self._batched_requests = 0
+        self._max_seen_batch = 0
+
+    async def synthesize(self, **params) -> bytes:
+        """То же, что synthesize_to_bytes, но с объединением в пачки."""
+        if self.window == 0 or self.max_batch == 1 or not self.tts_service.supports_batch:
+            self._direct += 1
+            return await self.tts_pool.submit(self.tts_service.synthesize_to_bytes, **params)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((params, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            # Запросы, чьи клиенты уже ушли, не синтезируем
+            batch = [(params, fut) for params, fut in batch if not fut.done()]
+            if batch:
+                task = asyncio.create_task(self._run_batch(batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[dict, asyncio.Future]]) -> None:
+        self._batches += 1
+        self._batched_requests += len(batch)
+        self._max_seen_batch = max(self._max_seen_batch, len(batch))
+        try:
+            results = await self.tts_pool.submit(
+                self.tts_service.synthesize_batch,
+                [params for params, _ in batch]
+            )
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), result in zip(batch, results):
+            if fut.done():
+                continue
+            if isinstance(result, Exception):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "direct": self._direct,
+            "batches": self._batches,
+            "avg_batch_size": round(self._batched_requests / self._batches, 2) if self._batches else 0.0,
+            "max_seen_batch": self._max_seen_batch,
+            "model_batch_api": self.tts_service.supports_batch,
+        }
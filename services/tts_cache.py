@@ -0,0 +1,245 @@
+# services/tts_cache.py
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from services.audio_encoding import OUTPUT_FORMATS
+
+
+class CachedAudio(NamedTuple):
+    """Аудио из кэша и его формат (ключ OUTPUT_FORMATS)."""
+    data: bytes
+    format: str
+
+    @property
+    def media_type(self) -> str:
+        return OUTPUT_FORMATS[self.format].media_type
+
+
+class TTSAudioCache:
+    """
+    Кэш готового аудио TTS с адресацией по содержимому запроса.
+
+    Ключ — sha256 от всех параметров, влияющих на результат синтеза
+    (текст, голос, эффекты, модель, частота дискретизации).
+    Два уровня:
+      - память: LRU, ограниченный суммарным размером в байтах;
+      - диск (опционально): файлы в disk_dir, ограничены max_disk_bytes,
+        вытесняются самые давно использованные.
+    Вместе с аудио хранится его формат (на диске — расширение файла),
+    чтобы отдавать запись по одному ключу с верным Content-Type.
+    """
+
+    def __init__(self,
+                 max_memory_bytes: int = 64 * 1024 * 1024,
+                 disk_dir: Optional[str] = None,
+                 max_disk_bytes: int = 512 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir or None
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, CachedAudio]" = OrderedDict()
+        self._memory_bytes = 0
+        # Индекс дискового уровня: ключ -> (размер, формат), порядок = порядок использования
+        self._disk: "OrderedDict[str, tuple]" = OrderedDict()
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    # -----------------------
+    # Ключи
+    # -----------------------
+    @staticmethod
+    def make_key(
+        text: str,
+        speaker: str,
+        speed: float,
+        pitch_semitones: float,
+        gain_db: float,
+        reverb_time: float,
+        reverb_decay: float,
+        silence_before: float,
+        silence_after: float,
+        model_id: str,
+        sample_rate: int,
+        **extra
+    ) -> str:
+        """
+        Детерминированный ключ кэша. В extra передаются параметры,
+        меняющие представление результата (например, потоковый режим).
+        """
+        payload = {
+            "text": text,
+            "speaker": speaker,
+            "speed": round(float(speed), 4),
+            "pitch_semitones": round(float(pitch_semitones), 4),
+            "gain_db": round(float(gain_db), 4),
+            "reverb_time": round(float(reverb_time), 4),
+            "reverb_decay": round(float(reverb_decay), 4),
+            "silence_before": round(float(silence_before), 4),
+            "silence_after": round(float(silence_after), 4),
+            "model_id": model_id,
+            "sample_rate": int(sample_rate),
+            **extra,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # -----------------------
+    # Чтение / запись
+    # -----------------------
+    async def get(self, key: str) -> Optional[CachedAudio]:
+        entry = self._get_memory(key)
+        if entry is not None:
+            return entry
+        if self.disk_dir and key in self._disk:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._put_memory(key, entry)
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def put(self, key: str, data: bytes, output_format: str) -> None:
+        entry = CachedAudio(data, output_format)
+        self._put_memory(key, entry)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, entry)
+
+    def _get_memory(self, key: str) -> Optional[CachedAudio]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return entry
+
+    def _put_memory(self, key: str, entry: CachedAudio) -> None:
+        if len(entry.data) > self.max_memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old.data)
+            self._memory[key] = entry
+            self._memory_bytes += len(entry.data)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted.data)
+
+    # -----------------------
+    # Дисковый уровень
+    # -----------------------
+    def _path(self, key: str, output_format: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.{output_format}")
+
+    def _load_disk_index(self) -> None:
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                key, _, output_format = name.rpartition(".")
+                path = os.path.join(root, name)
+                if output_format not in OUTPUT_FORMATS:
+                    # Старые записи без формата (.bin) и недописанные .tmp: отдать их с верным типом нельзя
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                st = os.stat(path)
+                entries.append((st.st_mtime, key, st.st_size, output_format))
+        for _, key, size, output_format in sorted(entries):
+            old = self._disk.pop(key, None)
+            if old is not None:
+                # Тот же ключ в другом формате: остается более новый файл
+                self._disk_bytes -= old[0]
+                self._remove_file(key, old[1])
+            self._disk[key] = (size, output_format)
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _read_disk(self, key: str) -> Optional[CachedAudio]:
+        with self._lock:
+            indexed = self._disk.get(key)
+        if indexed is None:
+            return None
+        path = self._path(key, indexed[1])
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                size, _ = self._disk.pop(key, (0, None))
+                self._disk_bytes -= size
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        return CachedAudio(data, indexed[1])
+
+    def _write_disk(self, key: str, entry: CachedAudio) -> None:
+        if len(entry.data) > self.max_disk_bytes:
+            return
+        path = self._path(key, entry.format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp{threading.get_ident()}"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(entry.data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"TTS cache disk write error: {e}")
+            return
+        with self._lock:
+            old = self._disk.pop(key, None)
+            if old is not None:
+                self._disk_bytes -= old[0]
+            self._disk[key] = (len(entry.data), entry.format)
+            self._disk_bytes += len(entry.data)
+        if old is not None and old[1] != entry.format:
+            self._remove_file(key, old[1])
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        while True:
+            with self._lock:
+                if self._disk_bytes <= self.max_disk_bytes or not self._disk:
+                    return
+                key, (size, output_format) = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+            self._remove_file(key, output_format)
+
+    def _remove_file(self, key: str, output_format: str) -> None:
+        try:
+            os.remove(self._path(key, output_format))
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_items": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,151 @@
+# services/worker_pool.py
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class PoolSaturatedError(Exception):
+    """
+    Пул перегружен: все воркеры заняты и очередь ожидания заполнена.
+    retry_after — оценка (в секундах), через сколько стоит повторить запрос.
+    """
+
+    def __init__(self, pool_name: str, retry_after: int):
+        super().__init__(f"Пул '{pool_name}' перегружен, повторите через {retry_after} с.")
+        self.retry_after = retry_after
+
+
+class BoundedWorkerPool:
+    """
+    Пул потоков для тяжелых блокирующих задач (синтез речи, инференс моделей).
+
+    - задачи выполняются вне event loop, поэтому SSE-стримы не замирают;
+    - число одновременно принятых задач ограничено (max_workers + max_queue),
+      лишние сразу отклоняются с PoolSaturatedError (backpressure);
+    - у каждой задачи есть таймаут ожидания результата;
+    - собирается статистика: глубина очереди, время ожидания и выполнения.
+    """
+
+    def __init__(self, name: str, max_workers: int = 2, max_queue: int = 8, timeout: Optional[float] = 60.0):
+        if max_workers < 1:
+            raise ValueError("max_workers должен быть >= 1")
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+
+        # Принятые задачи (в очереди + выполняются)
+        self._admitted = 0
+        self._running = 0
+
+        # Счетчики для метрик
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._cancelled = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._max_run = 0.0
+        self._last_run = 0.0
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue
+
+    async def submit(self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> Any:
+        """
+        Выполняет fn(*args, **kwargs) в пуле и возвращает результат.
+        Бросает PoolSaturatedError при переполнении и asyncio.TimeoutError по таймауту.
+        """
+        with self._lock:
+            if self._admitted >= self.capacity:
+                self._rejected += 1
+                raise PoolSaturatedError(self.name, self._estimate_retry_after_locked())
+            self._admitted += 1
+            self._submitted += 1
+
+        enqueued_at = time.perf_counter()
+
+        def job():
+            started_at = time.perf_counter()
+            with self._lock:
+                self._running += 1
+                self._total_wait += started_at - enqueued_at
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                elapsed = time.perf_counter() - started_at
+                with self._lock:
+                    self._running -= 1
+                    self._total_run += elapsed
+                    self._last_run = elapsed
+                    self._max_run = max(self._max_run, elapsed)
+                    if ok:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+
+        cf = self._executor.submit(job)
+        # Место в пуле освобождается, только когда задача реально завершилась
+        # (или была снята с очереди), а не когда вызывающий перестал ждать.
+        cf.add_done_callback(self._release)
+
+        effective_timeout = self.timeout if timeout is None else timeout
+        try:
+            # Отмена asyncio-future (по таймауту или отключению клиента)
+            # снимает задачу с очереди, если она еще не начала выполняться.
+            return await asyncio.wait_for(asyncio.wrap_future(cf), effective_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise
+        except asyncio.CancelledError:
+            with self._lock:
+                self._cancelled += 1
+            raise
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._admitted -= 1
+
+    def _estimate_retry_after_locked(self) -> int:
+        completed = self._completed + self._failed
+        avg_run = (self._total_run / completed) if completed else 1.0
+        queued = max(0, self._admitted - self._running)
+        return max(1, math.ceil(avg_run * (queued + 1) / self.max_workers))
+
+    def stats(self) -> dict:
+        """Снимок метрик пула."""
+        with self._lock:
+            finished = self._completed + self._failed
+            started = finished + self._running
+            return {
+                "name": self.name,
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queue_depth": max(0, self._admitted - self._running),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "cancelled": self._cancelled,
+                "avg_queue_wait_ms": round(1000 * self._total_wait / started, 2) if started else 0.0,
+                "avg_run_ms": round(1000 * self._total_run / finished, 2) if finished else 0.0,
+                "max_run_ms": round(1000 * self._max_run, 2),
+                "last_run_ms": round(1000 * self._last_run, 2),
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
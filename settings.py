@@ -0,0 +1,130 @@
+# settings.py
+import os
+
+# Параметры, которые удобно менять без правки кода (через переменные окружения).
+
+# --- База данных ---
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./chat_app.db")
+# PRAGMA для каждого нового соединения SQLite.
+# WAL: читатели не блокируют писателя, писатели стриминговых чатов не ждут друг друга так долго
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+# NORMAL в режиме WAL не теряет целостность, но не делает fsync на каждый коммит
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+# Кэш страниц на соединение (КиБ) и размер отображения файла в память (байт, 0 — выключено)
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Сколько ждать освобождения блокировки записи, прежде чем вернуть "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Групповая запись сообщений: окно сбора группы (мс) и максимум вставок в группе
+DB_WRITE_BATCH_MS = float(os.getenv("DB_WRITE_BATCH_MS", "5"))
+DB_WRITE_MAX_BATCH = int(os.getenv("DB_WRITE_MAX_BATCH", "256"))
+# Итоговый текст ответа пишется в фоне (не задерживает ответ); при остановке очередь дописывается
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "1") == "1"
+# Сколько раз повторять фоновое обновление текста, которое не записалось, прежде чем отбросить
+DB_WRITE_UPDATE_RETRIES = int(os.getenv("DB_WRITE_UPDATE_RETRIES", "3"))
+
+# Контрольные точки стримящегося ответа: сохранять текст каждые N токенов или T мс
+STREAM_CHECKPOINT_TOKENS = int(os.getenv("STREAM_CHECKPOINT_TOKENS", "64"))
+STREAM_CHECKPOINT_MS = float(os.getenv("STREAM_CHECKPOINT_MS", "2000"))
+# При старте ответы в статусе streaming без записи дольше этого (с) считаются прерванными.
+# Запас нужен, чтобы не задеть ответы, которые прямо сейчас пишут другие воркеры
+STREAM_RECOVERY_GRACE_S = float(os.getenv("STREAM_RECOVERY_GRACE_S", "120"))
+# Проверка повторяется и после старта: ответы, прерванные перед быстрым перезапуском,
+# становятся "старыми" только когда истечет запас
+STREAM_RECOVERY_INTERVAL_S = float(os.getenv("STREAM_RECOVERY_INTERVAL_S", "60"))
+# Живой ответ (в том числе ждущий в очереди LLM) отмечается в базе не реже, чем раз в столько секунд
+STREAM_HEARTBEAT_S = float(os.getenv("STREAM_HEARTBEAT_S", str(STREAM_RECOVERY_GRACE_S / 4)))
+
+# --- TTS: пул воркеров синтеза ---
+# Количество потоков, в которых одновременно выполняется синтез Silero
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "2"))
+# Сколько задач может ждать свободного воркера, прежде чем мы начнем отвечать 429
+TTS_MAX_QUEUE = int(os.getenv("TTS_MAX_QUEUE", "8"))
+# Максимальное время ожидания результата одной задачи (сек)
+TTS_JOB_TIMEOUT = float(os.getenv("TTS_JOB_TIMEOUT", "60"))
+
+# --- TTS: кэш готового аудио ---
+TTS_CACHE_MAX_MEMORY_MB = int(os.getenv("TTS_CACHE_MAX_MEMORY_MB", "64"))
+# Каталог дискового уровня кэша; пустая строка — только память
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "")
+TTS_CACHE_MAX_DISK_MB = int(os.getenv("TTS_CACHE_MAX_DISK_MB", "512"))
+
+# --- TTS: микробатчинг ---
+# Сколько миллисекунд копить запросы перед общим прогоном модели (0 — без батчинга)
+TTS_BATCH_WINDOW_MS = float(os.getenv("TTS_BATCH_WINDOW_MS", "10"))
+TTS_MAX_BATCH = int(os.getenv("TTS_MAX_BATCH", "8"))
+
+# --- STT: пул инференса Whisper ---
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "small")
+# Сколько независимых экземпляров модели держать в памяти
+STT_REPLICAS = int(os.getenv("STT_REPLICAS", "1"))
+# Потоки CTranslate2 на один экземпляр (0 — по числу ядер; при нескольких
+# экземплярах лучше делить ядра между ними, иначе они мешают друг другу)
+STT_CPU_THREADS = int(os.getenv("STT_CPU_THREADS", "4"))
+# Сколько распознаваний один экземпляр ведет параллельно
+STT_NUM_WORKERS = int(os.getenv("STT_NUM_WORKERS", "1"))
+STT_MAX_QUEUE = int(os.getenv("STT_MAX_QUEUE", "4"))
+STT_JOB_TIMEOUT = float(os.getenv("STT_JOB_TIMEOUT", "120"))
+# Потоковое распознавание (WebSocket): предел длины записи (с) и принятых байт на сессию
+STT_STREAM_MAX_SESSION_S = float(os.getenv("STT_STREAM_MAX_SESSION_S", "300"))
+STT_STREAM_MAX_BYTES = int(os.getenv("STT_STREAM_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# --- LLM: контекст диалога ---
+# Сколько токенов истории (вместе с краткой сводкой) отправлять модели
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "3072"))
+# Запас под ответ модели внутри окна контекста
+LLM_REPLY_RESERVE_TOKENS = int(os.getenv("LLM_REPLY_RESERVE_TOKENS", "512"))
+# Максимальная длина сводки старых реплик
+LLM_SUMMARY_TOKENS = int(os.getenv("LLM_SUMMARY_TOKENS", "384"))
+# Для скольких чатов держать собранный контекст в памяти
+LLM_CONTEXT_CACHE_CHATS = int(os.getenv("LLM_CONTEXT_CACHE_CHATS", "256"))
+
+# --- LLM: доступ к Ollama ---
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+LLM_MODEL = os.getenv("LLM_MODEL", "saiga_llama3_8b:latest")
+# Сколько генераций одной модели может идти одновременно (остальные — в очереди)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+# Закрытие страницы чата останавливает генерацию, только если за столько секунд
+# на чат никто не подписался снова (перезагрузка, resync, другая вкладка)
+LLM_CANCEL_GRACE_S = float(os.getenv("LLM_CANCEL_GRACE_S", "3"))
+
+# --- История чата ---
+# Сообщений на страницу: столько рендерится при открытии чата и подгружается при прокрутке вверх
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+# Верхняя граница limit в API истории
+CHAT_PAGE_MAX = int(os.getenv("CHAT_PAGE_MAX", "200"))
+
+# --- Поиск по сообщениям ---
+# Результатов на страницу и верхняя граница limit
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+SEARCH_PAGE_MAX = int(os.getenv("SEARCH_PAGE_MAX", "100"))
+# Длина фрагмента с подсветкой (слов)
+SEARCH_SNIPPET_WORDS = int(os.getenv("SEARCH_SNIPPET_WORDS", "12"))
+
+# --- SSE: рассылка событий чата ---
+# Окно объединения токенов в одно событие stream_token (мс, 0 — каждый токен отдельно)
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "40"))
+# Сбросить буфер раньше окна, если накопилось столько символов
+SSE_COALESCE_MAX_CHARS = int(os.getenv("SSE_COALESCE_MAX_CHARS", "512"))
+# Лимиты очереди одного подписчика: событий и байт (память на соединение)
+SSE_QUEUE_MAX_EVENTS = int(os.getenv("SSE_QUEUE_MAX_EVENTS", "1000"))
+SSE_QUEUE_MAX_BYTES = int(os.getenv("SSE_QUEUE_MAX_BYTES", str(1024 * 1024)))
+# Что делать при переполнении: drop_oldest | resync | disconnect
+SSE_SLOW_CONSUMER_POLICY = os.getenv("SSE_SLOW_CONSUMER_POLICY", "resync")
+# Буфер повтора для переподключений (Last-Event-ID): событий на чат и сколько чатов хранить
+SSE_REPLAY_EVENTS = int(os.getenv("SSE_REPLAY_EVENTS", "512"))
+SSE_REPLAY_CHATS = int(os.getenv("SSE_REPLAY_CHATS", "1024"))
+# Доставка событий между воркерами: memory (один процесс) | redis (нужен пакет redis)
+SSE_PUBSUB_BACKEND = os.getenv("SSE_PUBSUB_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SSE_PUBSUB_CHANNEL = os.getenv("SSE_PUBSUB_CHANNEL", "voice-chat:events")
+
+# --- Кэш истории чатов (в памяти процесса) ---
+# Сколько чатов держать (0 — выключен). Кэш не видит записей других воркеров,
+# поэтому при доставке событий через Redis по умолчанию выключен
+HISTORY_CACHE_CHATS = int(os.getenv("HISTORY_CACHE_CHATS", "512" if SSE_PUBSUB_BACKEND == "memory" else "0"))
+# Сколько пользователей держать со списком чатов
+HISTORY_CACHE_USERS = int(os.getenv("HISTORY_CACHE_USERS", "1024" if SSE_PUBSUB_BACKEND == "memory" else "0"))
+# Сообщений в окне одного чата (не меньше CHAT_PAGE_SIZE, иначе открытие чата всегда промахивается)
+HISTORY_CACHE_WINDOW = int(os.getenv("HISTORY_CACHE_WINDOW", str(CHAT_PAGE_SIZE)))
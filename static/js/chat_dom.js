@@ -2,7 +2,7 @@ export function scrollToBottom(messageList) {
   if (messageList) messageList.scrollTop = messageList.scrollHeight;
 }
 
-export function addMessageToDOM(messageList, message) {
+export function createMessageElement(message) {
   const time = new Date(message.created_at).toLocaleString();
   const messageDiv = document.createElement("div");
   const typeClass = message.message_type.toLowerCase();
@@ -25,16 +25,49 @@ export function addMessageToDOM(messageList, message) {
 
   messageDiv.appendChild(meta);
   messageDiv.appendChild(body);
+  return messageDiv;
+}
 
-  if (messageList) {
-    messageList.appendChild(messageDiv);
-    scrollToBottom(messageList);
+export function addMessageToDOM(messageList, message) {
+  if (!messageList) return;
+  // Повтор события после переподключения не должен дублировать сообщение
+  if (messageList.querySelector(`.message[data-id='${message.id}']`)) return;
+  messageList.appendChild(createMessageElement(message));
+  scrollToBottom(messageList);
+}
+
+// Более старые сообщения — в начало списка, не сдвигая то, что пользователь видит сейчас
+export function prependMessages(messageList, messages) {
+  if (!messageList || !messages.length) return;
+  const previousHeight = messageList.scrollHeight;
+  const fragment = document.createDocumentFragment();
+  messages.forEach((message) => fragment.appendChild(createMessageElement(message)));
+  messageList.insertBefore(fragment, messageList.firstChild);
+  messageList.scrollTop += messageList.scrollHeight - previousHeight;
+}
+
+// Позиция ответа в очереди генерации (0 — генерация началась)
+export function setMessageQueuePosition(msgId, position) {
+  const messageDiv = document.querySelector(`.message[data-id='${msgId}']`);
+  if (!messageDiv) return;
+  let badge = messageDiv.querySelector('.m-queue');
+  if (position <= 0) {
+    if (badge) badge.remove();
+    return;
+  }
+  if (!badge) {
+    badge = document.createElement("div");
+    badge.className = "m-queue";
+    messageDiv.insertBefore(badge, messageDiv.querySelector('.m-body'));
   }
+  badge.textContent = `В очереди: ${position}`;
 }
 
 export function appendTokenToMessage(messageList, msgId, token) {
   const messageBody = document.querySelector(`.message[data-id='${msgId}'] .m-body`);
   if (messageBody) {
+    const badge = messageBody.parentElement.querySelector('.m-queue');
+    if (badge) badge.remove();
     messageBody.parentElement.classList.remove("streaming");
     messageBody.textContent += token;
     scrollToBottom(messageList);
@@ -0,0 +1,35 @@
+import { prependMessages } from './chat_dom.js';
+
+// Подгрузка более старых сообщений при прокрутке к началу чата (пагинация по курсору)
+export function setupHistoryLoader(messageList, selectedChatId, threshold = 150) {
+  if (!messageList || !selectedChatId) return;
+  let cursor = messageList.dataset.nextCursor || null;
+  let loading = false;
+
+  async function loadOlder() {
+    if (!cursor || loading) return;
+    loading = true;
+    try {
+      const params = new URLSearchParams({ before: cursor });
+      const resp = await fetch(`/api/chats/${selectedChatId}/messages?${params}`);
+      if (!resp.ok) {
+        console.error("Не удалось загрузить историю:", resp.status);
+        return;
+      }
+      const messages = await resp.json();
+      cursor = resp.headers.get("X-Next-Cursor");
+      prependMessages(messageList, messages);
+    } catch (err) {
+      console.error("Ошибка загрузки истории:", err);
+    } finally {
+      loading = false;
+    }
+    // Страница не заполнила экран — сразу берем следующую
+    if (cursor && messageList.scrollHeight <= messageList.clientHeight) loadOlder();
+  }
+
+  messageList.addEventListener("scroll", () => {
+    if (messageList.scrollTop < threshold) loadOlder();
+  });
+  if (messageList.scrollHeight <= messageList.clientHeight) loadOlder();
+}
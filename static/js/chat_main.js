@@ -1,8 +1,9 @@
-import { addMessageToDOM, appendTokenToMessage, scrollToBottom } from './chat_dom.js';
+import { addMessageToDOM, appendTokenToMessage, scrollToBottom, setMessageQueuePosition } from './chat_dom.js';
 import { setupSendForm } from './chat_send.js';
-import { setupSSE } from './chat_sse.js';
+import { setupSSE, reloadingForResync } from './chat_sse.js';
 import { setupVoiceRecorder } from './chat_voice.js';
-import { setupTTS } from './chat_tts.js'; 
+import { setupTTS, createAudioQueue } from './chat_tts.js';
+import { setupHistoryLoader } from './chat_history.js';
 
 document.addEventListener("DOMContentLoaded", () => {
   const ctx = window.__CHAT_CONTEXT || {};
@@ -19,8 +20,19 @@ document.addEventListener("DOMContentLoaded", () => {
   const ttsButton = document.getElementById('tts-button');
 
   scrollToBottom(messageList);
+  setupHistoryLoader(messageList, selectedChatId);
   setupSendForm(sendForm, messageInput, selectedChatId);
-  setupSSE(selectedChatId, messageList, addMessageToDOM, appendTokenToMessage);
-  setupVoiceRecorder(recordButton, voiceIcon, messageInput, loadingIndicator, loadingText, playButton);
+  const audioQueue = createAudioQueue();
+  setupSSE(selectedChatId, messageList, addMessageToDOM, appendTokenToMessage, audioQueue.enqueue, setMessageQueuePosition);
+  setupVoiceRecorder(recordButton, voiceIcon, messageInput, loadingIndicator, loadingText, playButton, selectedChatId);
   setupTTS(ttsButton, messageInput); // <-- вызываем настройку TTS
+
+  // Чат закрыт — незачем дальше генерировать ответ. Перезагрузку по resync и уход
+  // в bfcache не считаем; обычную перезагрузку и другие вкладки отсеивает сервер
+  if (selectedChatId && navigator.sendBeacon) {
+    window.addEventListener('pagehide', (event) => {
+      if (event.persisted || reloadingForResync) return;
+      navigator.sendBeacon(`/chats/${selectedChatId}/cancel`);
+    });
+  }
 });
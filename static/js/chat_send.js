@@ -1,3 +1,5 @@
+import { readVoiceSettings } from './chat_tts.js';
+
 export function setupSendForm(sendForm, messageInput, selectedChatId) {
   if (!sendForm) return;
   sendForm.addEventListener("submit", async (e) => {
@@ -11,7 +13,7 @@ export function setupSendForm(sendForm, messageInput, selectedChatId) {
       const resp = await fetch(`/chats/${selectedChatId}/send`, {
         method: "POST",
         headers: { "Content-Type": "application/x-www-form-urlencoded" },
-        body: new URLSearchParams({ content })
+        body: new URLSearchParams(buildSendPayload(content))
       });
       if (!resp.ok) {
         console.error("Failed to send", await resp.text());
@@ -23,3 +25,10 @@ export function setupSendForm(sendForm, messageInput, selectedChatId) {
     }
   });
 }
+
+// В голосовом режиме ответ модели озвучивается по ходу генерации
+function buildSendPayload(content) {
+  const voiceMode = document.getElementById("voice-mode");
+  if (!voiceMode || !voiceMode.checked) return { content };
+  return { content, voice: "true", ...readVoiceSettings() };
+}
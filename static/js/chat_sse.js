@@ -1,4 +1,7 @@
-export function setupSSE(selectedChatId, messageList, addMessageToDOM, appendTokenToMessage) {
+// true — страница перезагружается по resync: это не закрытие чата, генерацию не останавливаем
+export let reloadingForResync = false;
+
+export function setupSSE(selectedChatId, messageList, addMessageToDOM, appendTokenToMessage, onAudioSegment, onQueuePosition) {
   if (!selectedChatId || typeof EventSource === 'undefined') return;
   const eventSource = new EventSource(`/chats/${selectedChatId}/events`);
   eventSource.addEventListener("new_message", (event) => {
@@ -9,8 +12,23 @@ export function setupSSE(selectedChatId, messageList, addMessageToDOM, appendTok
     const tokenData = JSON.parse(event.data);
     appendTokenToMessage(messageList, tokenData.msg_id, tokenData.token);
   });
+  eventSource.addEventListener("queue_position", (event) => {
+    const data = JSON.parse(event.data);
+    if (onQueuePosition) onQueuePosition(data.msg_id, data.position);
+  });
+  eventSource.addEventListener("audio_segment", (event) => {
+    const segment = JSON.parse(event.data);
+    if (onAudioSegment) onAudioSegment(segment.msg_id, segment.seq, segment.url);
+  });
+  eventSource.addEventListener("resync", () => {
+    // Клиент отстал и пропустил события — перечитываем чат целиком
+    eventSource.close();
+    reloadingForResync = true;
+    window.location.reload();
+  });
   eventSource.onerror = (err) => {
+    // Не закрываем: браузер переподключится сам и пришлет Last-Event-ID,
+    // сервер дошлет только пропущенные события
     console.error("SSE error", err);
-    eventSource.close();
   };
 }
@@ -1,3 +1,118 @@
+// Проигрывает потоковый WAV (PCM16 mono) по мере получения чанков через Web Audio API
+export async function playWavStream(resp) {
+  const AudioCtx = window.AudioContext || window.webkitAudioContext;
+  const ctx = new AudioCtx();
+  const reader = resp.body.getReader();
+  const chunks = [];
+  let header = null;
+  let pending = new Uint8Array(0);
+  let sampleRate = 48000;
+  let nextTime = 0;
+
+  const concat = (a, b) => {
+    const out = new Uint8Array(a.length + b.length);
+    out.set(a, 0);
+    out.set(b, a.length);
+    return out;
+  };
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    chunks.push(value);
+    pending = concat(pending, value);
+
+    if (!header) {
+      if (pending.length < 44) continue;
+      header = pending.slice(0, 44);
+      sampleRate = new DataView(header.buffer).getUint32(24, true);
+      pending = pending.slice(44);
+    }
+
+    // Берем только целые 16-битные сэмплы, остаток ждет следующего чанка
+    const usable = pending.length - (pending.length % 2);
+    if (!usable) continue;
+    const pcm = new Int16Array(pending.slice(0, usable).buffer);
+    pending = pending.slice(usable);
+
+    const buffer = ctx.createBuffer(1, pcm.length, sampleRate);
+    const channel = buffer.getChannelData(0);
+    for (let i = 0; i < pcm.length; i++) channel[i] = pcm[i] / 32768;
+
+    const source = ctx.createBufferSource();
+    source.buffer = buffer;
+    source.connect(ctx.destination);
+    nextTime = Math.max(nextTime, ctx.currentTime);
+    source.start(nextTime);
+    nextTime += buffer.duration;
+  }
+
+  return new Blob(chunks, { type: "audio/wav" });
+}
+
+const MAX_GET_QUERY_LENGTH = 4000;
+
+// Текущие настройки голоса из панели озвучки
+export function readVoiceSettings() {
+  const settings = {
+    speaker: document.getElementById("voice-select")?.value || "aidar",
+    speed: parseFloat(document.getElementById("speed-range")?.value) || 1.0,
+    pitch_semitones: parseFloat(document.getElementById("pitch-range")?.value) || 0,
+    gain_db: parseFloat(document.getElementById("gain-range")?.value) || 0,
+    reverb_time: parseFloat(document.getElementById("reverb-time")?.value) || 0,
+    reverb_decay: parseFloat(document.getElementById("reverb-decay")?.value) || 0
+  };
+
+  // Проверка NaN
+  Object.keys(settings).forEach(key => {
+    if (typeof settings[key] === "number" && isNaN(settings[key])) {
+      settings[key] = 0;
+    }
+  });
+  return settings;
+}
+
+// Очередь аудио-сегментов озвучки ответа: играет их строго по порядку seq,
+// даже если события пришли не по порядку.
+export function createAudioQueue() {
+  const pending = new Map(); // msgId -> Map(seq -> url)
+  const nextSeq = new Map(); // msgId -> следующий ожидаемый seq
+  let playing = false;
+  const order = [];
+
+  const pump = () => {
+    if (playing) return;
+    while (order.length) {
+      const msgId = order[0];
+      const segments = pending.get(msgId);
+      const seq = nextSeq.get(msgId) || 0;
+      if (!segments || !segments.has(seq)) return;
+      const url = segments.get(seq);
+      segments.delete(seq);
+      nextSeq.set(msgId, seq + 1);
+
+      playing = true;
+      const audio = new Audio(url);
+      const done = () => { playing = false; pump(); };
+      audio.onended = done;
+      audio.onerror = done;
+      audio.play().catch(done);
+      return;
+    }
+  };
+
+  return {
+    enqueue(msgId, seq, url) {
+      if (!pending.has(msgId)) {
+        pending.set(msgId, new Map());
+        order.push(msgId);
+      }
+      pending.get(msgId).set(seq, url);
+      pump();
+    }
+  };
+}
+
 export function setupTTS(ttsButton, messageInput) {
   if (!ttsButton || !messageInput) return;
 
@@ -5,29 +120,19 @@ export function setupTTS(ttsButton, messageInput) {
     const text = messageInput.value.trim();
     if (!text) return alert("Введите текст для озвучки.");
 
-    const payload = {
-      text,
-      speaker: document.getElementById("voice-select")?.value || "aidar",
-      speed: parseFloat(document.getElementById("speed-range")?.value) || 1.0,
-      pitch_semitones: parseFloat(document.getElementById("pitch-range")?.value) || 0,
-      gain_db: parseFloat(document.getElementById("gain-range")?.value) || 0,
-      reverb_time: parseFloat(document.getElementById("reverb-time")?.value) || 0,
-      reverb_decay: parseFloat(document.getElementById("reverb-decay")?.value) || 0
-    };
-
-    // Проверка NaN
-    Object.keys(payload).forEach(key => {
-      if (typeof payload[key] === "number" && isNaN(payload[key])) {
-        payload[key] = 0;
-      }
-    });
+    const payload = { text, ...readVoiceSettings(), stream: true };
 
     try {
-      const resp = await fetch("/tts", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(payload)
-      });
+      // GET-запрос кэшируется браузером и перепроверяется по ETag (304 без тела);
+      // слишком длинный текст не влезет в URL — тогда отправляем POST.
+      const query = new URLSearchParams(payload).toString();
+      const resp = query.length < MAX_GET_QUERY_LENGTH
+        ? await fetch(`/tts?${query}`)
+        : await fetch("/tts", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify(payload)
+          });
 
       if (!resp.ok) {
         const errText = await resp.text();
@@ -39,11 +144,8 @@ export function setupTTS(ttsButton, messageInput) {
         throw new Error(msg);
       }
 
-      const blob = await resp.blob();
-      const audioUrl = URL.createObjectURL(blob);
-      const audio = new Audio(audioUrl);
-      audio.play();
-      audio.onended = () => URL.revokeObjectURL(audioUrl);
+      // Воспроизведение начинается с первого синтезированного предложения
+      await playWavStream(resp);
 
     } catch (err) {
       console.error("TTS Error:", err);
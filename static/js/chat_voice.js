@@ -1,16 +1,123 @@
 // chat_voice.js
-export async function setupVoiceRecorder(recordButton, voiceIcon, messageInput, loadingIndicator, loadingText, playButton) {
+import { readVoiceSettings } from './chat_tts.js';
+
+const STREAM_CHUNK_MS = 250; // как часто MediaRecorder отдает куски в потоковом режиме
+
+export async function setupVoiceRecorder(recordButton, voiceIcon, messageInput, loadingIndicator, loadingText, playButton, selectedChatId = null) {
   let mediaRecorder, audioChunks = [], isRecording = false;
   let lastAudioBlob = null; // для воспроизведения последнего аудио
+  let socket = null;        // WebSocket потокового распознавания (null — режим загрузки)
+  let baseText = "";        // текст поля ввода до начала записи
+  let finals = [];          // окончательно распознанные фразы
+  let partial = "";         // текущая, еще меняющаяся фраза
+  let discardRecording = false; // запись остановлена сервером — не загружать ее заново
+
+  const showTranscript = () => {
+    if (!messageInput) return;
+    const spoken = [...finals, partial].filter(Boolean).join(' ');
+    messageInput.value = baseText + (baseText && spoken ? ' ' : '') + spoken;
+  };
+
+  const finishUi = () => {
+    if (loadingIndicator) loadingIndicator.style.display = 'none';
+    if (voiceIcon) voiceIcon.textContent = '🎤';
+    if (recordButton) recordButton.disabled = false;
+  };
+
+  // --- Потоковый режим: куски записи уходят на сервер по WebSocket ---
+  const openStream = () => {
+    if (!selectedChatId || !window.WebSocket) return null;
+    const proto = location.protocol === 'https:' ? 'wss' : 'ws';
+    const ws = new WebSocket(`${proto}://${location.host}/chats/${selectedChatId}/transcribe_stream`);
+    ws.binaryType = 'arraybuffer';
+    const pending = []; // куски, записанные до открытия соединения
+
+    ws.onopen = () => { pending.splice(0).forEach(chunk => ws.send(chunk)); };
+    ws.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      if (data.type === 'partial') {
+        partial = data.text;
+      } else if (data.type === 'final') {
+        finals.push(data.text);
+        partial = "";
+      } else if (data.type === 'done') {
+        finals = data.text ? [data.text] : [];
+        partial = "";
+        if (ws.autosend) {
+          // Сообщение уже отправлено сервером — возвращаем поле ввода как было
+          if (messageInput) messageInput.value = baseText;
+        } else {
+          showTranscript();
+          if (messageInput) messageInput.focus();
+        }
+        finishUi();
+        return;
+      } else if (data.type === 'limit') {
+        // Сервер дошел до предела длины записи: останавливаем запись, распознанное придет в done
+        if (isRecording) {
+          discardRecording = true;
+          mediaRecorder.stop();
+          recordButton.classList.remove('recording');
+          voiceIcon.textContent = '⚙️';
+          isRecording = false;
+        }
+        alert(data.detail);
+        return;
+      } else if (data.type === 'error') {
+        alert(`Ошибка транскрипции: ${data.detail}`);
+        finishUi();
+        return;
+      }
+      showTranscript();
+    };
+    ws.onclose = () => {
+      // Соединение оборвалось во время записи — запись уйдет обычной загрузкой
+      if (socket === ws) socket = null;
+      if (!isRecording) finishUi();
+    };
+
+    ws.sendChunk = (blob) => {
+      if (ws.readyState === WebSocket.OPEN) ws.send(blob);
+      else if (ws.readyState === WebSocket.CONNECTING) pending.push(blob);
+    };
+    ws.stop = () => {
+      const autosend = document.getElementById('voice-autosend');
+      ws.autosend = !!(autosend && autosend.checked);
+      const command = { type: 'stop', send: ws.autosend };
+      const voiceMode = document.getElementById('voice-mode');
+      if (ws.autosend && voiceMode && voiceMode.checked) {
+        command.voice = true;
+        command.voice_params = readVoiceSettings();
+      }
+      const send = () => ws.send(JSON.stringify(command));
+      if (ws.readyState === WebSocket.OPEN) send();
+      else ws.addEventListener('open', send, { once: true });
+    };
+    return ws;
+  };
 
   // --- Функция загрузки аудио на сервер ---
   const uploadAudio = async () => {
+    if (discardRecording) {
+      discardRecording = false;
+      audioChunks = [];
+      return;
+    }
     if (!audioChunks.length) return;
 
     const audioBlob = new Blob(audioChunks, { type: mediaRecorder.mimeType });
     lastAudioBlob = audioBlob; // сохраняем для прослушивания
     audioChunks = [];
 
+    if (socket) {
+      // Потоковый режим: дорабатывается только хвост после последнего куска
+      if (loadingText) loadingText.textContent = 'Завершение распознавания...';
+      if (loadingIndicator) loadingIndicator.style.display = 'flex';
+      if (recordButton) recordButton.disabled = true;
+      socket.stop();
+      return;
+    }
+
     if (loadingText) loadingText.textContent = 'Обработка аудио локальной моделью...';
     if (loadingIndicator) loadingIndicator.style.display = 'flex';
     if (recordButton) recordButton.disabled = true;
@@ -40,8 +147,7 @@ export async function setupVoiceRecorder(recordButton, voiceIcon, messageInput,
       console.error('Error uploading audio', err);
       alert("Ошибка сети или сервера при отправке аудио.");
     } finally {
-      if (voiceIcon) voiceIcon.textContent = '🎤';
-      if (recordButton) recordButton.disabled = false;
+      finishUi();
     }
   };
 
@@ -49,7 +155,12 @@ export async function setupVoiceRecorder(recordButton, voiceIcon, messageInput,
   try {
     const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
     mediaRecorder = new MediaRecorder(stream, { mimeType: 'audio/webm' });
-    mediaRecorder.ondataavailable = e => { if (e.data.size > 0) audioChunks.push(e.data); };
+    mediaRecorder.ondataavailable = e => {
+      if (e.data.size > 0) {
+        audioChunks.push(e.data);
+        if (socket) socket.sendChunk(e.data);
+      }
+    };
     mediaRecorder.onstop = uploadAudio;
 
     if (recordButton) recordButton.disabled = false;
@@ -73,7 +184,13 @@ export async function setupVoiceRecorder(recordButton, voiceIcon, messageInput,
         isRecording = false;
       } else {
         audioChunks = [];
-        mediaRecorder.start();
+        baseText = messageInput ? messageInput.value.trim() : "";
+        finals = [];
+        partial = "";
+        socket = openStream();
+        // В потоковом режиме запись режется на куски, которые сразу уходят на сервер
+        if (socket) mediaRecorder.start(STREAM_CHUNK_MS);
+        else mediaRecorder.start();
         recordButton.classList.add('recording');
         voiceIcon.textContent = '🔴';
         isRecording = true;
@@ -0,0 +1,35 @@
+# tests/conftest.py
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Движок db.py создается при импорте — база тестов задается до него
+_DB_DIR = tempfile.mkdtemp(prefix="voice-chat-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_DB_DIR, 'test.db')}"
+
+
+@pytest.fixture
+def run():
+    """Выполняет корутину на чистой базе (схема через init_db, как при старте приложения)."""
+    from db import engine, init_db
+    from models import Base
+
+    async def on_clean_db(coro):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.exec_driver_sql("DROP TABLE IF EXISTS messages_fts")
+            await conn.exec_driver_sql("PRAGMA user_version = 0")
+        await init_db()
+        try:
+            return await coro
+        finally:
+            # Соединения пула привязаны к циклу событий, который закроет asyncio.run
+            await engine.dispose()
+
+    return lambda coro: asyncio.run(on_clean_db(coro))
@@ -0,0 +1,110 @@
+# tests/test_message_search.py
+from db import async_session
+from models import Chat, Message, MessageStatus, MessageType, User
+from repositories.message_repo import MessageRepository, decode_search_cursor, encode_search_cursor
+
+
+async def seed() -> dict:
+    """Два пользователя; у первого два чата, у второго один. Все сообщения про книги."""
+    async with async_session() as session:
+        alice, bob = User(username="alice"), User(username="bob")
+        session.add_all([alice, bob])
+        await session.flush()
+        chats = {
+            "alice_1": Chat(title="Чтение", user_id=alice.id),
+            "alice_2": Chat(title="Разное", user_id=alice.id),
+            "bob_1": Chat(title="Чужой", user_id=bob.id),
+        }
+        session.add_all(chats.values())
+        await session.flush()
+        texts = {
+            "alice_1": ["Какую книгу почитать?", "Советую книги Чехова", "Ёлка на обложке книги"],
+            "alice_2": ["Купил две книги", "Погода сегодня хорошая"],
+            "bob_1": ["Моя любимая книга", "Книгами заставлена комната"],
+        }
+        for key, contents in texts.items():
+            for content in contents:
+                session.add(Message(chat_id=chats[key].id, content=content, message_type=MessageType.USER))
+        await session.commit()
+        return {"alice": alice.id, "bob": bob.id, **{key: chat.id for key, chat in chats.items()}}
+
+
+async def search(user_id, query, **kwargs):
+    async with async_session() as session:
+        return await MessageRepository(session).search_messages(user_id, query, **kwargs)
+
+
+def test_search_is_scoped_to_user_chats(run):
+    async def scenario():
+        ids = await seed()
+        rows, _ = await search(ids["alice"], "книгами")
+        assert {row.chat_id for row in rows} == {ids["alice_1"], ids["alice_2"]}
+        assert len(rows) == 4
+        rows, _ = await search(ids["bob"], "книга")
+        assert {row.chat_id for row in rows} == {ids["bob_1"]}
+        assert len(rows) == 2
+
+    run(scenario())
+
+
+def test_search_in_one_chat(run):
+    async def scenario():
+        ids = await seed()
+        rows, _ = await search(ids["alice"], "книги", chat_id=ids["alice_2"])
+        assert [row.content for row in rows] == ["Купил две книги"]
+        # Чужой чат ничего не находит, даже если совпадения там есть
+        rows, _ = await search(ids["alice"], "книги", chat_id=ids["bob_1"])
+        assert rows == []
+
+    run(scenario())
+
+
+def test_search_folds_yo_and_requires_all_words(run):
+    async def scenario():
+        ids = await seed()
+        rows, _ = await search(ids["alice"], "елка")
+        assert [row.content for row in rows] == ["Ёлка на обложке книги"]
+        rows, _ = await search(ids["alice"], "книги погода")
+        assert rows == []
+
+    run(scenario())
+
+
+def test_search_pages_by_cursor(run):
+    async def scenario():
+        ids = await seed()
+        everything, cursor = await search(ids["alice"], "книга", limit=10)
+        assert cursor is None
+        ranks = [(row.rank, row.id) for row in everything]
+        assert ranks == sorted(ranks)
+
+        seen, cursor = [], None
+        while True:
+            rows, cursor = await search(ids["alice"], "книга", limit=1, after=cursor)
+            seen.extend(row.id for row in rows)
+            if cursor is None:
+                break
+            # Курсор проходит через API строкой
+            cursor = decode_search_cursor(encode_search_cursor(cursor))
+        assert seen == [row.id for row in everything]
+
+    run(scenario())
+
+
+def test_streaming_answer_is_indexed_when_finished(run):
+    async def scenario():
+        ids = await seed()
+        async with async_session() as session:
+            answer = Message(chat_id=ids["alice_2"], content="Про библиотеку", message_type=MessageType.MODEL,
+                             status=MessageStatus.STREAMING)
+            session.add(answer)
+            await session.commit()
+            assert (await search(ids["alice"], "библиотека"))[0] == []
+
+            answer.content = "Про библиотеку и журналы"
+            answer.status = MessageStatus.COMPLETE
+            await session.commit()
+        rows, _ = await search(ids["alice"], "библиотека")
+        assert [row.id for row in rows] == [answer.id]
+
+    run(scenario())
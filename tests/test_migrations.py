@@ -0,0 +1,78 @@
+# tests/test_migrations.py
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from db import MIGRATIONS, _apply_migrations
+from models import Base
+
+
+class _WithoutFts5:
+    """Соединение как у SQLite, собранного без FTS5."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def exec_driver_sql(self, statement, *args):
+        if "USING fts5" in statement:
+            raise OperationalError(statement, None, Exception("no such module: fts5"))
+        return self._conn.exec_driver_sql(statement, *args)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        conn.exec_driver_sql("INSERT INTO users (id, username) VALUES (1, 'alice')")
+        conn.exec_driver_sql("INSERT INTO chats (id, title, created_at, user_id) VALUES (1, 'Чат', '2024-01-01', 1)")
+        conn.exec_driver_sql(
+            "INSERT INTO messages (content, message_type, status, created_at, chat_id) "
+            "VALUES ('Советую книги Чехова', 'USER', 'COMPLETE', '2024-01-01', 1)"
+        )
+    yield engine
+    engine.dispose()
+
+
+def user_version(conn) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def has_search_index(conn) -> bool:
+    return conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").scalar() is not None
+
+
+def indexed(conn, word: str) -> int:
+    return conn.exec_driver_sql(f"SELECT count(*) FROM messages_fts WHERE messages_fts MATCH '{word}'").scalar()
+
+
+def test_search_migration_is_retried_when_fts5_appears(engine):
+    with engine.begin() as conn:
+        _apply_migrations(_WithoutFts5(conn))
+        assert user_version(conn) == len(MIGRATIONS) - 1
+        assert not has_search_index(conn)
+
+    with engine.begin() as conn:
+        _apply_migrations(conn)
+        assert user_version(conn) == len(MIGRATIONS)
+        # Сообщения, написанные до появления индекса, тоже находятся
+        assert indexed(conn, "книги") == 1
+
+
+def test_missing_search_index_is_created_at_current_version(engine):
+    # База, которая раньше дошла до версии 4 без FTS5
+    with engine.begin() as conn:
+        _apply_migrations(conn)
+        conn.exec_driver_sql("DROP TABLE messages_fts")
+        for trigger in ("messages_fts_ai", "messages_fts_ad", "messages_fts_au"):
+            conn.exec_driver_sql(f"DROP TRIGGER {trigger}")
+
+    with engine.begin() as conn:
+        _apply_migrations(conn)
+        assert user_version(conn) == len(MIGRATIONS)
+        assert indexed(conn, "книги") == 1
+        conn.exec_driver_sql(
+            "INSERT INTO messages (content, message_type, status, created_at, chat_id) "
+            "VALUES ('Еще одна книга', 'USER', 'COMPLETE', '2024-01-02', 1)"
+        )
+        assert indexed(conn, "книга") == 1